@@ -1,7 +1,9 @@
 # app.py (copy-paste ready)
-from flask import Flask, render_template, request, redirect, session
+import time
+STARTUP_T0 = time.perf_counter()
+
+from flask import Flask, Response, render_template, request, redirect, session
 from werkzeug.exceptions import HTTPException
-from supabase import create_client, Client
 from datetime import datetime, timedelta
 import secrets
 import os
@@ -11,6 +13,28 @@ import requests
 import subprocess
 import tempfile
 import json
+import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cachetools import TTLCache
+
+from inference_pool import get_pool, InferenceError, INFER_WORKERS
+from result_cache import ResultCache, content_hash
+from jobs import JobManager, QueueFull, public_view
+from inference_backends import resolve_model_path
+from thumbnails import ThumbnailQueue, ThumbnailRegistry
+from image_hash import HashIndex, fingerprint
+from http_cache import VersionMarkers, conditional
+from identity_cache import IdentityCache
+from device_tokens import DeviceTokens, TokenError, TokenUnavailable
+from mission_push import MissionBroadcaster, stream_missions
+from mission_index import MissionIndex
+import transport
+from transport import CircuitOpen, execute, guarded, http_get
+from upload_spool import (
+    UploadSessions, UploadTooLarge, OffsetMismatch, spool_to_tempfile, UPLOAD_MAX_BYTES,
+)
 
 # =========================
 # SUPABASE SETTINGS
@@ -23,16 +47,84 @@ MISSION_BUCKET = os.getenv("SUPABASE_MISSION_BUCKET", "mission_transmission")
 
 PAIR_EXP_MINUTES = 10
 
+# "required": device routes only accept a Bearer device token, not a raw user_id
+DEVICE_AUTH = os.getenv("DEVICE_AUTH", "optional")
+
+# /device/missions/wait holds a request open; run gunicorn with threads
+# (-k gthread --threads N) so waiting devices don't occupy whole workers
+MISSION_WAIT_SECONDS = float(os.getenv("MISSION_WAIT_SECONDS", "25"))
+MISSION_WAIT_MAX_SECONDS = float(os.getenv("MISSION_WAIT_MAX_SECONDS", "55"))
+MISSION_WAIT_MAX_WAITERS = int(os.getenv("MISSION_WAIT_MAX_WAITERS", "200"))
+
+UPLOAD_BATCH_WORKERS = int(os.getenv("UPLOAD_BATCH_WORKERS", "4"))
+UPLOAD_BATCH_MAX_FILES = int(os.getenv("UPLOAD_BATCH_MAX_FILES", "100"))
+UPLOAD_BATCH_MAX_BYTES = int(os.getenv("UPLOAD_BATCH_MAX_BYTES", str(200 * 1024 * 1024)))   # whole request
+
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "30"))
+HISTORY_PAGE_MAX = int(os.getenv("HISTORY_PAGE_MAX", "100"))
+HISTORY_HEAD_TTL = float(os.getenv("HISTORY_HEAD_TTL", "10"))   # seconds a user's newest requestImages row is trusted
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 TF_PYTHON = os.getenv("TF_PYTHON", os.path.join(BASE_DIR, ".venv_tf", "Scripts", "python.exe"))
 MODEL_PATH = os.getenv("MODEL_PATH", os.path.join(BASE_DIR, "models", "CROP_MODEL.h5"))
 MODEL_INPUT_SIZE = os.getenv("MODEL_INPUT_SIZE", "224,224")
+INFER_TILED = os.getenv("INFER_TILED", "0") == "1"
+# /analysis/jobs/<id>/events holds a request open for a whole analysis; only turn it
+# on with threaded/async workers (gunicorn -k gthread or gevent). Browsers poll otherwise.
+ANALYSIS_JOB_SSE = os.getenv("ANALYSIS_JOB_SSE", "0") == "1"
+ANALYSIS_JOB_MAX_IMAGES = int(os.getenv("ANALYSIS_JOB_MAX_IMAGES", "50"))   # image ids per submit
+
+# Startup timings, served at /healthz
+startup_metrics = {}
+
+# Importing supabase pulls in httpx/realtime/storage clients, so the client is built
+# on first use instead of at import; workers that only serve pages stay light
+_supabase_client = None
+_supabase_lock = threading.Lock()
+
+
+def get_supabase():
+    global _supabase_client
+    if _supabase_client is None:
+        with _supabase_lock:
+            if _supabase_client is None:
+                t0 = time.perf_counter()
+                from supabase import create_client
+                _supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY, options=transport.supabase_options())
+                startup_metrics["supabase_init_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return _supabase_client
+
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+class _LazySupabase:
+    def __getattr__(self, name):
+        return getattr(get_supabase(), name)
+
+
+supabase = _LazySupabase()
+
+# Fingerprint the file the configured backend really loads (.h5 or .tflite)
+result_cache = ResultCache(resolve_model_path(MODEL_PATH), MODEL_INPUT_SIZE)
+analysis_jobs = JobManager()
+upload_sessions = UploadSessions()
+hash_index = HashIndex(supabase)
+# ETag version markers, bumped by every write that changes a cached GET (see http_cache.py)
+http_versions = VersionMarkers()
+thumbnail_registry = ThumbnailRegistry(supabase)
+
+
+def thumbnail_stored(original_path, written):
+    thumbnail_registry.record(original_path, written)
+    # Device uploads are stored under <user_id>/...; their history pages now get thumb URLs
+    http_versions.bump(f"history:{original_path.split('/', 1)[0]}")
+
+
+thumbnail_queue = ThumbnailQueue(lambda: supabase.storage.from_(IMAGE_BUCKET), on_stored=thumbnail_stored)
 
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "dev_secret_change_me")
+# Reject oversized bodies before they are read (+1 MB for multipart framing)
+app.config["MAX_CONTENT_LENGTH"] = UPLOAD_MAX_BYTES + 1024 * 1024
 
 
 # =========================
@@ -42,6 +134,9 @@ app.secret_key = os.getenv("FLASK_SECRET_KEY", "dev_secret_change_me")
 def handle_exception(e):
     if isinstance(e, HTTPException):
         return e
+    if isinstance(e, CircuitOpen):
+        # Backend is known to be down: answer now instead of tying up a worker
+        return {"error": str(e)}, 503, {"Retry-After": str(e.retry_after)}
     print("UNHANDLED EXCEPTION:", e)
     traceback.print_exc()
     return {"error": "server exception", "detail": str(e)}, 500
@@ -78,6 +173,7 @@ def register():
         }).execute()
 
         if response.data is not None:
+            identity_cache.remember(user_id)
             return redirect("/login")
         return f"Supabase insert error: {response.error}"
 
@@ -209,8 +305,7 @@ def device_connect_user():
     if not user_id:
         return {"error": "user_id required"}, 400
 
-    u = supabase.table("userAccounts").select("user_id").eq("user_id", user_id).execute()
-    if not u.data:
+    if not user_exists(user_id):
         return {"error": "user_id not found"}, 404
 
     device_id = str(uuid.uuid4())
@@ -226,57 +321,437 @@ def device_connect_user():
         return {"error": f"create request failed: {req.error}"}, 500
 
     row = req.data[0]
-    return {"message": "paired", "request_id": row["id"], "device_id": device_id}
+    # Without DEVICE_TOKEN_SECRET the device pairs by user_id only (no token issued)
+    tokens = device_tokens.issue(user_id, device_id) if device_tokens.enabled else {}
+    return {"message": "paired", "request_id": row["id"], "device_id": device_id, **tokens}
+
+
+@app.route("/device/token/refresh", methods=["POST"])
+def device_token_refresh():
+    payload = request.get_json(silent=True) or {}
+    refresh_token = payload.get("refresh_token")
+    if not refresh_token:
+        return {"error": "refresh_token required"}, 400
+    try:
+        return device_tokens.refresh(refresh_token)
+    except TokenUnavailable as e:
+        return {"error": str(e)}, 503, {"Retry-After": "5"}
+    except TokenError as e:
+        return {"error": str(e)}, 401
+
+
+@app.route("/device/token/revoke", methods=["POST"])
+def device_token_revoke():
+    """
+    Logged-in user:  {"device_id": "..."}  revokes every token of one of their devices.
+    Device:          Authorization: Bearer <token>  revokes its own device.
+    """
+    payload = request.get_json(silent=True) or {}
+    device_id = payload.get("device_id")
+
+    if "user_id" in session:
+        if not device_id:
+            return {"error": "device_id required"}, 400
+        owned = execute(
+            supabase.table("deviceRequests")
+            .select("id")
+            .eq("requested_by", session["user_id"])
+            .eq("paired_device_id", device_id)
+            .limit(1)
+        )
+        if not owned.data:
+            return {"error": "device not found"}, 404
+    else:
+        _, token_device, err = device_identity()
+        if err:
+            return err
+        if not token_device or (device_id and device_id != token_device):
+            return {"error": "forbidden"}, 403
+        device_id = token_device
+
+    device_tokens.revoke(device_id=device_id)
+    return {"message": "revoked", "device_id": device_id}
 
 
 # =========================
 # DEVICE -> WEBSITE IMAGE UPLOAD
 # =========================
 
-@app.route("/device/upload", methods=["POST"])
-def device_upload():
-
-    user_id = request.form.get("user_id")
+def device_storage_path(user_id, original_name, unique=False):
     date_today = datetime.utcnow().strftime("%Y%m%d")
-    file = request.files.get("image")
-
-    if not user_id or not file:
-        return {"error": "request_id and image file required"}, 400
 
-    resp = supabase.table("userAccounts").select("*").eq("user_id", user_id).execute() #Checks if user actually exists
-    if not resp.data:
-        return {"error": "invalid request_id"}, 404
-
-    original_name = file.filename or "image"
     ext = ""
     if "." in original_name:
         ext = "." + original_name.rsplit(".", 1)[1].lower()
 
     file_name = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
-    storage_path = f"{user_id}/{date_today}/{file_name}{ext}"
+    if unique:
+        # Batches land within the same second; keep their names apart
+        file_name += f"-{uuid.uuid4().hex[:8]}"
+    return f"{user_id}/{date_today}/{file_name}{ext}"
 
-    file_bytes = file.read()
-    content_type = file.mimetype or "application/octet-stream"
 
+def upload_spooled(storage_path, src_path, content_type):
+    """Stream a spooled file from disk to IMAGE_BUCKET. Returns an error string or None."""
     storage = supabase.storage.from_(IMAGE_BUCKET)
-    up = storage.upload(
-        path=storage_path,
-        file=file_bytes,
-        file_options={"content-type": content_type}
-    )
+    with open(src_path, "rb") as f:
+        # Behind the storage breaker, but not retried: the stream is half consumed
+        up = guarded(lambda: storage.upload(
+            path=storage_path,
+            file=f,
+            file_options={"content-type": content_type}
+        ), breaker=transport.STORAGE)
 
     if isinstance(up, dict) and up.get("error"):
-        return {"error": up["error"]}, 500
+        return up["error"]
+    return None
 
-    ins = supabase.table("imageReceived").insert({
-        "requested_by": user_id,
-        "uploaded_at": storage_path
-    }).execute()
 
-    if not ins.data:
-        return {"error": f"metadata insert failed: {ins.error}"}, 500
+def remove_uploaded(storage_paths):
+    """Best effort: delete bucket objects whose imageReceived row was never written."""
+    if not storage_paths:
+        return
+    try:
+        guarded(lambda: supabase.storage.from_(IMAGE_BUCKET).remove(storage_paths), breaker=transport.STORAGE)
+    except Exception as e:
+        print("ORPHANED UPLOAD CLEANUP FAILED:", storage_paths, e)
+
+
+def check_duplicate(user_id, src_path):
+    """
+    Hash a spooled upload and look it up in the user's hash index.
+    Returns (hashes, match): match has "duplicate_of" or "near_duplicate_of" when found.
+    Hashing / index trouble never blocks an upload.
+    """
+    try:
+        hashes = fingerprint(src_path)
+        return hashes, hash_index.check(user_id, hashes[0], hashes[1])
+    except Exception as e:
+        print("HASH CHECK FAILED:", e)
+        return None, {}
+
+
+def record_hashes(rows):
+    try:
+        hash_index.add_many([r for r in rows if r])
+    except Exception as e:
+        print("HASH INDEX WRITE FAILED:", e)
+
+
+def store_device_image(user_id, src_path, original_name, content_type):
+    """
+    Upload a spooled file and record it in imageReceived.
+    Byte-identical re-sends short-circuit to the existing image_path;
+    perceptual near-duplicates are stored but flagged.
+    Returns: (response_dict, status)
+    """
+    hashes, match = check_duplicate(user_id, src_path)
+    if match.get("duplicate_of"):
+        return {"message": "duplicate", "requested_by": user_id,
+                "image_path": match["duplicate_of"], "duplicate": True}, 200
+
+    storage_path = device_storage_path(user_id, original_name)
+
+    err = upload_spooled(storage_path, src_path, content_type)
+    if err:
+        return {"error": err}, 500
+
+    try:
+        ins = supabase.table("imageReceived").insert({
+            "requested_by": user_id,
+            "uploaded_at": storage_path
+        }).execute()
+        insert_error = None if ins.data else ins.error
+    except Exception as e:
+        insert_error = e
+
+    if insert_error is not None:
+        remove_uploaded([storage_path])
+        return {"error": f"metadata insert failed: {insert_error}"}, 500
+
+    http_versions.bump(f"history:{user_id}")
+    near = match.get("near_duplicate_of")
+    if hashes:
+        record_hashes([hash_index.row(user_id, storage_path, *hashes, near_duplicate_of=near)])
+
+    body = {"message": "uploaded", "requested_by": user_id, "image_path": storage_path}
+    if near:
+        body["near_duplicate_of"] = near
+    return body, 200
+
+
+def lookup_user(user_id):
+    resp = execute(supabase.table("userAccounts").select("user_id").eq("user_id", user_id))
+    return bool(resp.data)
+
+
+# Devices send user_id with every image and poll; answer from memory (see identity_cache.py)
+identity_cache = IdentityCache(lookup_user)
+
+
+def user_exists(user_id):
+    return identity_cache.exists(user_id)
+
+
+device_tokens = DeviceTokens(supabase)
+if not device_tokens.enabled:
+    app.logger.warning("device tokens disabled: set DEVICE_TOKEN_SECRET (or FLASK_SECRET_KEY)")
+
+
+def device_identity(claimed_user_id=None):
+    """
+    Who is calling a device route. Returns (user_id, device_id, None) or (None, None, error_response).
+    A Bearer token is verified locally (signature, expiry, revocation list); without one,
+    and unless DEVICE_AUTH=required, the raw user_id is checked as before (device_id None).
+    """
+    auth = request.headers.get("Authorization", "")
+    if auth.startswith("Bearer "):
+        try:
+            claims = device_tokens.verify(auth[7:].strip())
+        except TokenUnavailable as e:
+            return None, None, ({"error": str(e)}, 503, {"Retry-After": "5"})
+        except TokenError as e:
+            return None, None, ({"error": str(e)}, 401)
+        if claimed_user_id and claimed_user_id != claims["sub"]:
+            return None, None, ({"error": "forbidden"}, 403)
+        return claims["sub"], claims["did"], None
+
+    if DEVICE_AUTH == "required":
+        return None, None, ({"error": "device token required"}, 401, {"WWW-Authenticate": "Bearer"})
+    if not claimed_user_id:
+        return None, None, ({"error": "user_id or device token required"}, 400)
+    if not user_exists(claimed_user_id):
+        return None, None, ({"error": "invalid user_id"}, 404)
+    return claimed_user_id, None, None
+
+
+@app.route("/device/upload", methods=["POST"])
+def device_upload():
 
-    return {"message": "uploaded", "requested_by": user_id, "image_path": storage_path}
+    user_id, _, err = device_identity(request.form.get("user_id"))
+    if err:
+        return err
+
+    file = request.files.get("image")
+    if not file:
+        return {"error": "image file required"}, 400
+
+    original_name = file.filename or "image"
+    content_type = file.mimetype or "application/octet-stream"
+
+    # Copy to disk in UPLOAD_CHUNK_BYTES pieces instead of file.read()
+    try:
+        spool_path, _ = spool_to_tempfile(file.stream)
+    except UploadTooLarge as e:
+        return {"error": str(e)}, 413
+
+    try:
+        body, status = store_device_image(user_id, spool_path, original_name, content_type)
+    except Exception:
+        os.remove(spool_path)
+        raise
+
+    if status == 200 and not body.get("duplicate"):
+        thumbnail_queue.schedule(body["image_path"], spool_path)  # the queue deletes the spool file
+    else:
+        os.remove(spool_path)
+    return body, status
+
+
+@app.route("/device/upload/batch", methods=["POST"])
+def device_upload_batch():
+    """
+    Many images in one multipart request (field name "images", repeated) + user_id.
+    The user is validated once, files go to storage UPLOAD_BATCH_WORKERS at a time,
+    and all imageReceived rows are written in one bulk insert.
+    Returns a per-file result list in upload order.
+    """
+    # The whole batch is capped at UPLOAD_BATCH_MAX_BYTES; each file is still capped at UPLOAD_MAX_BYTES below
+    if request.content_length is not None and request.content_length > UPLOAD_BATCH_MAX_BYTES:
+        return {"error": f"batch exceeds {UPLOAD_BATCH_MAX_BYTES} bytes"}, 413
+    request.max_content_length = UPLOAD_BATCH_MAX_BYTES
+
+    user_id = request.form.get("user_id")
+    files = request.files.getlist("images") or request.files.getlist("image")
+
+    if not files:
+        return {"error": "images required"}, 400
+    if len(files) > UPLOAD_BATCH_MAX_FILES:
+        return {"error": f"at most {UPLOAD_BATCH_MAX_FILES} images per batch"}, 413
+
+    user_id, _, err = device_identity(user_id)
+    if err:
+        return err
+
+    batch_shas = {}
+    batch_lock = threading.Lock()
+
+    def upload_one(file):
+        original_name = file.filename or "image"
+        result = {"filename": original_name}
+        try:
+            spool_path, _ = spool_to_tempfile(file.stream)
+        except UploadTooLarge as e:
+            return {**result, "status": "failed", "error": str(e)}
+
+        hashes, match = check_duplicate(user_id, spool_path)
+        if match.get("duplicate_of"):
+            os.remove(spool_path)
+            return {**result, "status": "duplicate", "image_path": match["duplicate_of"]}
+
+        if hashes:
+            # The same photo twice in one batch isn't in the index yet
+            with batch_lock:
+                first = batch_shas.setdefault(hashes[0], file)
+            if first is not file:
+                os.remove(spool_path)
+                return {**result, "status": "duplicate", "duplicate_of_filename": first.filename}
+
+        result["_hashes"] = hashes
+        result["_spool"] = spool_path
+        if match.get("near_duplicate_of"):
+            result["near_duplicate_of"] = match["near_duplicate_of"]
+
+        try:
+            storage_path = device_storage_path(user_id, original_name, unique=True)
+            err = upload_spooled(storage_path, spool_path, file.mimetype or "application/octet-stream")
+        except Exception as e:
+            err = str(e)
+
+        if err:
+            os.remove(spool_path)
+            result.pop("_spool")
+            return {**result, "status": "failed", "error": err}
+        return {**result, "status": "uploaded", "image_path": storage_path}
+
+    with ThreadPoolExecutor(max_workers=UPLOAD_BATCH_WORKERS) as ex:
+        results = list(ex.map(upload_one, files))
+
+    # Thumbnails and hash rows only for images that made it into imageReceived;
+    # if the bulk insert fails, the uploaded objects are removed again
+    stored = [r for r in results if r["status"] == "uploaded"]
+    if stored:
+        try:
+            ins = supabase.table("imageReceived").insert(
+                [{"requested_by": user_id, "uploaded_at": r["image_path"]} for r in stored]
+            ).execute()
+            insert_error = None if ins.data else ins.error
+        except Exception as e:
+            insert_error = e
+
+        if insert_error is not None:
+            remove_uploaded([r["image_path"] for r in stored])
+            for r in stored:
+                os.remove(r["_spool"])
+                r.update(status="failed", error=f"metadata insert failed: {insert_error}")
+        else:
+            http_versions.bump(f"history:{user_id}")
+            for r in stored:
+                thumbnail_queue.schedule(r["image_path"], r["_spool"])
+            record_hashes([
+                hash_index.row(user_id, r["image_path"], *r["_hashes"], near_duplicate_of=r.get("near_duplicate_of"))
+                for r in stored if r.get("_hashes")
+            ])
+    for r in results:
+        r.pop("_hashes", None)
+        r.pop("_spool", None)
+
+    uploaded = sum(1 for r in results if r["status"] == "uploaded")
+    failed = sum(1 for r in results if r["status"] == "failed")
+    status = 200 if not failed else (207 if failed < len(results) else 500)
+    return {"requested_by": user_id, "uploaded": uploaded, "failed": failed,
+            "duplicates": len(results) - uploaded - failed, "results": results}, status
+
+
+# Resumable uploads for flaky field links:
+#   POST  /device/upload/sessions        {"user_id", "filename", "size", "content_type"}
+#   HEAD  /device/upload/sessions/<id>   -> Upload-Offset header (where to resume)
+#   GET   /device/upload/sessions/<id>   -> same, as JSON
+#   PATCH /device/upload/sessions/<id>   Upload-Offset: <n>, raw chunk as the body
+# The PATCH that completes the file stores it and returns image_path.
+# HEAD/GET/PATCH authenticate like every device route (Bearer token, or ?user_id=
+# where allowed) and only see sessions created by the same user; others get 404.
+
+@app.route("/device/upload/sessions", methods=["POST"])
+def device_upload_session_create():
+    payload = request.get_json(silent=True) or {}
+    size = payload.get("size")
+
+    if not isinstance(size, int) or size <= 0:
+        return {"error": "size required"}, 400
+
+    user_id, _, err = device_identity(payload.get("user_id"))
+    if err:
+        return err
+
+    try:
+        status = upload_sessions.create(
+            user_id,
+            payload.get("filename") or "image",
+            size,
+            payload.get("content_type") or "application/octet-stream",
+        )
+    except UploadTooLarge as e:
+        return {"error": str(e)}, 413
+
+    return status, 201
+
+
+def owned_upload_session(upload_id):
+    """(meta, None) for the caller's own session, else (None, error_response)."""
+    user_id, _, err = device_identity(request.args.get("user_id"))
+    if err:
+        return None, err
+    meta = upload_sessions.get(upload_id)
+    if not meta or meta["user_id"] != user_id:
+        return None, ({"error": "upload session not found"}, 404)
+    return meta, None
+
+
+@app.route("/device/upload/sessions/<upload_id>", methods=["GET", "HEAD"])
+def device_upload_session_status(upload_id):
+    _, err = owned_upload_session(upload_id)
+    if err:
+        return err
+    status = upload_sessions.status(upload_id)
+    if not status:
+        return {"error": "upload session not found"}, 404
+    headers = {"Upload-Offset": str(status["offset"]), "Upload-Length": str(status["size"])}
+    return status, 200, headers
+
+
+@app.route("/device/upload/sessions/<upload_id>", methods=["PATCH"])
+def device_upload_session_append(upload_id):
+    meta, err = owned_upload_session(upload_id)
+    if err:
+        return err
+
+    try:
+        offset = int(request.headers.get("Upload-Offset", ""))
+    except ValueError:
+        return {"error": "Upload-Offset header required"}, 400
+
+    try:
+        new_offset = upload_sessions.append(upload_id, offset, request.stream)
+    except OffsetMismatch as e:
+        return {"error": str(e), "offset": e.expected}, 409, {"Upload-Offset": str(e.expected)}
+    except UploadTooLarge as e:
+        return {"error": str(e)}, 413
+
+    if new_offset < meta["size"]:
+        return {"upload_id": upload_id, "offset": new_offset, "complete": False}, 200, {"Upload-Offset": str(new_offset)}
+
+    body, status = store_device_image(
+        meta["user_id"], upload_sessions.data_path(upload_id), meta["filename"], meta["content_type"]
+    )
+    if status == 200 and not body.get("duplicate"):
+        # Hand the assembled file to the thumbnail queue before dropping the session
+        thumb_src = upload_sessions.data_path(upload_id) + ".thumb"
+        os.replace(upload_sessions.data_path(upload_id), thumb_src)
+        thumbnail_queue.schedule(body["image_path"], thumb_src)
+    if status == 200:
+        upload_sessions.discard(upload_id)
+    return body, status
 
 
 # =========================
@@ -322,6 +797,15 @@ def mission_upload():
         file_options={"content-type": "application/json"}
     )   
 
+    mission_index.apply(user_id, add=[current_date])   # also bumps the missions:<user> marker
+    # Streams in this worker get it now, JSON inline; other workers see the bump
+    mission_broadcaster.publish(user_id, current_date, {
+        "requested_by": user_id,
+        "mission_id": current_date,
+        "status": "pending",
+        "mission": payload,
+    })
+
     return {
         "message": "Mission has been queued",
         "requested_by": user_id,
@@ -339,49 +823,87 @@ def device_mission_poll():
     if not request_id or not device_id:
         return {"error": "request_id and device_id required"}, 400
 
-    
-    # Get newest pending mission
-    m = (
-        supabase.table("userMissions")
-        .select("requested_by, requested_at, status")
-        .eq("requested_by", request_id)
-        .eq("status", "pending")
-        .order("requested_at", desc=True)
-        .limit(1)
-        .execute()
-    )
+    user_id, _, err = device_identity(request_id)
+    if err:
+        return err
 
-    if not m.data:
+    # Get newest pending mission and mark it delivered (same as /device/missions/claim)
+    body = claim_pending_mission(user_id, device_id)
+    if not body:
         return {"mission": None}
+    if body.get("error"):
+        return body, 502
 
-    row = m.data[0]
+    return {"mission_id": body["mission_id"], "mission": body["mission"], "created_at": body["mission_id"]}
 
-    latest = (
-    supabase.table("userMissions")
-    .select("requested_at")
-    .eq("requested_by", user_id)
-    .eq("status", "pending")
-    .order("requested_at", desc=True)
-    .limit(1)
-    .execute()
-    )
 
-    if not latest.data:
-        return {"error": "No pending missions found"}, 404
+# =========================
+# HISTORY + ANALYSIS
+# =========================
+def encode_cursor(row):
+    raw = json.dumps([row["uploaded_at"], row["id"]], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
 
-    latest_requested_at = latest.data[0]["requested_at"]
+def decode_cursor(cursor):
+    """Opaque page cursor -> (uploaded_at, id). Raises ValueError if it was tampered with."""
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    uploaded_at, image_id = json.loads(raw)
+    if not isinstance(uploaded_at, str):
+        raise ValueError("bad cursor")
+    parse_iso(uploaded_at)
+    # Both values end up inside a PostgREST or_() filter: only an int or a UUID id is accepted
+    if isinstance(image_id, str):
+        image_id = str(uuid.UUID(image_id))
+    elif not isinstance(image_id, int) or isinstance(image_id, bool):
+        raise ValueError("bad cursor")
+    return uploaded_at, image_id
 
-    # Mark delivered
-    supabase.table("userMissions").update({
-        "status": "delivered",
-    }).eq(["requested_by", request_id]).eq("requested_at", latest_requested_at).execute()
 
-    return {"mission_id": row["id"], "mission": row["mission"], "created_at": row.get("created_at")}
+def parse_iso(value):
+    # fromisoformat() doesn't take a trailing "Z" before 3.11
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
 
 
-# =========================
-# HISTORY + ANALYSIS
-# =========================
+_history_heads = TTLCache(maxsize=4096, ttl=HISTORY_HEAD_TTL)
+_history_heads_lock = threading.Lock()
+
+
+def remember_history_head(user_id, head):
+    with _history_heads_lock:
+        _history_heads[user_id] = head
+
+
+def history_head(user_id):
+    """
+    (uploaded_at, id) of the user's newest requestImages row, or None.
+    Cached for HISTORY_HEAD_TTL seconds, so a revalidation is normally answered
+    from the marker and this cache without a query.
+    """
+    with _history_heads_lock:
+        if user_id in _history_heads:
+            return _history_heads[user_id]
+    rows = execute(
+        supabase.table("requestImages")
+        .select("id, uploaded_at")
+        .eq("requested_by", user_id)
+        .order("uploaded_at", desc=True)
+        .order("id", desc=True)
+        .limit(1)
+    ).data or []
+    head = (rows[0]["uploaded_at"], rows[0]["id"]) if rows else None
+    remember_history_head(user_id, head)
+    return head
+
+
+HISTORY_FIELDS = ("id", "url", "thumb_url", "medium_url", "image_path", "request_id", "filename", "uploaded_at")
+
+
+# Keyset pagination, newest first. Each page is one indexed range scan:
+#   create index on "requestImages" (requested_by, uploaded_at desc, id desc);
+# so page 50 costs the same as page 1, unlike offset paging.
+#   ?limit=30  ?cursor=<next_cursor>  ?from=2025-06-01  ?to=2025-06-30  ?request_id=<mission>
+#   ?fields=id,thumb_url,uploaded_at  (trim the payload for the gallery grid)
 @app.route("/history/images")
 def history_images():
     if "user_id" not in session:
@@ -389,68 +911,119 @@ def history_images():
 
     user_id = session["user_id"]
 
-    resp = (
+    # The query string picks the page/filters, so it is part of the ETag. requestImages
+    # rows are written outside this app, where nothing bumps the history marker, so the
+    # newest row is part of it too (cached, see history_head)
+    head = history_head(user_id)
+    hit, cache = conditional(http_versions, f"history:{user_id}",
+                             variant=request.query_string + repr(head).encode())
+    if hit:
+        return hit
+
+    try:
+        limit = max(1, min(HISTORY_PAGE_MAX, int(request.args.get("limit", HISTORY_PAGE_SIZE))))
+    except ValueError:
+        return {"error": "limit must be an integer"}, 400
+
+    fields = request.args.get("fields")
+    fields = [f for f in fields.split(",") if f in HISTORY_FIELDS] if fields else list(HISTORY_FIELDS)
+
+    q = (
         supabase.table("requestImages")
         .select("id, image_path, original_filename, uploaded_at, request_id")
         .eq("requested_by", user_id)
-        .order("uploaded_at", desc=True)
-        .execute()
     )
 
-    rows = resp.data or []
+    date_from = request.args.get("from")
+    date_to = request.args.get("to")
+    try:
+        if date_from:
+            q = q.gte("uploaded_at", parse_iso(date_from).isoformat())
+        if date_to:
+            end = parse_iso(date_to)
+            if len(date_to) == 10:  # a bare date includes that whole day
+                end += timedelta(days=1)
+            q = q.lt("uploaded_at", end.isoformat())
+    except ValueError:
+        return {"error": "from/to must be ISO dates"}, 400
+
+    request_id = request.args.get("request_id")
+    if request_id:
+        q = q.eq("request_id", request_id)
+
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            after_ts, after_id = decode_cursor(cursor)
+        except (ValueError, TypeError):
+            return {"error": "invalid cursor"}, 400
+        q = q.or_(f'uploaded_at.lt."{after_ts}",and(uploaded_at.eq."{after_ts}",id.lt."{after_id}")')
+
+    # One extra row tells us whether another page exists without a count query
+    rows = execute(
+        q.order("uploaded_at", desc=True)
+        .order("id", desc=True)
+        .limit(limit + 1)
+    ).data or []
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
     public_base = f"{SUPABASE_URL}/storage/v1/object/public/{IMAGE_BUCKET}/"
 
+    # An unfiltered first page starts at the newest row: refresh the cached head,
+    # and if it had moved, send the ETag for what this body really contains
+    if not (cursor or date_from or date_to or request_id):
+        fresh = (rows[0]["uploaded_at"], rows[0]["id"]) if rows else None
+        if fresh != head:
+            remember_history_head(user_id, fresh)
+            _, cache = conditional(http_versions, f"history:{user_id}",
+                                   variant=request.query_string + repr(fresh).encode())
+
+    # Thumbnail URLs only for images whose derivatives are known to exist; the rest
+    # (not generated yet, failed, never backfilled) get the original
+    known = {}
+    if rows and ("thumb_url" in fields or "medium_url" in fields):
+        try:
+            known = thumbnail_registry.lookup([r["image_path"] for r in rows])
+        except Exception as e:
+            print("THUMBNAIL LOOKUP FAILED:", e)
+
     images = []
     for r in rows:
-        images.append({
+        original_url = public_base + r["image_path"]
+        thumbs = {name: public_base + path for name, path in known.get(r["image_path"], {}).items()}
+        item = {
             "id": r["id"],
-            "url": public_base + r["image_path"],
+            "url": original_url,
+            "thumb_url": thumbs.get("small", original_url),
+            "medium_url": thumbs.get("medium", original_url),
             "image_path": r["image_path"],
             "request_id": r["request_id"],
             "filename": r.get("original_filename"),
             "uploaded_at": r.get("uploaded_at")
-        })
-
-    return {"images": images}
-
-''' #Study this later for ML
-@app.route("/analysis/run", methods=["POST"])
-def analysis_run():
-    if "user_id" not in session:
-        return {"error": "Not logged in"}, 401
-
-    payload = request.get_json(silent=True) or {}
-    image_id = payload.get("image_id")
-    if not image_id:
-        return {"error": "image_id required"}, 400
+        }
+        images.append({k: item[k] for k in fields})
 
-    resp = (
-        supabase.table("requestImages")
-        .select("id, requested_by, image_path, request_id")
-        .eq("id", image_id)
-        .execute()
-    )
-    if not resp.data:
-        return {"error": "image not found"}, 404
-
-    row = resp.data[0]
-
-    if row["requested_by"] != session["user_id"]:
-        return {"error": "forbidden"}, 403
-
-    public_base = f"{SUPABASE_URL}/storage/v1/object/public/{IMAGE_BUCKET}/"
-    original_url = public_base + row["image_path"]
+    return {
+        "images": images,
+        "next_cursor": encode_cursor(rows[-1]) if has_more else None,
+    }, 200, cache
 
-    r = requests.get(original_url, timeout=30)
-    if r.status_code != 200:
-        return {"error": "failed to fetch original image"}, 500
+def run_model(image_bytes, tiled=False):
+    """
+    Returns: (result_png_bytes, metrics_dict)
+    Uses the persistent TF workers; INFER_WORKERS=0 falls back to a one-shot ml_infer.py run.
+    tiled=True scores the full-resolution image tile by tile (see tiling.py).
+    """
+    if INFER_WORKERS > 0:
+        return get_pool(TF_PYTHON, MODEL_PATH, MODEL_INPUT_SIZE).infer(image_bytes, tiled=tiled)
 
     with tempfile.TemporaryDirectory() as td:
         in_path = os.path.join(td, "input.jpg")
         out_path = os.path.join(td, "output.png")
 
         with open(in_path, "wb") as f:
-            f.write(r.content)
+            f.write(image_bytes)
 
         cmd = [
             TF_PYTHON,
@@ -460,22 +1033,94 @@ def analysis_run():
             "--output", out_path,
             "--size", MODEL_INPUT_SIZE
         ]
+        if tiled:
+            cmd.append("--tiled")
 
-        proc = subprocess.run(cmd, capture_output=True, text=True)
+        proc = subprocess.run(cmd, capture_output=True, text=True, cwd=BASE_DIR)
         if proc.returncode != 0:
-            return {"error": "ml failed", "detail": proc.stderr}, 500
+            raise InferenceError(proc.stderr)
 
         try:
             ml_json = json.loads((proc.stdout or "").strip() or "{}")
         except Exception:
-            return {"error": "ml output parse failed", "detail": proc.stdout}, 500
+            raise InferenceError(f"ml output parse failed: {proc.stdout}")
 
         if not os.path.exists(out_path):
-            return {"error": "ml did not produce output"}, 500
+            raise InferenceError("ml did not produce output")
 
         with open(out_path, "rb") as f:
-            result_png_bytes = f.read()
+            ml_json.pop("output_path", None)
+            return f.read(), ml_json
+
+
+class AnalysisError(Exception):
+    def __init__(self, error, status=500, detail=None):
+        super().__init__(error)
+        self.error = error
+        self.status = status
+        self.detail = detail
+
+    def response(self):
+        body = {"error": self.error}
+        if self.detail:
+            body["detail"] = self.detail
+        return body, self.status
+
+
+def load_image_row(image_id, user_id):
+    resp = execute(
+        supabase.table("requestImages")
+        .select("id, requested_by, image_path, request_id")
+        .eq("id", image_id)
+    )
+    if not resp.data:
+        raise AnalysisError("image not found", 404)
+
+    row = resp.data[0]
+
+    if row["requested_by"] != user_id:
+        raise AnalysisError("forbidden", 403)
+    return row
+
+
+def analyze_image(row, tiled=False, progress=lambda step: None):
+    """
+    fetch -> infer -> upload for one requestImages row.
+    Returns: {"original_url", "result_url", "metrics"[, "cached"]}
+    """
+    public_base = f"{SUPABASE_URL}/storage/v1/object/public/{IMAGE_BUCKET}/"
+    original_url = public_base + row["image_path"]
+
+    # Same image + same model + same mode = same answer: skip download, inference and upload
+    sha = result_cache.hash_for_path(row["image_path"])
+    if sha:
+        hit = result_cache.get(result_cache.key(sha, tiled))
+        if hit:
+            return {"original_url": original_url, "cached": True, **hit}
+
+    progress("fetching")
+    try:
+        r = http_get(original_url)
+    except (requests.RequestException, transport.TransientHTTPError) as e:
+        raise AnalysisError("failed to fetch original image", 502, detail=str(e))
+    if r.status_code != 200:
+        raise AnalysisError("failed to fetch original image")
 
+    sha = content_hash(r.content)
+    result_cache.remember_path(row["image_path"], sha)
+    cache_key = result_cache.key(sha, tiled)
+
+    hit = result_cache.get(cache_key)
+    if hit:
+        return {"original_url": original_url, "cached": True, **hit}
+
+    progress("inferring")
+    try:
+        result_png_bytes, metrics = run_model(r.content, tiled=tiled)
+    except InferenceError as e:
+        raise AnalysisError("ml failed", detail=str(e))
+
+    progress("uploading")
     result_path = f"results/{row['request_id']}/{row['requested_by']}/{uuid.uuid4()}.png"
     storage = supabase.storage.from_(IMAGE_BUCKET)
 
@@ -486,58 +1131,451 @@ def analysis_run():
     )
 
     if isinstance(up, dict) and up.get("error"):
-        return {"error": up["error"]}, 500
+        raise AnalysisError(up["error"])
 
     result_url = public_base + result_path
+    metrics = {"health_score": 0, **metrics}
+    result_cache.put(cache_key, result_url, metrics)
 
     return {
         "original_url": original_url,
         "result_url": result_url,
-        "metrics": {"health_score": ml_json.get("health_score", 0)}
+        "metrics": metrics
     }
-'''
+
+
+def parse_flag(value, default=False):
+    """JSON/form flag -> bool; the string "false" is False (bool("false") would be True)."""
+    if value is None:
+        return default
+    return str(value).lower() in ("1", "true", "yes")
+
+
+@app.route("/analysis/run", methods=["POST"])
+def analysis_run():
+    if "user_id" not in session:
+        return {"error": "Not logged in"}, 401
+
+    payload = request.get_json(silent=True) or {}
+    image_id = payload.get("image_id")
+    tiled = parse_flag(payload.get("tiled"), INFER_TILED)
+    if not image_id:
+        return {"error": "image_id required"}, 400
+
+    try:
+        row = load_image_row(image_id, session["user_id"])
+        return analyze_image(row, tiled=tiled)
+    except AnalysisError as e:
+        return e.response()
+
+
+def analysis_job(owner, image_id, tiled):
+    """Job factory (see jobs.py register()); rebuilt from these params if the job is requeued."""
+    def work(progress):
+        # Ownership is checked on the pool too, so a bad id only fails its own job
+        try:
+            return analyze_image(load_image_row(image_id, owner), tiled=tiled, progress=progress)
+        except AnalysisError as e:
+            raise RuntimeError(e.error if not e.detail else f"{e.error}: {e.detail}")
+    return work
+
+
+analysis_jobs.register("analysis", analysis_job)
+
+
+@app.route("/analysis/jobs", methods=["POST"])
+def analysis_jobs_submit():
+    """
+    POST /analysis/jobs  { "image_ids": [...], "tiled": false }   (or "image_id": "...")
+    Returns 202 right away with one job per image; poll /analysis/jobs/<job_id>
+    (or, when "events" is true, stream /analysis/jobs/<job_id>/events).
+    """
+    if "user_id" not in session:
+        return {"error": "Not logged in"}, 401
+
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return {"error": "JSON object required"}, 400
+    image_ids = payload.get("image_ids")
+    if image_ids is None and payload.get("image_id") is not None:
+        image_ids = [payload["image_id"]]
+    if not isinstance(image_ids, list) or not image_ids:
+        return {"error": "image_ids must be a non-empty list"}, 400
+    if len(image_ids) > ANALYSIS_JOB_MAX_IMAGES:
+        return {"error": f"at most {ANALYSIS_JOB_MAX_IMAGES} images per request"}, 413
+    if not all(isinstance(i, (int, str)) and not isinstance(i, bool) and str(i) for i in image_ids):
+        return {"error": "image_ids must be integers or strings"}, 400
+    tiled = parse_flag(payload.get("tiled"), INFER_TILED)
+
+    user_id = session["user_id"]
+    submitted = []
+    for image_id in image_ids:
+        try:
+            job = analysis_jobs.submit(user_id, "analysis", image_id=image_id, tiled=tiled)
+        except QueueFull as e:
+            if not submitted:
+                return {"error": str(e)}, 429
+            submitted.append({"image_id": image_id, "status": "rejected", "error": str(e)})
+            continue
+        submitted.append(public_view(job))
+
+    return {"jobs": submitted, "events": ANALYSIS_JOB_SSE}, 202
+
+
+def _owned_job(job_id):
+    job = analysis_jobs.get(job_id)
+    if not job or job["owner"] != session.get("user_id"):
+        return None
+    return job
+
+
+@app.route("/analysis/jobs/<job_id>")
+def analysis_job_status(job_id):
+    if "user_id" not in session:
+        return {"error": "Not logged in"}, 401
+
+    job = _owned_job(job_id)
+    if not job:
+        return {"error": "job not found"}, 404
+    return public_view(job)
+
+
+@app.route("/analysis/jobs/<job_id>/events")
+def analysis_job_events(job_id):
+    """Server-sent events: one "status" event per state/step change until done or failed."""
+    if "user_id" not in session:
+        return {"error": "Not logged in"}, 401
+    if not ANALYSIS_JOB_SSE:
+        return {"error": "job events disabled; poll /analysis/jobs/<job_id>"}, 404
+
+    job = _owned_job(job_id)
+    if not job:
+        return {"error": "job not found"}, 404
+
+    def stream(job):
+        version = -1
+        while True:
+            if job["version"] != version:
+                version = job["version"]
+                yield f"event: status\ndata: {json.dumps(public_view(job))}\n\n"
+                if job["status"] in ("done", "failed"):
+                    return
+            else:
+                yield ": keep-alive\n\n"
+            job = analysis_jobs.wait(job_id, version, timeout=15) or job
+
+    return Response(stream(job), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def warmup():
+    """Start the inference workers (each loads the model and runs a dummy predict)."""
+    t0 = time.perf_counter()
+    try:
+        if INFER_WORKERS > 0:
+            get_pool(TF_PYTHON, MODEL_PATH, MODEL_INPUT_SIZE)
+        startup_metrics["warmup_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    except Exception as e:
+        startup_metrics["warmup_error"] = str(e)
+        print("WARMUP FAILED:", e)
+
+
+@app.route("/healthz")
+def healthz():
+    return {"status": "ok", "startup": startup_metrics, "backends": transport.stats(),
+            "identity_cache": identity_cache.stats(), "device_tokens": device_tokens.stats(),
+            "mission_waiters": dict(mission_waiters), "mission_push": mission_broadcaster.stats(),
+            "mission_index": mission_index.stats(),
+            # counters only; the model fingerprint stays off this unauthenticated route
+            "result_cache": {k: v for k, v in result_cache.stats().items() if k != "model_fp"}}
+
+
+@app.route("/analysis/health")
+def analysis_health():
+    if INFER_WORKERS <= 0:
+        return {"mode": "subprocess"}
+    return {"mode": "pool", **get_pool(TF_PYTHON, MODEL_PATH, MODEL_INPUT_SIZE).health()}
+
 
 # =========================
 # GEOJSON (testing)
 # =========================
 
+@app.route("/geojson/targets")
+def geojson_targets():
+    # For testing: serve a small sample GeoJSON.
+    # Later you can load this from a file or database (bump "geojson:targets" on writes).
+    hit, cache = conditional(http_versions, "geojson:targets", cache_control="public, max-age=300")
+    if hit:
+        return hit
+
+    sample = {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "properties": {"name": "Target A"},
+                "geometry": {"type": "Point", "coordinates": [120.9842, 14.5995]}
+            },
+            {
+                "type": "Feature",
+                "properties": {"name": "Target B"},
+                "geometry": {"type": "Point", "coordinates": [121.0500, 14.6500]}
+            }
+        ]
+    }
+    return sample, 200, cache
+
+
 @app.route("/device/missions/latest", methods=["GET"])
 def device_missions_latest():
 
-      #GET /device/missions/latest?user_id=...
-    user_id = request.args.get("user_id")
+      #GET /device/missions/latest?user_id=...   (or Authorization: Bearer <device token>)
+    user_id, _, err = device_identity(request.args.get("user_id"))
+    if err:
+        return err
 
-    if not user_id:
-        return {"error": "user_id required"}, 400
+    # Devices poll this every few seconds; an unchanged queue answers 304 without a query
+    hit, cache = conditional(http_versions, f"missions:{user_id}")
+    if hit:
+        return hit
+
+    return latest_pending_mission(user_id), 200, cache
 
-    resp = (
+
+def load_pending_missions(user_id):
+    """The newest 500 pending mission ids (requested_at) for a user; feeds mission_index."""
+    rows = execute(
         supabase.table("userMissions")
-        .select("requested_by, requested_at, status")
+        .select("requested_at")
         .eq("requested_by", user_id)
         .eq("status", "pending")
         .order("requested_at", desc=True)
-        .limit(1)
-        .execute()
-    )
+        .limit(500)
+    ).data or []
+    return [r["requested_at"] for r in rows]
 
-    if not resp.data:
-        return {"mission": None}, 200
 
-    row = resp.data[0]
+# Pending missions per user, kept in memory (see mission_index.py)
+mission_index = MissionIndex(load_pending_missions, http_versions)
+
+
+def latest_pending_mission(user_id):
+    newest = mission_index.newest(user_id)
+    if not newest:
+        return {"mission": None}
+
     return {
         "requested_by": user_id,
-        "mission_id": row["requested_at"],
-        "status": row.get("status"),
-    }, 200
+        "mission_id": newest[0],
+        "status": "pending",
+    }
+
+
+def pending_missions_after(user_id, after):
+    """[(event_id, payload)] of pending missions newer than `after`, oldest first."""
+    return [(mission_id, {"requested_by": user_id, "mission_id": mission_id, "status": "pending"})
+            for mission_id in mission_index.after(user_id, after)]
+
+
+mission_broadcaster = MissionBroadcaster()
+
+
+@app.route("/device/missions/stream", methods=["GET"])
+def device_missions_stream():
+    """
+    Push channel: one long-lived text/event-stream per device (see mission_push.py).
+      GET /device/missions/stream?user_id=...      (or Authorization: Bearer <device token>)
+      Last-Event-ID: <mission_id>                   on reconnect, to replay what was missed
+    Each "mission" event carries the same fields as /device/missions/latest
+    (plus the mission JSON inline when it was queued through this worker).
+    """
+    user_id, _, err = device_identity(request.args.get("user_id"))
+    if err:
+        return err
+
+    cursor = request.headers.get("Last-Event-ID") or request.args.get("cursor")
+    if not mission_broadcaster.open_stream():
+        return {"error": "too many open streams"}, 503, {"Retry-After": "30"}
+
+    resp = Response(
+        stream_missions(mission_broadcaster, http_versions, user_id, cursor, pending_missions_after),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    resp.call_on_close(mission_broadcaster.close_stream)
+    return resp
+
+
+mission_waiters = {"waiting": 0, "woken": 0, "timed_out": 0}
+_mission_waiters_lock = threading.Lock()
+
+
+def wait_timeout():
+    """?timeout= for long-polling routes, clamped to MISSION_WAIT_MAX_SECONDS. Raises ValueError."""
+    return max(0.0, min(MISSION_WAIT_MAX_SECONDS, float(request.args.get("timeout", MISSION_WAIT_SECONDS))))
+
+
+def hold_for_mission(user_id, timeout, attempt):
+    """
+    Call attempt() (-> body, or None when nothing is pending) now, and again each time
+    the user's mission queue changes, until it returns a body or timeout passes.
+    Returns the body or None.
+    """
+    key = f"missions:{user_id}"
+    with _mission_waiters_lock:
+        if mission_waiters["waiting"] >= MISSION_WAIT_MAX_WAITERS:
+            timeout = 0   # full: behave like a plain poll rather than pile up threads
+        mission_waiters["waiting"] += 1
+
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            version = http_versions.version(key)   # read before the query so no queue change is missed
+            body = attempt()
+            if body:
+                return body
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not http_versions.wait(key, version, remaining):
+                with _mission_waiters_lock:
+                    mission_waiters["timed_out"] += 1
+                return None
+            with _mission_waiters_lock:
+                mission_waiters["woken"] += 1
+    finally:
+        with _mission_waiters_lock:
+            mission_waiters["waiting"] -= 1
+
+
+@app.route("/device/missions/wait", methods=["GET"])
+def device_missions_wait():
+    """
+    Long-poll version of /device/missions/latest:
+      GET /device/missions/wait?user_id=...&timeout=25
+    Answers at once if a mission is pending, otherwise holds the request until
+    mission_upload queues one (woken in-process, or within a second from another
+    worker) or the timeout passes, then returns {"mission": null}. Same body as latest.
+    One query per call instead of one every POLL_SECONDS.
+    """
+    user_id, _, err = device_identity(request.args.get("user_id"))
+    if err:
+        return err
+
+    try:
+        timeout = wait_timeout()
+    except ValueError:
+        return {"error": "timeout must be a number"}, 400
+
+    def attempt():
+        body = latest_pending_mission(user_id)
+        return body if body.get("mission_id") else None
+
+    body = hold_for_mission(user_id, timeout, attempt) or {"mission": None}
+    return body, 200, {"Cache-Control": "no-store"}
+
+
+def load_mission_json(user_id, mission_id):
+    """The uploaded mission JSON: from this worker's broadcast history if it has it, else storage."""
+    for eid, payload in mission_broadcaster.since(user_id, None):
+        if eid == mission_id and "mission" in payload:
+            return payload["mission"]
+    data = guarded(
+        lambda: supabase.storage.from_(MISSION_BUCKET).download(f"{user_id}/{mission_id}.json"),
+        retry=True, breaker=transport.STORAGE,
+    )
+    return json.loads(data)
+
+
+def claim_pending_mission(user_id, device_id=None, candidates=3):
+    """
+    Newest pending mission for user_id, marked delivered with a conditional update
+    (status must still be pending), so two devices can never both claim it.
+    Returns the claim body, an {"error"} body if the mission file can't be read
+    (the claim is undone), or None when nothing is pending.
+    """
+    for mission_id in mission_index.newest(user_id, candidates):
+        won = execute(
+            supabase.table("userMissions")
+            .update({"status": "delivered"})
+            .eq("requested_by", user_id)
+            .eq("requested_at", mission_id)
+            .eq("status", "pending"),
+            retry=False,
+        ).data
+        if not won:
+            # Another device (or worker) got it first; that write already bumped the marker
+            mission_index.discard(user_id, mission_id)
+            continue
+
+        mission_index.apply(user_id, remove=[mission_id])
+        try:
+            mission = load_mission_json(user_id, mission_id)
+        except Exception as e:
+            # Hand it back so the next claim (or this device's retry) can have it
+            try:
+                execute(
+                    supabase.table("userMissions")
+                    .update({"status": "pending"})
+                    .eq("requested_by", user_id)
+                    .eq("requested_at", mission_id)
+                    .eq("status", "delivered"),
+                    retry=False,
+                )
+                mission_index.apply(user_id, add=[mission_id])
+            except Exception as undo_error:
+                # Left "delivered" but never handed to a device: log it so it can be re-queued by hand
+                print("CLAIM UNDO FAILED:", user_id, mission_id, undo_error)
+                traceback.print_exc()
+            return {"error": "mission file unavailable", "detail": str(e), "mission_id": mission_id}
+
+        return {
+            "requested_by": user_id,
+            "mission_id": mission_id,
+            "status": "delivered",
+            "device_id": device_id,
+            "mission": mission,
+        }
+
+    # Nothing pending (or every race lost); the caller waits for the next change
+    return None
+
+
+@app.route("/device/missions/claim", methods=["POST"])
+def device_missions_claim():
+    """
+    One round trip instead of latest -> download (redirect) -> ack:
+      POST /device/missions/claim?timeout=25   {"user_id": "..."}  (or Authorization: Bearer <device token>)
+    Atomically takes the newest pending mission, marks it delivered and returns
+    its JSON inline. With ?timeout= it long-polls like /device/missions/wait.
+    {"mission": null} when nothing is pending.
+    """
+    payload = request.get_json(silent=True) or {}
+    user_id, device_id, err = device_identity(payload.get("user_id") or request.args.get("user_id"))
+    if err:
+        return err
+
+    try:
+        timeout = wait_timeout() if "timeout" in request.args else 0.0
+    except ValueError:
+        return {"error": "timeout must be a number"}, 400
+
+    body = hold_for_mission(user_id, timeout, lambda: claim_pending_mission(user_id, device_id))
+    if body and body.get("error"):
+        return body, 502
+    return body or {"mission": None}, 200, {"Cache-Control": "no-store"}
+
 
 @app.route("/device/missions/download", methods=["GET"])
 def missions_download():
-    user_id = request.args.get("requested_by")
     mission_id = request.args.get("requested_at")
-
-    if not user_id or not mission_id:
+    if not mission_id:
         return {"error": "requested_by and requested_at required"}, 400
 
+    user_id, _, err = device_identity(request.args.get("requested_by"))
+    if err:
+        return err
+
     storage = supabase.storage.from_(MISSION_BUCKET)
     file_path = f"{user_id}/{mission_id}.json"   # bucket-relative path
 
@@ -554,34 +1592,33 @@ def device_missions_ack():
     """
     payload = request.get_json(silent=True) or {}
     mission_id = payload.get("requested_at")
-    user_id = payload.get("user_id")
 
-    if not mission_id or not user_id:
+    if not mission_id:
         return {"error": "mission_id and user_id required"}, 400
 
+    user_id, _, err = device_identity(payload.get("user_id"))
+    if err:
+        return err
+
     # (Optional) ensure this mission belongs to that user
-    check = (
+    check = execute(
         supabase.table("userMissions")
         .select("requested_by, requested_at, status")
         .eq("requested_at", mission_id)
         .eq("requested_by", user_id )
         .limit(1)
-        .execute()
     )
 
     if not check.data:
         return {"error": "mission not found"}, 404
 
-    row = check.data[0]
-    if row["requested_by"] != user_id:
-        return {"error": "forbidden"}, 403
-    
-    #Problem part
+    # Scoped to this user: requested_at alone is only a timestamp and can collide across users
     upd = (
         supabase.table("userMissions")
         .update({
             "status": "delivered",
         })
+        .eq("requested_by", user_id)
         .eq("requested_at", mission_id)
         .execute()
     )
@@ -589,8 +1626,18 @@ def device_missions_ack():
     if not upd.data:
         return {"error": f"ack update failed: {upd.error}"}, 500
 
+    mission_index.apply(user_id, remove=[mission_id])
+
     return {"message": "acked", "requested_at": mission_id}, 200
 
 
+startup_metrics["app_import_ms"] = round((time.perf_counter() - STARTUP_T0) * 1000, 1)
+
+# WARMUP_ON_BOOT=1: warm the model in the background so the first real analysis
+# doesn't pay for loading + graph building. Otherwise it happens on first use.
+if os.getenv("WARMUP_ON_BOOT", "0") == "1":
+    threading.Thread(target=warmup, daemon=True).start()
+
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,270 @@
+# benchmarks/bench_inference.py
+# Reproducible benchmark for the ML path. Builds a small dummy Keras model and
+# synthetic JPEGs, so it needs no real model and no network. Run in the TF venv.
+#
+#   python benchmarks/bench_inference.py
+#   python benchmarks/bench_inference.py --sizes 1280x720,4000x3000 --batches 1,8,32 --json bench.json
+#
+# Reports:
+#   cold      fresh interpreter: imports + model load + first analyze()
+#   warm      ml_infer-style single image: p50/p95/p99 and per-stage split
+#             (decode, preprocess, predict, overlay, encode)
+#   batch     predict() images/s at several batch sizes
+#   batcher   crop_analyzer.run_inference images/s, serial vs concurrent callers
+#   peak_rss_mb for the whole run (Unix only; null on Windows)
+# JSON output is meant to be diffed between releases.
+
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource   # Unix only; peak_rss_mb is null without it (e.g. the Windows .venv_tf setup)
+except ImportError:
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+
+def build_dummy_model(path, size, classes=4):
+    import tensorflow as tf
+
+    w, h = size
+    tf.keras.utils.set_random_seed(0)
+    model = tf.keras.Sequential([
+        tf.keras.Input(shape=(h, w, 3)),
+        tf.keras.layers.Conv2D(16, 3, strides=2, activation="relu"),
+        tf.keras.layers.Conv2D(32, 3, strides=2, activation="relu"),
+        tf.keras.layers.Conv2D(64, 3, strides=2, activation="relu"),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(classes, activation="softmax"),
+    ])
+    model.save(path)
+    return path
+
+
+def synthetic_jpeg(w, h, quality=90):
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:h, 0:w]
+    img = np.stack([(xx * 255 // max(1, w - 1)), (yy * 255 // max(1, h - 1)), (xx + yy) % 256], axis=-1)
+    img = (img + rng.integers(0, 32, size=img.shape)).clip(0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(img).save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def pct(values, p):
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1)))))
+    return values[k]
+
+
+def summarize(ms):
+    return {
+        "n": len(ms),
+        "mean_ms": round(statistics.mean(ms), 2),
+        "p50_ms": round(pct(ms, 50), 2),
+        "p95_ms": round(pct(ms, 95), 2),
+        "p99_ms": round(pct(ms, 99), 2),
+    }
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+def staged_analyze(model, data, size, buffers):
+    """ml_infer.analyze split into timed stages. Returns {stage: ms}."""
+    import numpy as np
+    from PIL import Image
+    import preprocess
+
+    w, h = size
+    t = {}
+
+    t0 = time.perf_counter()
+    img = preprocess.open_image(data)
+    if img.format == "JPEG":
+        img.draft("RGB", (w * 2, h * 2))
+    img.load()
+    t1 = time.perf_counter()
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    frame = np.array(img.resize((w, h), Image.BILINEAR, reducing_gap=2.0))
+    x = buffers.from_frames([frame])
+    t2 = time.perf_counter()
+    pred = model.predict(x, verbose=0)
+    t3 = time.perf_counter()
+    preprocess.label(frame, f"class={int(np.argmax(pred[0]))} conf={float(np.max(pred[0])):.2f}")
+    bgr = preprocess.to_bgr_inplace(frame)
+    t4 = time.perf_counter()
+    import cv2
+    cv2.imencode(".png", bgr)
+    t5 = time.perf_counter()
+
+    t["decode"] = (t1 - t0) * 1000
+    t["preprocess"] = (t2 - t1) * 1000
+    t["predict"] = (t3 - t2) * 1000
+    t["overlay"] = (t4 - t3) * 1000
+    t["encode"] = (t5 - t4) * 1000
+    t["total"] = (t5 - t0) * 1000
+    return t
+
+
+def bench_cold(model_path, image_path, size_arg):
+    """Time a fresh interpreter doing exactly what a one-shot ml_infer.py call does."""
+    t0 = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, os.path.join(ROOT, "ml_infer.py"), "--model", model_path,
+         "--input", image_path, "--output", image_path + ".out.png", "--size", size_arg],
+        capture_output=True, text=True, cwd=ROOT,
+    )
+    elapsed = (time.perf_counter() - t0) * 1000
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr)
+    return round(elapsed, 1)
+
+
+def bench_warm(model, images, size, repeat):
+    import preprocess
+
+    buffers = preprocess.BatchBuffer()
+    results = {}
+    for name, data in images.items():
+        staged_analyze(model, data, size, buffers)  # first call per resolution is not "warm"
+        runs = [staged_analyze(model, data, size, buffers) for _ in range(repeat)]
+        results[name] = {
+            **summarize([r["total"] for r in runs]),
+            "stages_ms": {k: round(statistics.median([r[k] for r in runs]), 2)
+                          for k in ("decode", "preprocess", "predict", "overlay", "encode")},
+        }
+    return results
+
+
+def bench_batches(model, size, batch_sizes, seconds):
+    import numpy as np
+
+    w, h = size
+    out = {}
+    for b in batch_sizes:
+        x = np.random.default_rng(0).random((b, h, w, 3), dtype=np.float32)
+        model.predict(x, verbose=0)
+        n = 0
+        t0 = time.perf_counter()
+        while time.perf_counter() - t0 < seconds:
+            model.predict(x, verbose=0)
+            n += b
+        out[str(b)] = round(n / (time.perf_counter() - t0), 1)
+    return out
+
+
+def bench_batcher(data, count, concurrency, size):
+    import crop_analyzer
+
+    crop_analyzer.warmup(size)
+    t0 = time.perf_counter()
+    for _ in range(count):
+        crop_analyzer.run_inference(data, size)
+    serial = count / (time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        list(ex.map(lambda _: crop_analyzer.run_inference(data, size), range(count)))
+    concurrent = count / (time.perf_counter() - t0)
+
+    return {
+        "serial_img_s": round(serial, 1),
+        f"concurrent{concurrency}_img_s": round(concurrent, 1),
+        "batcher": crop_analyzer.get_batcher().stats(),
+    }
+
+
+def git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=ROOT).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="640x480,1920x1080,4000x3000")
+    ap.add_argument("--model-size", default="224,224")
+    ap.add_argument("--batches", default="1,4,8,16,32")
+    ap.add_argument("--repeat", type=int, default=30)
+    ap.add_argument("--batch-seconds", type=float, default=2.0)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--json", default=None)
+    args = ap.parse_args()
+
+    size = tuple(int(v) for v in args.model_size.split(","))
+
+    with tempfile.TemporaryDirectory() as td:
+        model_path = build_dummy_model(os.path.join(td, "dummy.h5"), size)
+
+        images = {}
+        for s in args.sizes.split(","):
+            w, h = [int(v) for v in s.split("x")]
+            images[s] = synthetic_jpeg(w, h)
+        first = next(iter(images))
+        first_path = os.path.join(td, "first.jpg")
+        with open(first_path, "wb") as f:
+            f.write(images[first])
+
+        cold_ms = bench_cold(model_path, first_path, args.model_size)
+
+        # Point crop_analyzer (imported later) at the dummy model too
+        os.environ["MODEL_PATH"] = model_path
+        import ml_infer
+
+        t0 = time.perf_counter()
+        model = ml_infer.load_model(model_path)
+        load_ms = (time.perf_counter() - t0) * 1000
+        first_predict_ms = ml_infer.warmup(model, size)
+
+        report = {
+            "meta": {
+                "git": git_rev(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "backend": type(model).__name__,
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "args": vars(args),
+            },
+            "cold": {
+                "process_first_result_ms": cold_ms,
+                "model_load_ms": round(load_ms, 1),
+                "first_predict_ms": round(first_predict_ms, 1),
+            },
+            "warm": bench_warm(model, images, size, args.repeat),
+            "batch_img_s": bench_batches(model, size, [int(b) for b in args.batches.split(",")], args.batch_seconds),
+            "crop_analyzer": bench_batcher(images[first], args.repeat, args.concurrency, size),
+        }
+        report["peak_rss_mb"] = peak_rss_mb()
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
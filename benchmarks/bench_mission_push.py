@@ -0,0 +1,238 @@
+# benchmarks/bench_mission_push.py
+# Simulates a fleet of devices holding mission push streams open on one host.
+#
+#   python benchmarks/bench_mission_push.py --devices 500 --users 50 --missions 20
+#       in-process: the real stream_missions() generator per simulated device,
+#       broadcaster + version markers, no network and no Supabase
+#
+#   python benchmarks/bench_mission_push.py --url http://127.0.0.1:8000 \
+#       --username demo --password demo --user-id <uuid> --devices 300 --missions 10
+#       live: N SSE connections to /device/missions/stream, missions queued
+#       through /mission/upload as a logged-in user
+#
+# Reports delivered/expected events, delivery latency p50/p95/p99 (publish ->
+# device, same-host clock), open streams, threads and peak RSS (Unix only). Run the live mode
+# against gunicorn -k gthread with enough --threads for --devices.
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource   # Unix only; peak_rss_mb is null without it (e.g. the Windows .venv_tf setup)
+except ImportError:
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+
+def pct(values, p):
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1)))))
+    return values[k]
+
+
+def summarize(ms):
+    if not ms:
+        return {"n": 0}
+    return {
+        "n": len(ms),
+        "mean_ms": round(statistics.mean(ms), 2),
+        "p50_ms": round(pct(ms, 50), 2),
+        "p95_ms": round(pct(ms, 95), 2),
+        "p99_ms": round(pct(ms, 99), 2),
+        "max_ms": round(max(ms), 2),
+    }
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+def parse_sse(lines):
+    """Yields (event, data_dict) from an iterable of SSE lines."""
+    event, data = "message", []
+    for line in lines:
+        if line == "":
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.delivered = 0
+        self.connected = 0
+
+    def got(self, payload):
+        now = time.time()
+        with self.lock:
+            self.delivered += 1
+            if "published_at" in payload:
+                self.latencies.append((now - payload["published_at"]) * 1000)
+
+
+def run_inprocess(args):
+    from http_cache import VersionMarkers
+    from mission_push import MissionBroadcaster, stream_missions
+
+    broadcaster = MissionBroadcaster()
+    markers = VersionMarkers(root=tempfile.mkdtemp(prefix="bench_push_"))
+    results = Results()
+    stop = threading.Event()
+    users = [f"user{u}" for u in range(args.users)]
+
+    def device(i):
+        user_id = users[i % len(users)]
+        gen = stream_missions(broadcaster, markers, user_id, None, lambda u, after: [],
+                              heartbeat=args.heartbeat)
+        lines = (line for chunk in gen for line in chunk.split("\n"))
+        with results.lock:
+            results.connected += 1
+        for event, payload in parse_sse(lines):
+            if event == "mission":
+                results.got(payload)
+            if stop.is_set():
+                return
+
+    threads = [threading.Thread(target=device, args=(i,), daemon=True) for i in range(args.devices)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    while results.connected < args.devices:
+        time.sleep(0.01)
+    connect_s = time.perf_counter() - t0
+
+    expected = 0
+    devices_per_user = {u: sum(1 for i in range(args.devices) if users[i % len(users)] == u) for u in users}
+    for m in range(args.missions):
+        user_id = users[m % len(users)]
+        mission_id = time.strftime("%Y%m%dT%H%M%S", time.gmtime()) + f"{m:06d}Z"
+        markers.bump(f"missions:{user_id}")
+        broadcaster.publish(user_id, mission_id, {"mission_id": mission_id, "requested_by": user_id})
+        expected += devices_per_user[user_id]
+        time.sleep(args.interval)
+
+    deadline = time.monotonic() + args.drain
+    while results.delivered < expected and time.monotonic() < deadline:
+        time.sleep(0.05)
+    stop.set()
+
+    return {
+        "mode": "inprocess",
+        "connect_all_s": round(connect_s, 3),
+        "expected": expected,
+        "delivered": results.delivered,
+        "latency": summarize(results.latencies),
+        "broadcaster": broadcaster.stats(),
+        "threads": threading.active_count(),
+    }
+
+
+def run_live(args):
+    import requests
+
+    results = Results()
+    stop = threading.Event()
+
+    def device(i):
+        s = requests.Session()
+        headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+        params = {} if args.token else {"user_id": args.user_id}
+        try:
+            with s.get(f"{args.url}/device/missions/stream", params=params, headers=headers,
+                       stream=True, timeout=(10, args.heartbeat * 3)) as r:
+                r.raise_for_status()
+                with results.lock:
+                    results.connected += 1
+                for event, payload in parse_sse(r.iter_lines(decode_unicode=True)):
+                    if event == "mission":
+                        results.got(payload)
+                    if stop.is_set():
+                        return
+        except Exception as e:
+            if not stop.is_set():
+                print(f"device {i}: {e}", file=sys.stderr)
+
+    threads = [threading.Thread(target=device, args=(i,), daemon=True) for i in range(args.devices)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    deadline = time.monotonic() + 60
+    while results.connected < args.devices and time.monotonic() < deadline:
+        time.sleep(0.05)
+    connect_s = time.perf_counter() - t0
+    connected = results.connected
+
+    web = requests.Session()
+    web.post(f"{args.url}/login", data={"user": args.username, "pass": args.password}, timeout=20)
+    for m in range(args.missions):
+        mission = {"target": {"lat": 14.5995, "lng": 120.9842, "alt_m": 30}, "bench": m}
+        r = web.post(f"{args.url}/mission/upload", json=mission, timeout=30)
+        if r.status_code != 200:
+            print("mission upload:", r.status_code, r.text[:200], file=sys.stderr)
+        time.sleep(max(args.interval, 1.0))   # mission ids have one-second resolution
+
+    expected = connected * args.missions
+    deadline = time.monotonic() + args.drain
+    while results.delivered < expected and time.monotonic() < deadline:
+        time.sleep(0.1)
+    stop.set()
+
+    return {
+        "mode": "live",
+        "url": args.url,
+        "connected": connected,
+        "connect_all_s": round(connect_s, 3),
+        "expected": expected,
+        "delivered": results.delivered,
+        "latency": summarize(results.latencies),
+        "threads": threading.active_count(),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--devices", type=int, default=300)
+    ap.add_argument("--users", type=int, default=30, help="in-process mode: devices are spread over this many users")
+    ap.add_argument("--missions", type=int, default=20)
+    ap.add_argument("--interval", type=float, default=0.1, help="seconds between published missions")
+    ap.add_argument("--heartbeat", type=float, default=15.0)
+    ap.add_argument("--drain", type=float, default=10.0, help="seconds to wait for stragglers")
+    ap.add_argument("--url", default=None, help="live mode: base URL of a running server")
+    ap.add_argument("--user-id", default=None)
+    ap.add_argument("--token", default=None, help="live mode: device token instead of --user-id")
+    ap.add_argument("--username", default=None)
+    ap.add_argument("--password", default=None)
+    ap.add_argument("--json", default=None)
+    args = ap.parse_args()
+
+    report = run_live(args) if args.url else run_inprocess(args)
+    report["devices"] = args.devices
+    report["missions"] = args.missions
+    report["peak_rss_mb"] = peak_rss_mb()
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
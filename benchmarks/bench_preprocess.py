@@ -0,0 +1,170 @@
+# benchmarks/bench_preprocess.py
+# Legacy preprocessing (PIL full decode -> convert -> resize -> np.array -> astype/255
+# -> expand_dims -> cvtColor) vs preprocess.py, on synthetic JPEGs. "shared-draft"
+# is preprocess.py with PREPROCESS_JPEG_DRAFT on; the pixel table shows how far
+# each path's model input is from the legacy one (shared should be 0).
+#
+# JPEGs are generated once by the parent; each (mode, resolution) then runs in a
+# fresh interpreter so peak RSS only reflects that pipeline. No model needed.
+#
+#   python benchmarks/bench_preprocess.py
+#   python benchmarks/bench_preprocess.py --sizes 4000x3000,5472x3648 --repeat 10 --json out.json
+
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:   # Windows: no getrusage; peak RSS is reported as None
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+TARGET = (224, 224)
+
+
+def synthetic_jpeg(w, h, quality=90):
+    import numpy as np
+    from PIL import Image
+
+    # Smooth gradients + noise: compresses like a field photo, not like flat colour
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:h, 0:w]
+    img = np.stack([(xx * 255 // max(1, w - 1)), (yy * 255 // max(1, h - 1)), (xx + yy) % 256], axis=-1)
+    img = (img + rng.integers(0, 32, size=img.shape)).clip(0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(img).save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def legacy(data):
+    import numpy as np
+    from PIL import Image
+    import cv2
+
+    img = Image.open(io.BytesIO(data)).convert("RGB").resize(TARGET)
+    img_rgb = np.array(img, dtype=np.uint8)
+    x = img_rgb.astype(np.float32) / 255.0
+    x = np.expand_dims(x, axis=0)
+    bgr = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
+    return x, bgr
+
+
+def shared(data, draft=False, _buffers=[]):
+    import preprocess
+
+    if not _buffers:
+        _buffers.append(preprocess.BatchBuffer())
+    frame = preprocess.load_frame(data, TARGET, draft=draft)
+    x = _buffers[0].from_frames([frame])
+    bgr = preprocess.to_bgr_inplace(frame)
+    return x, bgr
+
+
+def shared_draft(data):
+    return shared(data, draft=True)
+
+
+MODES = {"legacy": legacy, "shared": shared, "shared-draft": shared_draft}
+
+
+def pixel_diff(data):
+    """Max / mean absolute difference (0-255) of each path's resized frame vs legacy."""
+    import numpy as np
+    from PIL import Image
+    import preprocess
+
+    ref = np.array(Image.open(io.BytesIO(data)).convert("RGB").resize(TARGET), dtype=np.int16)
+    out = {}
+    for mode, draft in (("shared", False), ("shared-draft", True)):
+        diff = np.abs(preprocess.load_frame(data, TARGET, draft=draft).astype(np.int16) - ref)
+        out[mode] = {"max": int(diff.max()), "mean": round(float(diff.mean()), 3)}
+    return out
+
+
+def max_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_one(mode, path, repeat):
+    fn = MODES[mode]
+    fn(synthetic_jpeg(64, 64))  # imports + first-call cost out of the way, on a tiny frame
+
+    with open(path, "rb") as f:
+        data = f.read()
+    w, h = os.path.basename(path).split(".")[0].split("x")
+
+    base = max_rss_mb()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(data)
+        times.append((time.perf_counter() - t0) * 1000.0)
+
+    return {
+        "mode": mode,
+        "size": f"{w}x{h}",
+        "jpeg_bytes": len(data),
+        "ms_median": round(statistics.median(times), 2),
+        "ms_min": round(min(times), 2),
+        "peak_rss_growth_mb": round(max_rss_mb() - base, 1) if base is not None else None,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="1280x720,4000x3000,5472x3648")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--json", default=None)
+    ap.add_argument("--one", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.one:
+        print(json.dumps(run_one(args.one[0], args.one[1], args.repeat)))
+        return
+
+    results = []
+    diffs = {}
+    with tempfile.TemporaryDirectory() as td:
+        for size in args.sizes.split(","):
+            w, h = [int(v) for v in size.split("x")]
+            path = os.path.join(td, f"{w}x{h}.jpg")
+            with open(path, "wb") as f:
+                f.write(synthetic_jpeg(w, h))
+
+            diffs[size] = pixel_diff(synthetic_jpeg(w, h))
+            for mode in MODES:
+                out = subprocess.run(
+                    [sys.executable, __file__, "--one", mode, path, "--repeat", str(args.repeat)],
+                    capture_output=True, text=True, check=True,
+                )
+                results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    print(f"{'size':>10} {'mode':>12} {'median ms':>10} {'min ms':>8} {'peak RSS +MB':>13}")
+    for r in results:
+        print(f"{r['size']:>10} {r['mode']:>12} {r['ms_median']:>10} {r['ms_min']:>8} {r['peak_rss_growth_mb']!s:>13}")
+
+    print(f"\n{'size':>10} {'mode':>12} {'max |diff|':>10} {'mean |diff|':>12}   (resized frame vs legacy)")
+    for size, by_mode in diffs.items():
+        for mode, d in by_mode.items():
+            print(f"{size:>10} {mode:>12} {d['max']:>10} {d['mean']:>12}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"timings": results, "pixel_diff": diffs}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
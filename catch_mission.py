@@ -1,95 +1,240 @@
 # wait_for_mission.py
-# Raspberry Pi: poll Flask server for the LATEST mission for this USER_ID.
-# saves mission.json, then ACKs it (marks delivered) so it won't be re-downloaded.
+# Raspberry Pi: claim the LATEST mission for this USER_ID and save it as mission.json.
+#
+# MissionClient is reusable from other device scripts:
+#   - one keep-alive requests.Session (one TLS handshake to Render, not one per poll)
+#   - long-poll mode (default): /device/missions/claim holds the request for up to
+#     WAIT_SECONDS, answers as soon as a mission is queued and marks it delivered
+#   - poll mode (--poll): conditional GET of /device/missions/latest with
+#     If-None-Match, so an unchanged queue costs a bodiless 304; then one claim
+#   - adaptive intervals: MIN_INTERVAL right after activity, doubling with jitter
+#     while idle up to MAX_INTERVAL; errors back off the same way up to
+#     MAX_ERROR_BACKOFF, and Retry-After from the server wins
+#   - device token auth via device_auth.py (copy it alongside): a 401 refreshes
+#     the token, or pairs again through /device/connect_user, and retries once
+#   - STATE_PATH remembers the last mission saved, so after a reboot the same
+#     mission is acknowledged again instead of downloaded again
+#   - logs delivery latency (queued on the website -> saved on the Pi)
 #
 # pip install requests
+#
+#   python catch_mission.py            # wait for one mission, save it, exit
+#   python catch_mission.py --forever  # keep receiving missions
+#   python catch_mission.py --poll     # conditional polling instead of long-poll
 
-import time
+import argparse
 import json
-import requests
+import random
+import time
+from datetime import datetime, timezone
 from pathlib import Path
 
-BASE = "https://agrivision-website-v2.onrender.com" 
-USER_ID = "7dd1806f-97d7-4228-95eb-c45e8b52b283"
+import requests
 
-POLL_SECONDS = 2
-OUT_PATH = Path("mission.json")
+from device_auth import TOKEN_PATH, DeviceAuth
 
+BASE = "https://agrivision-website-v2.onrender.com"
+USER_ID = "7dd1806f-97d7-4228-95eb-c45e8b52b283"
 
-def poll_latest_mission_for_user():
-    while True:
+WAIT_SECONDS = 25         # server-side hold per long-poll request
+MIN_INTERVAL = 1          # poll interval right after a mission arrived
+MAX_INTERVAL = 60         # idle poll interval cap
+MAX_ERROR_BACKOFF = 300   # error backoff cap
+OUT_PATH = Path("mission.json")
+STATE_PATH = Path("mission_state.json")
+
+
+def mission_age_seconds(mission_id):
+    """mission ids are the website's requested_at (UTC, %Y%m%dT%H%M%SZ)."""
+    try:
+        queued = datetime.strptime(mission_id, "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return None
+    return (datetime.now(timezone.utc) - queued).total_seconds()
+
+
+class MissionClient:
+    def __init__(self, base=BASE, user_id=USER_ID, token_path=TOKEN_PATH,
+                 out_path=OUT_PATH, state_path=STATE_PATH):
+        self.base = base
+        self.user_id = user_id
+        self.out_path = Path(out_path)
+        self.state_path = Path(state_path)
+        self.session = requests.Session()
+        self.auth = DeviceAuth(base, user_id, self.session, token_path)
+        self.etag = None
+        self.interval = MIN_INTERVAL
+        self.errors = 0
+        self.last_rtt = 0.0
+        self.state = self._load_state()
+
+    # ---------- persistent state ----------
+    def _load_state(self):
         try:
-            
-            r = requests.get(
-                f"{BASE}/device/missions/latest",
-                params={"user_id": USER_ID},
-                timeout=20,
-            )
-
-            if r.status_code != 200:
-                print("GET LATEST:", r.status_code, r.text)
-                time.sleep(POLL_SECONDS)
-                continue
-
-            data = r.json()
-            print(data)
-            
-            requested_by = data.get("requested_by")
-            requested_at = data.get("mission_id")
-
-            if not data or data.get("mission_id") is None:
-                print("No mission yet... waiting")
-                time.sleep(POLL_SECONDS)
-                continue
-
-            # mission becomes the JSON file content that matches requested_at + requested_by
-            dl = requests.get(
-                f"{BASE}/device/missions/download",
-                params={"requested_at": requested_at, "requested_by": requested_by},
-                timeout=20,
-                allow_redirects=True,
-            )
-
-            print(f"Mission received! id={requested_at}")
-
-            if dl.status_code != 200:
-                print("DOWNLOAD:", dl.status_code, dl.text[:200])
-                time.sleep(POLL_SECONDS)
-                continue
-
-            # Now parse JSON from the final response body
+            return json.loads(self.state_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self, mission_id):
+        self.state = {"last_mission_id": mission_id,
+                      "saved_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+        tmp = self.state_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.state), encoding="utf-8")
+        tmp.replace(self.state_path)
+
+    def already_have(self, mission_id):
+        return mission_id is not None and mission_id == self.state.get("last_mission_id")
+
+    # ---------- pacing ----------
+    def _sleep(self, seconds):
+        time.sleep(seconds * random.uniform(0.5, 1.0))   # jitter: a fleet doesn't poll in lockstep
+
+    def _idle(self):
+        self._sleep(self.interval)
+        self.interval = min(MAX_INTERVAL, self.interval * 2)
+
+    def _active(self):
+        self.interval = MIN_INTERVAL
+
+    def _error(self, retry_after=None):
+        self.errors += 1
+        delay = retry_after or min(MAX_ERROR_BACKOFF, MIN_INTERVAL * 2 ** self.errors)
+        print(f"Backing off {delay:.0f}s (errors in a row: {self.errors})")
+        self._sleep(delay)
+
+    @staticmethod
+    def _retry_after(r):
+        try:
+            return float(r.headers.get("Retry-After", ""))
+        except ValueError:
+            return None
+
+    def _identity(self):
+        return self.auth.identity()
+
+    # ---------- server calls ----------
+    def _call(self, method, path, **kwargs):
+        """One request; on a 401 the device token is renewed (see device_auth.py) and the request retried once."""
+        r = self.session.request(method, f"{self.base}{path}", **kwargs)
+        if r.status_code == 401 and self.auth.renew():
+            r = self.session.request(method, f"{self.base}{path}", **kwargs)
+        return r
+
+    def claim(self, wait=0):
+        """One claim; wait > 0 long-polls. Returns the response JSON, or None after an error."""
+        t0 = time.monotonic()
+        r = self._call(
+            "POST", "/device/missions/claim",
+            params={"timeout": wait} if wait else None,
+            json=self._identity(),
+            timeout=wait + 15,
+        )
+        self.last_rtt = time.monotonic() - t0
+        if r.status_code != 200:
+            print("CLAIM:", r.status_code, r.text[:200])
+            self._error(self._retry_after(r))
+            return None
+        self.errors = 0
+        return r.json()
+
+    def latest(self):
+        """
+        Conditional GET of the newest pending mission.
+        Returns the JSON, {} when unchanged since last time (304), or None after an error.
+        """
+        headers = {"If-None-Match": self.etag} if self.etag else {}
+        r = self._call("GET", "/device/missions/latest", params=self._identity(),
+                       headers=headers, timeout=20)
+        if r.status_code in (200, 304):
+            self.errors = 0
+        if r.status_code == 304:
+            return {}
+        if r.status_code != 200:
+            print("GET LATEST:", r.status_code, r.text[:200])
+            self._error(self._retry_after(r))
+            return None
+        self.etag = r.headers.get("ETag")
+        return r.json()
+
+    def ack(self, mission_id):
+        r = self._call("POST", "/device/missions/ack",
+                       json={"requested_at": mission_id, **self._identity()}, timeout=20)
+        print("ACK:", r.status_code, r.text[:200])
+
+    def save(self, mission_id, mission):
+        # Write then rename, so a power cut never leaves a half-written mission.json
+        tmp = self.out_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(mission, indent=2), encoding="utf-8")
+        tmp.replace(self.out_path)
+        self._save_state(mission_id)
+
+        age = mission_age_seconds(mission_id)
+        latency = f"{age:.1f}s after it was queued" if age is not None else "latency unknown"
+        print(f"Mission {mission_id} saved to {self.out_path.resolve()} ({latency})")
+
+    # ---------- loop ----------
+    def wait_for_mission(self, long_poll=True):
+        """Blocks until a new mission is saved. Returns the mission dict."""
+        while True:
             try:
-                mission = dl.json()
-            except Exception:
-                print("DOWNLOAD returned non-JSON:", dl.headers.get("Content-Type"), dl.text[:200])
-                time.sleep(POLL_SECONDS)
-                continue
-
-            OUT_PATH.write_text(json.dumps(mission, indent=2), encoding="utf-8")
-            print(f"Saved to: {OUT_PATH.resolve()}")
-
-            # 2) ACK it (so next poll doesn't return the same mission)
-            if mission:
-                ack = requests.post(
-                    f"{BASE}/device/missions/ack",
-                    json={"requested_at": requested_at, "user_id": USER_ID},
-                    timeout=20,
-                )
-                print("ACK:", ack.status_code, ack.text)
-
-            return mission
-
-        except requests.RequestException as e:
-            print("Network error:", e)
-            time.sleep(POLL_SECONDS)
-        except Exception as e:
-            print("Unexpected error:", e)
-            time.sleep(POLL_SECONDS)
+                if long_poll:
+                    data = self.claim(wait=WAIT_SECONDS)
+                    if data is None:
+                        continue
+                    if data.get("mission_id") is None:
+                        if self.last_rtt < 1:
+                            self._idle()   # answered without holding (server busy): slow down
+                        continue
+                else:
+                    latest = self.latest()
+                    if latest is None:
+                        continue
+                    if latest.get("mission_id") is None:
+                        self._idle()
+                        continue
+                    if self.already_have(latest["mission_id"]):
+                        # Saved before a reboot but the server never heard back: acknowledge, don't refetch
+                        self.ack(latest["mission_id"])
+                        self._idle()
+                        continue
+                    data = self.claim()
+                    if not data or data.get("mission_id") is None:
+                        # Claim failed or another device got it first: forget the ETag so
+                        # the next poll reads the queue again instead of a 304 that still
+                        # points at this mission
+                        self.etag = None
+                        continue
+
+                # A claimed mission is already marked delivered on the server: always keep it
+                mission_id = data["mission_id"]
+                self._active()
+                self.save(mission_id, data.get("mission"))
+                return data.get("mission")
+
+            except requests.RequestException as e:
+                print("Network error:", e)
+                self._error()
+            except Exception as e:
+                print("Unexpected error:", e)
+                self._error()
+
+
+def poll_latest_mission_for_user(long_poll=True):
+    return MissionClient().wait_for_mission(long_poll=long_poll)
 
 
 def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--forever", action="store_true", help="keep receiving missions")
+    ap.add_argument("--poll", action="store_true", help="conditional polling instead of long-poll")
+    args = ap.parse_args()
+
     print("Waiting for latest mission uploads for user:", USER_ID)
-    poll_latest_mission_for_user()
+    client = MissionClient()
+    while True:
+        client.wait_for_mission(long_poll=not args.poll)
+        if not args.forever:
+            break
 
 
 if __name__ == "__main__":
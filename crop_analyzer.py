@@ -1,51 +1,103 @@
 # ml_runner.py
+# TF / OpenCV / PIL are imported on first use, so importing this module is cheap.
+# Call warmup() at boot to pay model load + first predict up front.
 import os
-import io
-import numpy as np
-from PIL import Image
-import tensorflow as tf
-import cv2
+import threading
+import time
+
+from micro_batch import MicroBatcher
+import inference_backends
 
 MODEL_PATH = os.getenv("MODEL_PATH", "models/model.h5")
+# (w, h) the model takes; same setting as app.py / inference_worker.py
+INPUT_SIZE = tuple(int(v) for v in os.getenv("MODEL_INPUT_SIZE", "224,224").split(","))
+
+# Micro-batching: trade a few ms of latency for one predict() per burst of uploads
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "20"))
+
 _model = None
+_batcher = None
+_buffers = None
+_lock = threading.Lock()
+metrics = {}
 
 def get_model():
     global _model
     if _model is None:
-        _model = tf.keras.models.load_model(MODEL_PATH, compile=False)
+        t0 = time.perf_counter()
+        _model = inference_backends.load_backend(MODEL_PATH)  # keras or tflite, per INFER_BACKEND
+        metrics["model_load_ms"] = round((time.perf_counter() - t0) * 1000, 1)
     return _model
 
-def run_inference(image_bytes: bytes):
+def get_batcher():
+    global _batcher, _buffers
+    with _lock:
+        if _batcher is None:
+            import preprocess
+            model = get_model()
+            _buffers = preprocess.BatchBuffer()
+            _batcher = MicroBatcher(
+                # uint8 frames go straight into the reusable float32 batch buffer
+                lambda frames: model.predict(_buffers.from_frames(frames), verbose=0),
+                max_batch=BATCH_MAX_SIZE,
+                max_wait_ms=BATCH_MAX_WAIT_MS,
+                stack=False,
+            )
+    return _batcher
+
+def run_inference(image_bytes: bytes, size=None):
     """
     Returns: (result_png_bytes, metrics_dict)
-    NOTE: Adjust TARGET_SIZE to your model input.
+    size: model input (w, h); defaults to MODEL_INPUT_SIZE.
+    Safe to call from many threads at once; concurrent calls share one predict().
     """
-    TARGET_SIZE = (224, 224)  # <-- CHANGE THIS if your model uses different input
-
-    model = get_model()
-
-    img = Image.open(io.BytesIO(image_bytes)).convert("RGB").resize(TARGET_SIZE)
-    img_rgb = np.array(img, dtype=np.uint8)
+    import numpy as np
+    import preprocess
 
-    x = img_rgb.astype(np.float32) / 255.0
-    x = np.expand_dims(x, axis=0)
+    frame = preprocess.load_frame(image_bytes, size or INPUT_SIZE)
 
-    pred = model.predict(x)
+    probs = get_batcher().predict(frame)
 
     # Basic classification-style output
-    if pred.ndim == 2 and pred.shape[0] == 1:
-        probs = pred[0]
+    if probs.ndim == 1:
         cls = int(np.argmax(probs))
         conf = float(np.max(probs))
 
-        bgr = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
-        cv2.putText(bgr, f"class={cls} conf={conf:.2f}", (10, 30),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
-
-        ok, buf = cv2.imencode(".png", bgr)
-        return buf.tobytes(), {"class": cls, "confidence": conf, "health_score": int(conf * 100)}
+        preprocess.label(frame, f"class={cls} conf={conf:.2f}")
+        return preprocess.encode_png(frame), {"class": cls, "confidence": conf, "health_score": int(conf * 100)}
 
     # Fallback: just return the resized image
-    bgr = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
+    return preprocess.encode_png(frame), {"health_score": 0}
+
+def run_tiled_inference(image_bytes: bytes, size=None):
+    """
+    Full-resolution variant of run_inference: overlapping model-sized tiles are
+    scored in batches and stitched into a heatmap overlay.
+    Tile overlap / max tiles / batch come from TILE_OVERLAP, TILE_MAX, TILE_BATCH.
+    Returns: (result_png_bytes, metrics_dict)
+    """
+    import cv2
+    import preprocess
+    import tiling
+
+    model = get_model()
+    img_rgb = preprocess.load_full(image_bytes)
+
+    bgr, tile_metrics = tiling.analyze_tiled(lambda b: model.predict(b, verbose=0), img_rgb, size or INPUT_SIZE)
     ok, buf = cv2.imencode(".png", bgr)
-    return buf.tobytes(), {"health_score": 0}
+    return buf.tobytes(), tile_metrics
+
+def warmup(size=None):
+    """
+    Load the model and push one dummy frame through the batcher, so the first real
+    analysis doesn't absorb graph building. Returns the timings (also kept in `metrics`).
+    size: model input (w, h); defaults to MODEL_INPUT_SIZE.
+    """
+    import numpy as np
+
+    t0 = time.perf_counter()
+    w, h = size or INPUT_SIZE
+    get_batcher().predict(np.zeros((h, w, 3), dtype=np.uint8))
+    metrics["warmup_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return dict(metrics)
@@ -0,0 +1,225 @@
+# device_agent.py
+# Raspberry Pi: watch the camera's capture folder and ship new photos to the
+# website through /device/upload, surviving reboots and uplink outages.
+#
+#   capture dir  --(resize / recompress)-->  spool dir  --(upload, backoff)-->  /device/upload
+#
+# - captures are copied into SPOOL_DIR (write to .tmp, then rename) before anything
+#   is sent, so a reboot or a dead LTE link never loses a photo
+# - optional downsize to MAX_SIDE px / JPEG_QUALITY before spooling: on 3G/LTE the
+#   bytes saved matter more than the CPU spent
+# - one keep-alive requests.Session for every upload; exponential backoff with
+#   jitter on network errors and 5xx, capped at MAX_BACKOFF
+# - uploads are oldest-first; a 400/413/415 (this file is bad) moves the item to
+#   SPOOL_DIR/failed so one bad file can't block the queue. Any other error,
+#   including 401/403/404 (the agent's credentials or user are wrong, not the
+#   file), keeps the queue intact and backs off
+# - device token auth via device_auth.py (copy it alongside); the token pair is
+#   kept in SPOOL_DIR/device_token.json, and a 401 renews it and retries once
+#
+# pip install requests pillow
+#
+#   python device_agent.py --capture-dir /home/pi/captures
+#   python device_agent.py --capture-dir /home/pi/captures --max-side 2048 --quality 82
+
+import argparse
+import json
+import mimetypes
+import os
+import random
+import shutil
+import time
+from pathlib import Path
+
+import requests
+
+from device_auth import DeviceAuth
+
+BASE = "https://agrivision-website-v2.onrender.com"
+USER_ID = "7dd1806f-97d7-4228-95eb-c45e8b52b283"
+
+SPOOL_DIR = Path("spool")
+SCAN_SECONDS = 2
+SETTLE_SECONDS = 3          # a capture must be unchanged this long before we touch it
+MAX_BACKOFF = 300
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp", ".tif", ".tiff"}
+REJECT_STATUSES = {400, 413, 415}   # the file itself was refused; anything else is retried
+
+
+def compress(src, dest, max_side, quality):
+    """Downsize to max_side on the long edge and re-encode as JPEG. Keeps EXIF."""
+    from PIL import Image, ImageOps
+
+    with Image.open(src) as img:
+        # Pixels are rotated upright here, so the saved EXIF must say Orientation=1;
+        # the original bytes would make viewers (and thumbnails.py) rotate again
+        img = ImageOps.exif_transpose(img)
+        exif = img.getexif()
+        if 0x0112 in exif:
+            exif[0x0112] = 1
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        if max_side and max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+        kwargs = {"quality": quality, "optimize": True, "progressive": True}
+        if exif:
+            kwargs["exif"] = exif.tobytes()
+        img.save(dest, "JPEG", **kwargs)
+
+
+class Spool:
+    """Persistent FIFO of files waiting to be uploaded, plus a record of captures already taken in."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.failed = self.root / "failed"
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.failed.mkdir(exist_ok=True)
+        self.seen_path = self.root / "seen.json"
+        try:
+            self.seen = json.loads(self.seen_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            self.seen = {}
+
+    def _save_seen(self):
+        tmp = self.seen_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.seen), encoding="utf-8")
+        os.replace(tmp, self.seen_path)
+
+    @staticmethod
+    def _key(path, st):
+        return f"{path.name}:{st.st_size}:{int(st.st_mtime)}"
+
+    def is_seen(self, path, st):
+        return self._key(path, st) in self.seen
+
+    def add(self, path, st, max_side, quality):
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(st.st_mtime))
+        name = f"{stamp}_{path.stem}"
+        if max_side or quality < 100:
+            name += ".jpg"
+            tmp = self.root / (name + ".tmp")
+            try:
+                compress(path, tmp, max_side, quality)
+            except Exception as e:
+                print("Compress failed, sending original:", path.name, e)
+                name = f"{stamp}_{path.name}"
+                tmp = self.root / (name + ".tmp")
+                shutil.copyfile(path, tmp)
+        else:
+            name = f"{stamp}_{path.name}"
+            tmp = self.root / (name + ".tmp")
+            shutil.copyfile(path, tmp)
+
+        os.replace(tmp, self.root / name)  # atomic: a half-written file is never queued
+        self.seen[self._key(path, st)] = name
+        self._save_seen()
+
+    def pending(self):
+        return sorted(p for p in self.root.iterdir() if p.is_file() and p.suffix.lower() in IMAGE_EXTS)
+
+    def done(self, item):
+        item.unlink(missing_ok=True)
+
+    def reject(self, item):
+        os.replace(item, self.failed / item.name)
+
+
+def scan(capture_dir, spool, max_side, quality):
+    now = time.time()
+    for entry in sorted(Path(capture_dir).iterdir()):
+        if not entry.is_file() or entry.suffix.lower() not in IMAGE_EXTS:
+            continue
+        st = entry.stat()
+        if now - st.st_mtime < SETTLE_SECONDS or spool.is_seen(entry, st):
+            continue
+        try:
+            spool.add(entry, st, max_side, quality)
+            print("Queued:", entry.name)
+        except OSError as e:
+            print("Queue failed:", entry.name, e)
+
+
+def upload(session, item, auth):
+    original_name = item.name.split("_", 1)[-1]   # drop the spool's timestamp prefix
+    content_type = mimetypes.guess_type(item.name)[0] or "application/octet-stream"
+    with open(item, "rb") as f:
+        return session.post(
+            f"{BASE}/device/upload",
+            data=auth.identity(),
+            files={"image": (original_name, f, content_type)},
+            timeout=(10, 120),
+        )
+
+
+def drain(session, spool, auth, state):
+    """Send everything queued. Returns when the queue is empty or the uplink fails."""
+    for item in spool.pending():
+        try:
+            t0 = time.perf_counter()
+            r = upload(session, item, auth)
+            if r.status_code == 401 and auth.renew():
+                r = upload(session, item, auth)
+        except requests.RequestException as e:
+            print("Network error:", e)
+            return False
+
+        if r.status_code == 200:
+            size_kb = item.stat().st_size / 1024
+            print(f"Uploaded {item.name} ({size_kb:.0f} KB in {time.perf_counter() - t0:.1f}s):", r.json().get("image_path"))
+            spool.done(item)
+            state["backoff"] = 0
+            continue
+
+        if r.status_code in REJECT_STATUSES:
+            print("Rejected, moving to failed/:", item.name, r.status_code, r.text[:200])
+            spool.reject(item)
+            continue
+
+        if r.status_code in (401, 403, 404):
+            print("Agent not authorized (check --user-id / device token), keeping queue:", r.status_code, r.text[:200])
+        else:
+            print("Server error:", r.status_code, r.text[:200])
+        return False
+    return True
+
+
+def next_backoff(current):
+    return 2 if current == 0 else min(MAX_BACKOFF, current * 2)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--capture-dir", required=True)
+    ap.add_argument("--spool-dir", default=str(SPOOL_DIR))
+    ap.add_argument("--user-id", default=USER_ID)
+    ap.add_argument("--max-side", type=int, default=0, help="downsize long edge to this many px (0 = keep)")
+    ap.add_argument("--quality", type=int, default=100, help="JPEG quality when recompressing (100 = keep file)")
+    args = ap.parse_args()
+
+    spool = Spool(args.spool_dir)
+    session = requests.Session()   # one TLS handshake, reused for every upload
+    auth = DeviceAuth(BASE, args.user_id, session, spool.root / "device_token.json")
+    state = {"backoff": 0}
+    retry_at = 0.0
+
+    print("Watching", args.capture_dir, "-> spool", spool.root.resolve(), "| queued:", len(spool.pending()))
+
+    while True:
+        try:
+            scan(args.capture_dir, spool, args.max_side, args.quality)
+        except OSError as e:
+            print("Scan failed:", e)
+
+        if time.time() >= retry_at and spool.pending():
+            if not drain(session, spool, auth, state):
+                state["backoff"] = next_backoff(state["backoff"])
+                delay = state["backoff"] * random.uniform(0.5, 1.0)  # jitter keeps a fleet from retrying in lockstep
+                retry_at = time.time() + delay
+                print(f"Uplink unavailable, retrying in {delay:.0f}s ({len(spool.pending())} queued)")
+
+        time.sleep(SCAN_SECONDS)
+
+
+if __name__ == "__main__":
+    main()
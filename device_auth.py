@@ -0,0 +1,91 @@
+# device_auth.py
+# Raspberry Pi side of device tokens (see device_tokens.py on the server), shared
+# by catch_mission.py and device_agent.py. Copy it next to them on the Pi.
+#
+# - the token pair from /device/connect_user is kept in TOKEN_PATH, so a reboot
+#   reuses it instead of pairing again
+# - every call carries Authorization: Bearer <token> once a token is known;
+#   until then (or when the server issues none) calls send user_id as before
+# - on a 401, renew() first tries /device/token/refresh; if the refresh token is
+#   rejected too (expired, revoked), it pairs again through /device/connect_user.
+#   The caller then retries its request once.
+
+import json
+import os
+from pathlib import Path
+
+import requests
+
+TOKEN_PATH = Path("device_token.json")
+
+
+class DeviceAuth:
+    def __init__(self, base, user_id, session, path=TOKEN_PATH):
+        self.base = base
+        self.user_id = user_id
+        self.session = session
+        self.path = Path(path)
+        try:
+            self.tokens = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            self.tokens = {}
+        self._apply()
+
+    def _apply(self):
+        if self.tokens.get("token"):
+            self.session.headers["Authorization"] = f"Bearer {self.tokens['token']}"
+        else:
+            self.session.headers.pop("Authorization", None)
+
+    def _store(self, tokens):
+        self.tokens = tokens
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(tokens), encoding="utf-8")
+        os.replace(tmp, self.path)
+        self._apply()
+
+    @property
+    def has_token(self):
+        return bool(self.tokens.get("token"))
+
+    def identity(self):
+        """Extra request fields: none with a token, the user_id without one."""
+        return {} if self.has_token else {"user_id": self.user_id}
+
+    def renew(self):
+        """
+        After a 401: refresh the token pair, or pair again if that fails.
+        Returns True if the request is worth retrying with the new credentials.
+        """
+        refresh_token = self.tokens.get("refresh_token")
+        if refresh_token:
+            try:
+                r = self.session.post(f"{self.base}/device/token/refresh",
+                                      json={"refresh_token": refresh_token}, timeout=20)
+            except requests.RequestException as e:
+                print("TOKEN REFRESH:", e)
+                return False
+            if r.status_code == 200:
+                self._store({**self.tokens, **r.json()})
+                return True
+            print("TOKEN REFRESH:", r.status_code, r.text[:200])
+            if r.status_code != 401:
+                return False   # server-side trouble (e.g. 503): keep the pair, back off
+
+        try:
+            r = self.session.post(f"{self.base}/device/connect_user",
+                                  json={"user_id": self.user_id}, timeout=20)
+        except requests.RequestException as e:
+            print("CONNECT:", e)
+            return False
+        if r.status_code != 200:
+            print("CONNECT:", r.status_code, r.text[:200])
+            return False
+        data = r.json()
+        if not data.get("token"):
+            print("CONNECT: server issued no device token")
+            return False
+        self._store({"device_id": data.get("device_id"), "token": data["token"],
+                     "refresh_token": data.get("refresh_token")})
+        print("Paired as device", data.get("device_id"))
+        return True
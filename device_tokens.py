@@ -0,0 +1,172 @@
+# device_tokens.py
+# Signed, expiring device tokens (HS256 JWT), so device calls are authenticated
+# locally instead of re-checking a raw user_id against Supabase every time.
+#
+#   /device/connect_user  -> {"token", "refresh_token", "expires_in"}
+#   device calls          -> Authorization: Bearer <token>
+#   /device/token/refresh -> new pair; the old refresh token is revoked (rotation)
+#   /device/token/revoke  -> kill a device (all its tokens) or one token
+#
+# Access tokens are short-lived (DEVICE_TOKEN_TTL), refresh tokens long-lived.
+# Revocations are rows in deviceTokenRevocations (device_id, jti, revoked_at);
+# each worker keeps them as in-memory sets reloaded in the background every
+# DEVICE_REVOCATION_REFRESH seconds, so verify() doesn't wait on the database
+# (after the first load) and a revocation made on another worker applies within
+# that interval. Until one load has succeeded, verify() fails closed.
+#
+# Tokens need a real secret (DEVICE_TOKEN_SECRET, or FLASK_SECRET_KEY); with
+# none set, issue() and verify() raise TokenUnavailable instead of signing with
+# a public default.
+
+import os
+import threading
+import time
+import uuid
+
+import jwt
+
+_DEFAULT_SECRET = "dev_secret_change_me"   # app.py's dev fallback for FLASK_SECRET_KEY; never sign with it
+DEVICE_TOKEN_SECRET = os.getenv("DEVICE_TOKEN_SECRET") or os.getenv("FLASK_SECRET_KEY")
+DEVICE_TOKEN_TTL = int(os.getenv("DEVICE_TOKEN_TTL", str(3600)))
+DEVICE_REFRESH_TTL = int(os.getenv("DEVICE_REFRESH_TTL", str(30 * 24 * 3600)))
+DEVICE_REVOCATION_REFRESH = int(os.getenv("DEVICE_REVOCATION_REFRESH", "30"))
+DEVICE_REVOCATION_RETRY = int(os.getenv("DEVICE_REVOCATION_RETRY", "5"))   # until the first load succeeds
+REVOCATION_TABLE = "deviceTokenRevocations"
+
+_ALGORITHM = "HS256"
+
+
+class TokenError(Exception):
+    pass
+
+
+class TokenUnavailable(TokenError):
+    """Tokens can't be checked right now (no secret configured, revocation list not loaded)."""
+
+
+class DeviceTokens:
+    def __init__(self, supabase, secret=DEVICE_TOKEN_SECRET, ttl=DEVICE_TOKEN_TTL,
+                 refresh_ttl=DEVICE_REFRESH_TTL, reload_seconds=DEVICE_REVOCATION_REFRESH):
+        self.supabase = supabase
+        self.secret = secret if secret and secret != _DEFAULT_SECRET else None
+        self.ttl = ttl
+        self.refresh_ttl = refresh_ttl
+        self.reload_seconds = reload_seconds
+        self._lock = threading.Lock()
+        self._revoked_devices = set()
+        self._revoked_jtis = set()
+        self._loaded_at = 0.0
+        self._loaded_ok = False
+        self._loading = False
+
+    @property
+    def enabled(self):
+        return self.secret is not None
+
+    def _encode(self, user_id, device_id, typ, ttl):
+        if not self.enabled:
+            raise TokenUnavailable("device tokens are not configured (set DEVICE_TOKEN_SECRET)")
+        now = int(time.time())
+        claims = {"sub": user_id, "did": device_id, "typ": typ,
+                  "jti": uuid.uuid4().hex, "iat": now, "exp": now + ttl}
+        return jwt.encode(claims, self.secret, algorithm=_ALGORITHM)
+
+    def issue(self, user_id, device_id):
+        return {
+            "token": self._encode(user_id, device_id, "device", self.ttl),
+            "refresh_token": self._encode(user_id, device_id, "refresh", self.refresh_ttl),
+            "expires_in": self.ttl,
+        }
+
+    def verify(self, token, typ="device"):
+        """Returns the claims dict or raises TokenError. No network on the hot path."""
+        if not self.enabled:
+            raise TokenUnavailable("device tokens are not configured (set DEVICE_TOKEN_SECRET)")
+        try:
+            claims = jwt.decode(token, self.secret, algorithms=[_ALGORITHM],
+                                options={"require": ["sub", "did", "jti", "exp"]})
+        except jwt.ExpiredSignatureError:
+            raise TokenError("token expired")
+        except jwt.InvalidTokenError as e:
+            raise TokenError(f"invalid token: {e}")
+
+        if claims.get("typ") != typ:
+            raise TokenError("wrong token type")
+
+        self._maybe_reload()
+        with self._lock:
+            if not self._loaded_ok:
+                raise TokenUnavailable("revocation list not loaded yet")
+            if claims["did"] in self._revoked_devices or claims["jti"] in self._revoked_jtis:
+                raise TokenError("token revoked")
+        return claims
+
+    def refresh(self, refresh_token):
+        """Rotate: verify the refresh token, revoke it, and issue a fresh pair."""
+        claims = self.verify(refresh_token, typ="refresh")
+        self.revoke(jti=claims["jti"], device_id=None, expires_at=claims["exp"])
+        return self.issue(claims["sub"], claims["did"])
+
+    def revoke(self, device_id=None, jti=None, expires_at=None):
+        row = {"device_id": device_id, "jti": jti,
+               "revoked_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+        if expires_at:
+            row["expires_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(expires_at))
+        self.supabase.table(REVOCATION_TABLE).insert(row).execute()
+        with self._lock:
+            if device_id:
+                self._revoked_devices.add(device_id)
+            if jti:
+                self._revoked_jtis.add(jti)
+
+    def _maybe_reload(self):
+        with self._lock:
+            interval = self.reload_seconds if self._loaded_ok else min(DEVICE_REVOCATION_RETRY, self.reload_seconds)
+            if self._loading or time.monotonic() - self._loaded_at < interval:
+                return
+            self._loading = True
+            first = not self._loaded_ok
+        if first:
+            self._reload()   # verify() rejects every token until this has succeeded once
+        else:
+            threading.Thread(target=self._reload, daemon=True).start()
+
+    def _reload(self):
+        try:
+            devices, jtis = set(), set()
+            now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+            start, page = 0, 1000
+            while True:
+                rows = (
+                    self.supabase.table(REVOCATION_TABLE)
+                    .select("device_id, jti")
+                    # a revoked token past its own expiry can't be used anyway
+                    .or_(f"expires_at.is.null,expires_at.gt.{now}")
+                    .range(start, start + page - 1)
+                    .execute()
+                ).data or []
+                for r in rows:
+                    if r.get("device_id"):
+                        devices.add(r["device_id"])
+                    if r.get("jti"):
+                        jtis.add(r["jti"])
+                if len(rows) < page:
+                    break
+                start += page
+            with self._lock:
+                self._revoked_devices, self._revoked_jtis = devices, jtis
+                self._loaded_ok = True
+        except Exception as e:
+            # Keep the last known list; a Supabase blip must not lock every device out
+            # (before the first successful load there is no list, and verify() fails closed)
+            print("REVOCATION RELOAD FAILED:", e)
+        finally:
+            with self._lock:
+                self._loaded_at = time.monotonic()
+                self._loading = False
+
+    def stats(self):
+        with self._lock:
+            return {"enabled": self.enabled, "revocations_loaded": self._loaded_ok,
+                    "revoked_devices": len(self._revoked_devices), "revoked_tokens": len(self._revoked_jtis),
+                    "loaded_seconds_ago": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None}
@@ -0,0 +1,139 @@
+# http_cache.py
+# Conditional GET for read-heavy JSON routes (history gallery, device mission
+# polling, map targets).
+#
+# ETags come from version markers, not from the response body: every write path
+# (uploads, mission queue, ack) bumps the marker for what it changed, and a GET
+# compares If-None-Match against the marker *before* touching the database, so a
+# 304 costs one stat() call.
+#
+# Markers are empty files under HTTP_CACHE_DIR whose mtime_ns is the version, so
+# all gunicorn workers on the box see each other's bumps (same idea as the upload
+# spool). Rows written outside this app (dashboard edits, DB triggers) can't bump
+# a marker, so each ETag also carries a HTTP_CACHE_WINDOW-second time bucket:
+# nothing is served stale for longer than that.
+# /history/images reads requestImages, which is only written outside this app,
+# so its ETag also carries the newest row (HISTORY_HEAD_TTL-cached per user, so
+# most checks make no query at all).
+# Responses with such a variant send no Last-Modified: only the ETag covers it.
+
+import hashlib
+import os
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+
+from flask import Response, request
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+HTTP_CACHE_DIR = os.getenv("HTTP_CACHE_DIR", os.path.join(BASE_DIR, "cache", "versions"))
+HTTP_CACHE_WINDOW = int(os.getenv("HTTP_CACHE_WINDOW", "60"))
+HTTP_CACHE_POLL = float(os.getenv("HTTP_CACHE_POLL", "1"))   # wait(): how often to look for other workers' bumps
+
+
+class VersionMarkers:
+    def __init__(self, root=HTTP_CACHE_DIR, window=HTTP_CACHE_WINDOW):
+        self.root = root
+        self.window = window
+        self._lock = threading.Lock()
+        self._changed = threading.Condition()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        # keys contain user ids; hash them into safe, fixed-length file names
+        return os.path.join(self.root, hashlib.sha1(key.encode()).hexdigest())
+
+    def bump(self, *keys):
+        """Move each key to a new version; returns the last key's new version."""
+        ns = 0
+        for key in keys:
+            path = self._path(key)
+            with self._lock:
+                try:
+                    ns = max(time.time_ns(), os.stat(path).st_mtime_ns + 1)
+                except OSError:
+                    open(path, "a").close()
+                    ns = time.time_ns()
+                os.utime(path, ns=(ns, ns))
+        with self._changed:
+            self._changed.notify_all()
+        return ns
+
+    def version(self, key):
+        try:
+            return os.stat(self._path(key)).st_mtime_ns
+        except OSError:
+            return 0
+
+    def wait(self, key, version, timeout, poll=HTTP_CACHE_POLL):
+        """
+        Block until `key` moves past `version` (from version()) or timeout. Returns True if it moved.
+        Bumps in this process wake the waiter at once; bumps made by other workers
+        are noticed within `poll` seconds (a stat() each time, no database).
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                if self.version(key) != version:
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._changed.wait(min(remaining, poll))
+
+    def validators(self, *keys, variant=b""):
+        """
+        (etag, last_modified_seconds) for a response built from `keys`.
+        variant: anything else that changes the body (query string, ...).
+        """
+        bucket = int(time.time() // self.window) if self.window > 0 else 0
+        versions = [self.version(k) for k in keys]
+        h = hashlib.sha1(repr((versions, bucket)).encode())
+        h.update(variant)
+        modified = max([v / 1e9 for v in versions] + [bucket * self.window])
+        return h.hexdigest()[:20], int(modified)
+
+
+def not_modified(etag, last_modified):
+    """
+    True when the client's cached copy is current (If-None-Match wins over If-Modified-Since).
+    last_modified None: ETag only, If-Modified-Since is ignored.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    since = request.headers.get("If-Modified-Since")
+    if since and last_modified is not None:
+        try:
+            return int(parsedate_to_datetime(since).timestamp()) >= last_modified
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def cache_headers(etag, last_modified, cache_control):
+    headers = {"ETag": f'"{etag}"', "Cache-Control": cache_control}
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    return headers
+
+
+def conditional(markers, *keys, cache_control="private, no-cache", variant=b""):
+    """
+    Returns (response_304_or_None, headers). Use at the top of a GET route:
+
+        hit, headers = conditional(markers, f"history:{user_id}")
+        if hit:
+            return hit
+        ...
+        return body, 200, headers
+    """
+    etag, modified = markers.validators(*keys, variant=variant)
+    if variant:
+        # The variant (query string, data outside the markers) is only in the ETag;
+        # a marker-only Last-Modified would let If-Modified-Since skip its changes
+        modified = None
+    headers = cache_headers(etag, modified, cache_control)
+    if not_modified(etag, modified):
+        return Response(status=304, headers=headers), headers
+    return None, headers
@@ -0,0 +1,140 @@
+# identity_cache.py
+# "Does this user_id exist?" without a Supabase round trip per uploaded image.
+#
+# Tier 1: in-process TTL+LRU caches (cachetools), one for known ids and a
+#         shorter-lived one for unknown ids (negative caching), both bounded
+# Tier 2 (IDENTITY_SHARED=1): sqlite file shared by every worker on the box,
+#         so one worker's database lookup serves all of them
+#
+# register() and account changes call remember()/invalidate(). A local negative
+# entry is re-checked against tier 2 before it is trusted, so a user registered
+# through another worker is never turned away for IDENTITY_NEGATIVE_TTL.
+# invalidate() clears tier 2 and this worker's tier 1; other workers' tier 1
+# entries age out within IDENTITY_TTL.
+
+import os
+import sqlite3
+import threading
+import time
+
+from cachetools import TTLCache
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", "10000"))
+IDENTITY_TTL = int(os.getenv("IDENTITY_TTL", "300"))
+IDENTITY_NEGATIVE_TTL = int(os.getenv("IDENTITY_NEGATIVE_TTL", "30"))
+IDENTITY_SHARED = os.getenv("IDENTITY_SHARED", "0") == "1"
+IDENTITY_DB = os.getenv("IDENTITY_DB", os.path.join(BASE_DIR, "cache", "identity.sqlite3"))
+
+
+class IdentityCache:
+    def __init__(self, lookup, size=IDENTITY_CACHE_SIZE, ttl=IDENTITY_TTL,
+                 negative_ttl=IDENTITY_NEGATIVE_TTL, shared=IDENTITY_SHARED, db_path=IDENTITY_DB):
+        """lookup(user_id) -> bool, the authoritative (slow) check."""
+        self.lookup = lookup
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._known = TTLCache(maxsize=size, ttl=ttl)
+        self._unknown = TTLCache(maxsize=size, ttl=negative_ttl)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.db_path = db_path if shared else None
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+        if self.db_path:
+            if os.path.dirname(self.db_path):
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            with self._db() as db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS identities ("
+                    " user_id TEXT PRIMARY KEY, present INTEGER, expires_at REAL)"
+                )
+
+    def _db(self):
+        # sqlite connections can't be shared across threads; keep one per thread
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
+
+    def _shared_get(self, user_id):
+        if not self.db_path:
+            return None
+        row = self._db().execute(
+            "SELECT present FROM identities WHERE user_id = ? AND expires_at > ?", (user_id, time.time())
+        ).fetchone()
+        return None if row is None else bool(row[0])
+
+    def _shared_put(self, user_id, present):
+        if not self.db_path:
+            return
+        ttl = self.ttl if present else self.negative_ttl
+        with self._db() as db:
+            db.execute("INSERT OR REPLACE INTO identities VALUES (?, ?, ?)",
+                       (user_id, int(present), time.time() + ttl))
+
+    def _local_put(self, user_id, present):
+        with self._lock:
+            if present:
+                self._unknown.pop(user_id, None)
+                self._known[user_id] = True
+            else:
+                self._known.pop(user_id, None)
+                self._unknown[user_id] = True
+
+    def exists(self, user_id):
+        with self._lock:
+            known = user_id in self._known
+            unknown = not known and user_id in self._unknown
+        if known:
+            self.hits += 1
+            return True
+
+        shared = self._shared_get(user_id)
+        if unknown and not shared:
+            self.negative_hits += 1
+            return False
+        if shared is not None:
+            self.shared_hits += 1
+            self._local_put(user_id, shared)
+            return shared
+
+        self.misses += 1
+        present = bool(self.lookup(user_id))
+        self._local_put(user_id, present)
+        self._shared_put(user_id, present)
+        return present
+
+    def remember(self, user_id):
+        """A user was just created: cache it as known everywhere."""
+        self._local_put(user_id, True)
+        self._shared_put(user_id, True)
+
+    def invalidate(self, user_id):
+        """Account changed or deleted: the next check goes to the database."""
+        with self._lock:
+            self._known.pop(user_id, None)
+            self._unknown.pop(user_id, None)
+        if self.db_path:
+            with self._db() as db:
+                db.execute("DELETE FROM identities WHERE user_id = ?", (user_id,))
+
+    def stats(self):
+        lookups = self.hits + self.negative_hits + self.shared_hits + self.misses
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_ratio": round(1 - self.misses / lookups, 3) if lookups else None,
+            "known": len(self._known),
+            "unknown": len(self._unknown),
+            "shared": bool(self.db_path),
+        }
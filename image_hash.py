@@ -0,0 +1,216 @@
+# image_hash.py
+# Exact + perceptual hashes for uploaded images, and a per-user index to find
+# duplicates fast.
+#
+#   sha256 - byte-identical retries (device re-sent after a timeout)
+#   dHash  - 64-bit gradient hash; a few bits apart = same spot photographed twice
+#   aHash  - 64-bit mean hash, stored alongside for later tuning
+#
+# Index rows live in the imageHashes table:
+#   requested_by, image_path, sha256, dhash (16 hex), ahash (16 hex), near_duplicate_of
+# (DDL in schema.sql, unique on requested_by + sha256)
+# Each user's rows are loaded once into memory and kept write-through; exact
+# misses are confirmed against the table, since other workers also write to it. Near-duplicate
+# search uses multi-index hashing: the 64 bits are split into HASH_NEAR_DISTANCE + 1
+# bands, and any hash within that Hamming distance must match at least one band
+# exactly (pigeonhole), so a query only compares against a handful of candidates
+# instead of the whole history.
+
+import hashlib
+import os
+import threading
+
+from cachetools import LRUCache
+
+HASH_NEAR_DISTANCE = int(os.getenv("HASH_NEAR_DISTANCE", "4"))    # max differing dHash bits
+HASH_INDEX_USERS = int(os.getenv("HASH_INDEX_USERS", "256"))      # per-user indexes kept in memory
+HASH_TABLE = "imageHashes"
+
+
+def sha256_file(path, chunk_bytes=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _bits_to_int(bits):
+    v = 0
+    for b in bits.ravel():
+        v = (v << 1) | int(b)
+    return v
+
+
+def perceptual_hashes(src):
+    """Returns (dhash, ahash) as 64-bit ints. src: path, bytes or file-like."""
+    import io
+    import numpy as np
+    from PIL import Image
+
+    if isinstance(src, (bytes, bytearray)):
+        src = io.BytesIO(src)
+    img = Image.open(src)
+    if img.format == "JPEG":
+        img.draft("L", (64, 64))  # we only need 9x8 pixels; decode as small as possible
+    gray = img.convert("L")
+
+    d = np.asarray(gray.resize((9, 8), resample=3), dtype=np.int16)   # 3 = BICUBIC
+    dhash = _bits_to_int(d[:, 1:] > d[:, :-1])
+
+    a = np.asarray(gray.resize((8, 8), resample=3), dtype=np.float32)
+    ahash = _bits_to_int(a > a.mean())
+    return dhash, ahash
+
+
+def fingerprint(path):
+    """(sha256, dhash, ahash) for a spooled upload; the perceptual hashes are None if it won't decode."""
+    sha = sha256_file(path)
+    try:
+        dhash, ahash = perceptual_hashes(path)
+    except Exception:
+        dhash = ahash = None
+    return sha, dhash, ahash
+
+
+def _parse(hex_value):
+    return int(hex_value, 16) if hex_value else None
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _bands(value, n_bands):
+    """Split 64 bits into n_bands contiguous bands -> [(band_no, band_value), ...]."""
+    width = 64 // n_bands
+    out = []
+    for i in range(n_bands):
+        lo = i * width
+        bits = width if i < n_bands - 1 else 64 - lo
+        out.append((i, (value >> lo) & ((1 << bits) - 1)))
+    return out
+
+
+class _UserIndex:
+    def __init__(self, distance):
+        self.distance = distance
+        self.n_bands = distance + 1
+        self.by_sha = {}
+        self.bands = {}      # (band_no, band_value) -> [(dhash, image_path)]
+
+    def add(self, image_path, sha, dhash):
+        self.by_sha.setdefault(sha, image_path)
+        if dhash is None:
+            return
+        for key in _bands(dhash, self.n_bands):
+            self.bands.setdefault(key, []).append((dhash, image_path))
+
+    def exact(self, sha):
+        return self.by_sha.get(sha)
+
+    def nearest(self, dhash):
+        if dhash is None:
+            return None
+        best = None
+        seen = set()
+        for key in _bands(dhash, self.n_bands):
+            for other, path in self.bands.get(key, ()):
+                if path in seen:
+                    continue
+                seen.add(path)
+                d = hamming(dhash, other)
+                if d <= self.distance and (best is None or d < best[0]):
+                    best = (d, path)
+        return best   # (distance, image_path) or None
+
+
+class HashIndex:
+    def __init__(self, supabase, distance=HASH_NEAR_DISTANCE, max_users=HASH_INDEX_USERS):
+        self.supabase = supabase
+        self.distance = distance
+        self._users = LRUCache(maxsize=max_users)
+        self._lock = threading.Lock()
+
+    def _load(self, user_id):
+        idx = _UserIndex(self.distance)
+        start, page = 0, 1000
+        while True:
+            rows = (
+                self.supabase.table(HASH_TABLE)
+                .select("image_path, sha256, dhash")
+                .eq("requested_by", user_id)
+                .range(start, start + page - 1)
+                .execute()
+            ).data or []
+            for r in rows:
+                idx.add(r["image_path"], r["sha256"], _parse(r["dhash"]))
+            if len(rows) < page:
+                return idx
+            start += page
+
+    def _index(self, user_id):
+        with self._lock:
+            idx = self._users.get(user_id)
+        if idx is None:
+            idx = self._load(user_id)
+            with self._lock:
+                idx = self._users.setdefault(user_id, idx)
+        return idx
+
+    def check(self, user_id, sha, dhash):
+        """
+        Returns {"duplicate_of": path} for a byte-identical image,
+        {"near_duplicate_of": path, "distance": d} for a perceptual match, else {}.
+        """
+        idx = self._index(user_id)
+        with self._lock:
+            exact = idx.exact(sha)
+            near = idx.nearest(dhash)
+        if exact:
+            return {"duplicate_of": exact}
+
+        # Another gunicorn worker may have stored the retry we are looking at;
+        # exact matches are cheap to confirm against the table
+        hit = (
+            self.supabase.table(HASH_TABLE)
+            .select("image_path")
+            .eq("requested_by", user_id)
+            .eq("sha256", sha)
+            .limit(1)
+            .execute()
+        ).data
+        if hit:
+            return {"duplicate_of": hit[0]["image_path"]}
+
+        if near:
+            return {"near_duplicate_of": near[1], "distance": near[0]}
+        return {}
+
+    def row(self, user_id, image_path, sha, dhash, ahash, near_duplicate_of=None):
+        return {
+            "requested_by": user_id,
+            "image_path": image_path,
+            "sha256": sha,
+            "dhash": None if dhash is None else f"{dhash:016x}",
+            "ahash": None if ahash is None else f"{ahash:016x}",
+            "near_duplicate_of": near_duplicate_of,
+        }
+
+    def add_many(self, rows):
+        """
+        Persist index rows (one bulk insert) and update the in-memory indexes.
+        (requested_by, sha256) is unique in the table (schema.sql): when two workers
+        both let the same bytes through check(), the later row is skipped, not
+        inserted twice, and the first stored path stays the one duplicates point to.
+        """
+        if not rows:
+            return
+        self.supabase.table(HASH_TABLE).upsert(
+            rows, on_conflict="requested_by,sha256", ignore_duplicates=True
+        ).execute()
+        with self._lock:
+            for r in rows:
+                idx = self._users.get(r["requested_by"])
+                if idx is not None and idx.exact(r["sha256"]) is None:
+                    idx.add(r["image_path"], r["sha256"], _parse(r["dhash"]))
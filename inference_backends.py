@@ -0,0 +1,114 @@
+# inference_backends.py
+# Backends behind get_model() / ml_infer.load_model(). Every backend exposes
+# predict(x, verbose=0) on an (N, h, w, 3) float32 batch, like a Keras model,
+# so callers don't care which one they got.
+#
+#   INFER_BACKEND=auto    .tflite path -> tflite, anything else -> keras (default)
+#   INFER_BACKEND=keras   tf.keras.models.load_model(MODEL_PATH)
+#   INFER_BACKEND=tflite  TFLite interpreter on TFLITE_MODEL_PATH
+#                         (default: MODEL_PATH with a .tflite extension)
+#   TFLITE_THREADS        interpreter threads (default: all cores)
+#
+# Build the .tflite file with: python tflite_tools.py convert --model models/CROP_MODEL.h5
+# Nothing heavy is imported until a backend is actually loaded.
+
+import os
+import threading
+
+INFER_BACKEND = os.getenv("INFER_BACKEND", "auto").lower()
+TFLITE_MODEL_PATH = os.getenv("TFLITE_MODEL_PATH")
+TFLITE_THREADS = int(os.getenv("TFLITE_THREADS", str(os.cpu_count() or 1)))
+
+
+def backend_name(model_path, backend=INFER_BACKEND):
+    if backend == "auto":
+        return "tflite" if model_path.endswith(".tflite") else "keras"
+    return backend
+
+
+def resolve_model_path(model_path, backend=INFER_BACKEND):
+    """The file the chosen backend will actually load (used for cache fingerprints too)."""
+    if backend_name(model_path, backend) == "tflite" and not model_path.endswith(".tflite"):
+        return TFLITE_MODEL_PATH or os.path.splitext(model_path)[0] + ".tflite"
+    return model_path
+
+
+class KerasBackend:
+    name = "keras"
+
+    def __init__(self, model_path):
+        import tensorflow as tf
+        self.model = tf.keras.models.load_model(model_path, compile=False)
+
+    def predict(self, x, verbose=0):
+        return self.model.predict(x, verbose=verbose)
+
+
+def _tflite_interpreter(model_path, threads):
+    # Prefer the small tflite-runtime wheel; fall back to full TF
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter(model_path=model_path, num_threads=threads)
+
+
+class TFLiteBackend:
+    name = "tflite"
+
+    def __init__(self, model_path, threads=TFLITE_THREADS):
+        self.interpreter = _tflite_interpreter(model_path, threads)
+        self.interpreter.allocate_tensors()
+        self._in = self.interpreter.get_input_details()[0]
+        self._out = self.interpreter.get_output_details()[0]
+        self._batch = int(self._in["shape"][0])
+        # The interpreter is stateful; one predict at a time
+        self._lock = threading.Lock()
+
+    @property
+    def quantized(self):
+        import numpy as np
+        return self._in["dtype"] in (np.int8, np.uint8)
+
+    def _resize(self, n):
+        if n != self._batch:
+            shape = list(self._in["shape"])
+            shape[0] = n
+            self.interpreter.resize_tensor_input(self._in["index"], shape)
+            self.interpreter.allocate_tensors()
+            self._in = self.interpreter.get_input_details()[0]
+            self._out = self.interpreter.get_output_details()[0]
+            self._batch = n
+
+    def predict(self, x, verbose=0):
+        import numpy as np
+
+        with self._lock:
+            self._resize(len(x))
+
+            if self.quantized:
+                scale, zero = self._in["quantization"]
+                info = np.iinfo(self._in["dtype"])
+                x = np.clip(np.round(x / scale + zero), info.min, info.max).astype(self._in["dtype"])
+            elif x.dtype != self._in["dtype"]:
+                x = x.astype(self._in["dtype"])
+
+            self.interpreter.set_tensor(self._in["index"], x)
+            self.interpreter.invoke()
+            out = self.interpreter.get_tensor(self._out["index"])
+
+            if self._out["dtype"] in (np.int8, np.uint8):
+                scale, zero = self._out["quantization"]
+                out = (out.astype(np.float32) - zero) * scale
+            return np.array(out)
+
+
+def load_backend(model_path, backend=INFER_BACKEND):
+    name = backend_name(model_path, backend)
+    path = resolve_model_path(model_path, backend)
+    if name == "tflite":
+        return TFLiteBackend(path)
+    if name == "keras":
+        return KerasBackend(path)
+    raise ValueError(f"unknown INFER_BACKEND: {backend}")
@@ -0,0 +1,221 @@
+# inference_pool.py
+# Flask side of the persistent TF workers (see inference_worker.py).
+# Spawns INFER_WORKERS processes in the TF venv, hands each request to an idle
+# worker, health-checks them in the background and restarts any that die.
+#
+# One pool per *process*: under gunicorn every worker process that serves an
+# analysis starts its own INFER_WORKERS TF processes, so the host runs
+# (gunicorn workers x INFER_WORKERS) model copies. Size memory for that, or keep
+# analysis on one process per host (e.g. gunicorn --workers 1 --threads N, which
+# the background job runner in jobs.py is built for).
+#
+# A worker that dies is never restarted on the request path: the request fails
+# at once with the real error and a background thread brings the worker back
+# (retrying every INFER_HEALTH_SECONDS), then returns it to the idle queue.
+
+import atexit
+import os
+import queue
+import secrets
+import subprocess
+import threading
+import time
+from multiprocessing.connection import Client
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+WORKER_SCRIPT = os.path.join(BASE_DIR, "inference_worker.py")
+
+INFER_WORKERS = int(os.getenv("INFER_WORKERS", "1"))
+INFER_TIMEOUT = float(os.getenv("INFER_TIMEOUT", "60"))
+INFER_START_TIMEOUT = float(os.getenv("INFER_START_TIMEOUT", "120"))
+INFER_HEALTH_SECONDS = float(os.getenv("INFER_HEALTH_SECONDS", "10"))
+
+
+class InferenceError(Exception):
+    pass
+
+
+class _Worker:
+    def __init__(self, python, model_path, size, authkey):
+        self.python = python
+        self.model_path = model_path
+        self.size = size
+        self.authkey = authkey
+        self.proc = None
+        self.conn = None
+        self.restarts = -1
+
+    def start(self):
+        self.stop()
+        env = dict(os.environ, INFER_AUTHKEY=self.authkey.decode("utf-8"))
+        self.proc = subprocess.Popen(
+            [self.python, WORKER_SCRIPT, "--model", self.model_path, "--size", self.size],
+            cwd=BASE_DIR,
+            env=env,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        self.restarts += 1
+
+        port = self._wait_ready()
+        self.conn = Client(("127.0.0.1", port), authkey=self.authkey)
+
+    def _wait_ready(self):
+        # readline() blocks, so read the READY line from a helper thread
+        found = queue.Queue()
+
+        def reader():
+            port_seen = None
+            for line in self.proc.stdout:
+                if port_seen is None and line.startswith("READY "):
+                    port_seen = int(line.split()[1])
+                    found.put(port_seen)
+                # keep draining so a chatty worker never blocks on a full pipe
+            if port_seen is None:
+                found.put(None)
+
+        threading.Thread(target=reader, daemon=True).start()
+        try:
+            port = found.get(timeout=INFER_START_TIMEOUT)
+        except queue.Empty:
+            port = None
+
+        if port is None:
+            code = self.proc.poll() if self.proc is not None else None
+            self.stop()
+            raise InferenceError(f"inference worker failed to start (exit code {code})")
+        return port
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None and self.conn is not None
+
+    def call(self, msg, timeout):
+        self.conn.send(msg)
+        if not self.conn.poll(timeout):
+            raise InferenceError("inference worker timed out")
+        return self.conn.recv()
+
+    def stop(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+        if self.proc is not None:
+            if self.proc.poll() is None:
+                self.proc.terminate()
+                try:
+                    self.proc.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self.proc.kill()
+            self.proc = None
+
+
+class InferencePool:
+    def __init__(self, python, model_path, size, workers=INFER_WORKERS):
+        self.authkey = secrets.token_hex(16).encode("utf-8")
+        self.workers = [_Worker(python, model_path, size, self.authkey) for _ in range(max(1, workers))]
+        self.idle = queue.Queue()
+        self._closed = False
+
+        for w in self.workers:
+            w.start()
+            self.idle.put(w)
+
+        self._health = threading.Thread(target=self._health_loop, daemon=True)
+        self._health.start()
+
+    def infer(self, image_bytes, tiled=None, timeout=INFER_TIMEOUT):
+        """
+        tiled: None = worker default (INFER_TILED), True/False to force a mode
+        Returns: (result_png_bytes, metrics_dict)
+        """
+        msg = {"op": "infer", "image": image_bytes}
+        if tiled is not None:
+            msg["tiled"] = bool(tiled)
+
+        w = self._checkout(timeout)
+        try:
+            resp = w.call(msg, timeout)
+        except (OSError, EOFError, InferenceError) as e:
+            # Worker crashed or hung mid-request: fail this call now, replace it off the request path
+            self._restart_later(w)
+            raise InferenceError(f"inference worker crashed: {e}")
+        self.idle.put(w)
+
+        if not resp.get("ok"):
+            raise InferenceError(resp.get("error") or "inference failed")
+        return resp["png"], resp["metrics"]
+
+    def _checkout(self, timeout):
+        """An idle, live worker; dead ones found on the way are sent for restart."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                w = self.idle.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise InferenceError("no inference worker available (restarting or busy)")
+            if w.alive():
+                return w
+            self._restart_later(w)
+
+    def _restart_later(self, w):
+        """Restart w in the background; it rejoins the idle queue once it is up again."""
+        def run():
+            while not self._closed:
+                try:
+                    w.start()
+                    break
+                except Exception as e:
+                    print("INFERENCE WORKER RESTART FAILED:", e)
+                    time.sleep(INFER_HEALTH_SECONDS)
+            self.idle.put(w)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def health(self):
+        return {
+            "pid": os.getpid(),   # one pool per process; compare across workers to count pools on the host
+            "workers": len(self.workers),
+            "idle": self.idle.qsize(),
+            "alive": sum(1 for w in self.workers if w.alive()),
+            "restarts": sum(w.restarts for w in self.workers),
+        }
+
+    def _health_loop(self):
+        while not self._closed:
+            time.sleep(INFER_HEALTH_SECONDS)
+            # Only check workers that are idle right now, so we never race a request
+            for _ in range(self.idle.qsize()):
+                try:
+                    w = self.idle.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    if not w.alive() or not w.call({"op": "ping"}, 5).get("ok"):
+                        raise InferenceError("ping failed")
+                except Exception as e:
+                    print("INFERENCE WORKER UNHEALTHY, restarting:", e)
+                    self._restart_later(w)
+                    continue
+                self.idle.put(w)
+
+    def close(self):
+        self._closed = True
+        for w in self.workers:
+            w.stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(python, model_path, size):
+    """This process's pool (see the header: one per gunicorn worker process, not per host)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = InferencePool(python, model_path, size)
+            atexit.register(_pool.close)
+    return _pool
@@ -0,0 +1,99 @@
+# inference_worker.py
+# Long-lived TF worker. Runs inside the .venv_tf interpreter, loads the model ONCE,
+# then serves requests from the Flask app over a local socket.
+#
+# The model is warmed up (one dummy predict) before READY is printed, so the first
+# real request never pays for graph building.
+#
+# Started by inference_pool.py, not by hand:
+#   TF_PYTHON inference_worker.py --model models/CROP_MODEL.h5 --size 224,224
+#
+# Protocol (multiprocessing.connection, pickled dicts):
+#   {"op": "ping"}                      -> {"ok": True, "pid": ..., "served": ...}
+#   {"op": "infer", "image": <bytes>}   -> {"ok": True, "png": <bytes>, "metrics": {...}}
+#     optional "tiled": bool overrides the worker's --tiled default
+#   errors                              -> {"ok": False, "error": "..."}
+
+import argparse
+import io
+import os
+import sys
+import time
+import traceback
+from multiprocessing.connection import Listener
+
+import cv2
+
+import ml_infer
+
+
+def serve(listener, model, size, tiled=False):
+    served = 0
+    while True:
+        conn = listener.accept()
+        try:
+            while True:
+                try:
+                    req = conn.recv()
+                except EOFError:
+                    break
+
+                op = req.get("op")
+                if op == "ping":
+                    conn.send({"ok": True, "pid": os.getpid(), "served": served})
+                elif op == "infer":
+                    try:
+                        out, metrics = ml_infer.analyze(model, io.BytesIO(req["image"]), size,
+                                                         tiled=req.get("tiled", tiled))
+                        ok, buf = cv2.imencode(".png", out)
+                        if not ok:
+                            raise RuntimeError("png encode failed")
+                        served += 1
+                        conn.send({"ok": True, "png": buf.tobytes(), "metrics": metrics})
+                    except Exception as e:
+                        traceback.print_exc()
+                        conn.send({"ok": False, "error": str(e)})
+                elif op == "shutdown":
+                    conn.send({"ok": True})
+                    return
+                else:
+                    conn.send({"ok": False, "error": f"unknown op: {op}"})
+        finally:
+            conn.close()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model", required=True)
+    ap.add_argument("--size", default="224,224")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=0)  # 0 = let the OS pick
+    ap.add_argument("--tiled", action="store_true",
+                    default=os.getenv("INFER_TILED", "0") == "1")  # full-res tiled mode by default
+    args = ap.parse_args()
+
+    authkey = os.environ.get("INFER_AUTHKEY", "").encode("utf-8") or None
+
+    t0 = time.perf_counter()
+    model = ml_infer.load_model(args.model)
+    size = ml_infer.parse_size(args.size)
+    load_ms = (time.perf_counter() - t0) * 1000.0
+    warm_ms = ml_infer.warmup(model, size)
+    print(f"inference worker {os.getpid()}: model load {load_ms:.0f} ms, warm-up {warm_ms:.0f} ms",
+          file=sys.stderr, flush=True)
+
+    listener = Listener((args.host, args.port), authkey=authkey)
+    host, port = listener.address
+
+    # The pool waits for this line before routing traffic here
+    print(f"READY {port}", flush=True)
+    sys.stdout.flush()
+
+    try:
+        serve(listener, model, size, tiled=args.tiled)
+    finally:
+        listener.close()
+
+
+if __name__ == "__main__":
+    main()
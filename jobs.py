@@ -0,0 +1,246 @@
+# jobs.py
+# Background job runner for analysis. Submitting returns a job id right away;
+# a bounded thread pool does the fetch -> infer -> upload work so Flask workers
+# stay free for login / device routes.
+#
+# Job states: queued -> running -> done | failed
+#
+# The work runs on the worker that accepted the job, but its state lives in a
+# sqlite file (ANALYSIS_JOB_DB) shared by every gunicorn worker on the box, so a
+# status request that lands on another worker still finds the job.
+#
+# Each worker holds a lease on its queued/running jobs and renews it from a
+# heartbeat thread. If a worker dies, its leases lapse after ANALYSIS_JOB_LEASE
+# seconds and another worker requeues the job (jobs are submitted by kind +
+# parameters, see register(), so any worker can rebuild them). A job is failed
+# instead after ANALYSIS_JOB_ATTEMPTS tries, so one that kills its worker every
+# time doesn't go round forever.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ANALYSIS_JOB_WORKERS = int(os.getenv("ANALYSIS_JOB_WORKERS", "2"))
+ANALYSIS_JOB_QUEUE = int(os.getenv("ANALYSIS_JOB_QUEUE", "64"))   # max queued+running jobs per worker
+ANALYSIS_JOB_TTL = int(os.getenv("ANALYSIS_JOB_TTL", "3600"))      # seconds a finished job is kept
+ANALYSIS_JOB_DB = os.getenv("ANALYSIS_JOB_DB", os.path.join(BASE_DIR, "cache", "jobs.sqlite3"))
+ANALYSIS_JOB_POLL = float(os.getenv("ANALYSIS_JOB_POLL", "1"))    # wait(): how often to re-read other workers' jobs
+ANALYSIS_JOB_LEASE = float(os.getenv("ANALYSIS_JOB_LEASE", "60"))  # seconds without a heartbeat before a job is requeued
+ANALYSIS_JOB_ATTEMPTS = int(os.getenv("ANALYSIS_JOB_ATTEMPTS", "2"))
+
+_COLUMNS = ("job_id", "owner", "status", "step", "result", "error", "created_at", "updated_at", "version", "meta")
+_LEASE_COLUMNS = {"kind": "TEXT", "worker": "TEXT", "lease_until": "REAL", "attempts": "INTEGER DEFAULT 1"}
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobManager:
+    def __init__(self, workers=ANALYSIS_JOB_WORKERS, max_pending=ANALYSIS_JOB_QUEUE, ttl=ANALYSIS_JOB_TTL,
+                 db_path=ANALYSIS_JOB_DB, lease=ANALYSIS_JOB_LEASE, max_attempts=ANALYSIS_JOB_ATTEMPTS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analysis")
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._running = set()     # job ids queued or running in this worker
+        self._factories = {}      # kind -> factory(owner, **params) -> fn(progress)
+        self.worker_id = uuid.uuid4().hex
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.db_path = db_path
+        self.requeued = 0
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._db() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY, owner TEXT, status TEXT, step TEXT, result TEXT, error TEXT,"
+                " created_at REAL, updated_at REAL, version INTEGER, meta TEXT)"
+            )
+            have = {row[1] for row in db.execute("PRAGMA table_info(jobs)")}
+            for name, decl in _LEASE_COLUMNS.items():
+                if name not in have:
+                    db.execute(f"ALTER TABLE jobs ADD COLUMN {name} {decl}")
+
+        threading.Thread(target=self._heartbeat_loop, daemon=True).start()
+
+    def _db(self):
+        # sqlite connections can't be shared across threads; keep one per thread
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
+
+    @staticmethod
+    def _to_job(row):
+        job = dict(zip(_COLUMNS, row))
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        meta = json.loads(job.pop("meta") or "{}")
+        return {**job, **meta}
+
+    def register(self, kind, factory):
+        """
+        factory(owner, **params) -> fn(progress). fn runs on the pool; progress(step)
+        publishes an intermediate step. Whatever fn returns becomes job["result"];
+        an exception marks the job failed. params must be JSON-serializable, since a
+        requeued job is rebuilt from them on another worker.
+        """
+        self._factories[kind] = factory
+
+    def submit(self, owner, kind, **params):
+        if kind not in self._factories:
+            raise KeyError(f"unknown job kind {kind!r}")
+        with self._cond:
+            if len(self._running) >= self.max_pending:
+                raise QueueFull("analysis queue is full")
+            job_id = uuid.uuid4().hex
+            self._running.add(job_id)
+
+        try:
+            self._prune()
+            now = time.time()
+            with self._db() as db:
+                db.execute(
+                    f"INSERT INTO jobs ({', '.join(_COLUMNS)}, kind, worker, lease_until, attempts)"
+                    " VALUES (?, ?, 'queued', NULL, NULL, NULL, ?, ?, 0, ?, ?, ?, ?, 1)",
+                    (job_id, owner, now, now, json.dumps(params), kind, self.worker_id, now + self.lease),
+                )
+        except Exception:
+            with self._cond:
+                self._running.discard(job_id)
+            raise
+
+        self._start(job_id, kind, owner, params)
+        return self.get(job_id)
+
+    def _start(self, job_id, kind, owner, params):
+        try:
+            fn = self._factories[kind](owner, **params)
+        except Exception as e:
+            self._update(job_id, status="failed", error=str(e))
+            with self._cond:
+                self._running.discard(job_id)
+            return
+        self._executor.submit(self._run, job_id, fn)
+
+    def _update(self, job_id, **fields):
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"])
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        with self._db() as db:
+            db.execute(
+                f"UPDATE jobs SET {assignments}, updated_at = ?, version = version + 1 WHERE job_id = ?",
+                (*fields.values(), time.time(), job_id),
+            )
+        with self._cond:
+            self._cond.notify_all()
+
+    def _run(self, job_id, fn):
+        try:
+            self._update(job_id, status="running")
+            try:
+                result = fn(lambda step: self._update(job_id, step=step))
+                self._update(job_id, status="done", step=None, result=result)
+            except Exception as e:
+                self._update(job_id, status="failed", step=None, error=str(e))
+        finally:
+            with self._cond:
+                self._running.discard(job_id)
+
+    def get(self, job_id):
+        row = self._db().execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        return self._to_job(row) if row else None
+
+    def wait(self, job_id, version, timeout, poll=ANALYSIS_JOB_POLL):
+        """
+        Block until the job changes past `version` (or timeout). Returns the job snapshot.
+        Jobs run by this worker wake the waiter at once; jobs run by another worker
+        are re-read every `poll` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["version"] > version or remaining <= 0:
+                return job
+            with self._cond:
+                self._cond.wait(min(remaining, poll))
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(max(1.0, self.lease / 3))
+            try:
+                self._renew()
+                self._reclaim()
+            except Exception as e:
+                print("JOB HEARTBEAT FAILED:", e)
+
+    def _renew(self):
+        with self._cond:
+            job_ids = list(self._running)
+        if not job_ids:
+            return
+        with self._db() as db:
+            db.execute(
+                f"UPDATE jobs SET lease_until = ? WHERE worker = ? AND job_id IN ({', '.join('?' * len(job_ids))})",
+                (time.time() + self.lease, self.worker_id, *job_ids),
+            )
+
+    def _reclaim(self):
+        """Requeue (or give up on) jobs whose worker stopped renewing their lease."""
+        now = time.time()
+        rows = self._db().execute(
+            "SELECT job_id, owner, kind, meta, attempts FROM jobs"
+            " WHERE status IN ('queued', 'running') AND lease_until < ?", (now,)
+        ).fetchall()
+        for job_id, owner, kind, meta, attempts in rows:
+            if (attempts or 1) >= self.max_attempts or kind not in self._factories:
+                with self._db() as db:
+                    db.execute(
+                        "UPDATE jobs SET status = 'failed', step = NULL, error = ?, updated_at = ?,"
+                        " version = version + 1 WHERE job_id = ? AND lease_until < ?",
+                        ("analysis worker lost", now, job_id, now),
+                    )
+                continue
+
+            with self._cond:
+                if len(self._running) >= self.max_pending:
+                    return
+            with self._db() as db:
+                won = db.execute(
+                    "UPDATE jobs SET status = 'queued', step = NULL, worker = ?, lease_until = ?,"
+                    " attempts = attempts + 1, updated_at = ?, version = version + 1"
+                    " WHERE job_id = ? AND lease_until < ?",
+                    (self.worker_id, now + self.lease, now, job_id, now),
+                ).rowcount
+            if won:
+                print("REQUEUED ANALYSIS JOB", job_id, "attempt", (attempts or 1) + 1)
+                self.requeued += 1
+                with self._cond:
+                    self._running.add(job_id)
+                self._start(job_id, kind, owner, json.loads(meta or "{}"))
+        with self._cond:
+            self._cond.notify_all()
+
+    def _prune(self):
+        with self._db() as db:
+            db.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                       (time.time() - self.ttl,))
+
+
+def public_view(job):
+    """Strip internal fields before returning a job to the browser."""
+    return {k: v for k, v in job.items() if k not in ("owner", "version")}
@@ -0,0 +1,81 @@
+# micro_batch.py
+# Dynamic micro-batching: requests that arrive within max_wait_ms (or until
+# max_batch items are waiting) are stacked into one NumPy batch and run through
+# a single predict call. Each caller gets back its own row of the output.
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class MicroBatcher:
+    def __init__(self, predict_fn, max_batch=8, max_wait_ms=20, stack=True):
+        """
+        predict_fn: takes an (N, ...) array and returns an (N, ...) array
+        max_batch:  largest batch handed to predict_fn
+        max_wait_ms: how long the first queued request waits for company
+        stack: False hands predict_fn the list of samples, so it can write them
+               into its own preallocated buffer instead of np.stack copying them
+        """
+        self.predict_fn = predict_fn
+        self.stack = stack
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, x):
+        """x: a single sample (no batch dim). Returns a Future of its prediction row."""
+        fut = Future()
+        self._queue.put((x, fut))
+        return fut
+
+    def predict(self, x, timeout=None):
+        return self.submit(x).result(timeout=timeout)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": (self.items / self.batches) if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000.0,
+        }
+
+    def _collect(self):
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _loop(self):
+        while True:
+            items = self._collect()
+            futs = [f for _, f in items]
+            try:
+                batch = [x for x, _ in items]
+                if self.stack:
+                    batch = np.stack(batch, axis=0)
+                out = self.predict_fn(batch)
+                self.batches += 1
+                self.items += len(items)
+                for i, f in enumerate(futs):
+                    f.set_result(out[i])
+            except Exception as e:
+                for f in futs:
+                    if not f.done():
+                        f.set_exception(e)
@@ -0,0 +1,142 @@
+# mission_index.py
+# In-process index of pending missions per user, so "anything for me?" from a
+# device with nothing queued is answered with zero database calls.
+#
+# - populated lazily: a user's pending requested_at values are loaded on first use
+# - write-through: mission_upload / ack / claim go through apply(), which updates
+#   the index and bumps the missions:<user> version marker (http_cache.py)
+# - every read compares the entry's marker version with the current one; a bump
+#   from another worker means reload (one query), so workers never serve each
+#   other stale queues
+# - entries older than MISSION_INDEX_RECONCILE seconds are reloaded as well,
+#   catching rows changed outside the app; "drift" counts reloads that found the
+#   index wrong (should stay ~0)
+#
+# Missions are kept as a sorted list of requested_at strings (their ids, which
+# sort by time): newest is the last element and "after cursor" is a bisect, which
+# covers every query the routes make.
+
+import bisect
+import os
+import threading
+import time
+
+from cachetools import LRUCache
+
+MISSION_INDEX_USERS = int(os.getenv("MISSION_INDEX_USERS", "4096"))
+MISSION_INDEX_RECONCILE = float(os.getenv("MISSION_INDEX_RECONCILE", "60"))
+
+
+class _Pending:
+    __slots__ = ("ids", "version", "loaded_at")
+
+    def __init__(self, ids, version):
+        self.ids = sorted(ids)
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+
+class MissionIndex:
+    def __init__(self, load, markers, max_users=MISSION_INDEX_USERS, reconcile_seconds=MISSION_INDEX_RECONCILE):
+        """load(user_id) -> iterable of pending mission ids (requested_at), from the database."""
+        self.load = load
+        self.markers = markers
+        self.reconcile_seconds = reconcile_seconds
+        self._users = LRUCache(maxsize=max_users)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0           # first load for a user (or evicted)
+        self.invalidations = 0    # reloaded because another worker bumped the marker
+        self.reconciles = 0       # reloaded because the entry got old
+        self.drift = 0            # reconciles that found the index out of date
+
+    @staticmethod
+    def _key(user_id):
+        return f"missions:{user_id}"
+
+    def _entry(self, user_id):
+        version = self.markers.version(self._key(user_id))
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None:
+                if entry.version != version:
+                    self.invalidations += 1
+                elif time.monotonic() - entry.loaded_at >= self.reconcile_seconds:
+                    self.reconciles += 1
+                else:
+                    self.hits += 1
+                    return entry
+            else:
+                self.misses += 1
+
+        fresh = _Pending(self.load(user_id), version)
+        with self._lock:
+            if entry is not None and entry.version == version and entry.ids != fresh.ids:
+                self.drift += 1
+            self._users[user_id] = fresh
+        return fresh
+
+    def newest(self, user_id, n=1):
+        """Up to n pending mission ids, newest first."""
+        entry = self._entry(user_id)
+        with self._lock:
+            return entry.ids[::-1][:n]
+
+    def after(self, user_id, cursor, limit=50):
+        """Pending mission ids > cursor, oldest first (all of them if cursor is falsy)."""
+        entry = self._entry(user_id)
+        with self._lock:
+            start = bisect.bisect_right(entry.ids, cursor) if cursor else 0
+            return entry.ids[start:start + limit]
+
+    def apply(self, user_id, add=(), remove=()):
+        """
+        Write-through after a successful database write: update the index and bump
+        the marker. Check, bump and mutate happen under one lock, so a concurrent
+        read never sees the new version with the old ids, and the entry takes the
+        version of our own bump (a later bump from another worker still reloads it).
+        """
+        key = self._key(user_id)
+        with self._lock:
+            entry = self._users.get(user_id)
+            current = entry is not None and entry.version == self.markers.version(key)
+            version = self.markers.bump(key)
+            if entry is None:
+                return
+            if not current:
+                # Already behind another worker's write: let the next read reload it
+                self._users.pop(user_id, None)
+                return
+            for mission_id in remove:
+                i = bisect.bisect_left(entry.ids, mission_id)
+                if i < len(entry.ids) and entry.ids[i] == mission_id:
+                    entry.ids.pop(i)
+            for mission_id in add:
+                i = bisect.bisect_left(entry.ids, mission_id)
+                if i == len(entry.ids) or entry.ids[i] != mission_id:
+                    entry.ids.insert(i, mission_id)
+            entry.version = version
+
+    def discard(self, user_id, mission_id):
+        """Local-only removal (e.g. a claim lost to another device); no marker bump."""
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and mission_id in entry.ids:
+                entry.ids.remove(mission_id)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.invalidations + self.reconciles
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "reconciles": self.reconciles,
+                "drift": self.drift,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "users": len(self._users),
+                "pending": sum(len(e.ids) for e in self._users.values()),
+                "oldest_entry_seconds": round(max((time.monotonic() - e.loaded_at for e in self._users.values()),
+                                                  default=0.0), 1),
+            }
@@ -0,0 +1,131 @@
+# mission_push.py
+# Push delivery of missions to devices over one persistent server-sent-events
+# connection (GET /device/missions/stream), instead of polling.
+#
+# - MissionBroadcaster: in-process fan-out. mission_upload publishes each new
+#   mission here; every stream of that user in this worker gets it at once,
+#   with the mission JSON inline (no download round trip).
+# - Devices connected to *another* worker learn about it through the
+#   missions:<user> version marker (http_cache.py), which mission_upload bumps;
+#   their stream then reads the pending missions past its cursor from the database.
+# - Event ids are the mission's requested_at (sortable). A device that
+#   reconnects sends Last-Event-ID and is replayed every pending mission after
+#   it, so nothing queued while it was offline is missed.
+# - Idle streams send a comment line every MISSION_PUSH_HEARTBEAT seconds so
+#   proxies keep them open and the device can detect a dead link.
+#
+# Each open stream holds a server thread; run gunicorn with -k gthread and
+# enough --threads for the fleet (benchmarks/bench_mission_push.py measures it).
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+MISSION_PUSH_HEARTBEAT = float(os.getenv("MISSION_PUSH_HEARTBEAT", "15"))
+MISSION_PUSH_HISTORY = int(os.getenv("MISSION_PUSH_HISTORY", "32"))   # recent events kept per user for replay
+MISSION_PUSH_MAX_STREAMS = int(os.getenv("MISSION_PUSH_MAX_STREAMS", "500"))
+
+
+class MissionBroadcaster:
+    def __init__(self, history=MISSION_PUSH_HISTORY):
+        self.history = history
+        self._cond = threading.Condition()
+        self._events = {}        # user_id -> deque[(event_id, payload)]
+        self.streams = 0
+        self.published = 0
+        self.delivered = 0
+
+    def publish(self, user_id, event_id, payload):
+        payload = {**payload, "published_at": time.time()}
+        with self._cond:
+            q = self._events.setdefault(user_id, deque(maxlen=self.history))
+            q.append((event_id, payload))
+            self.published += 1
+            self._cond.notify_all()
+
+    def since(self, user_id, cursor):
+        """Events for user_id with id > cursor (all recent ones if cursor is None)."""
+        with self._cond:
+            return [(eid, p) for eid, p in self._events.get(user_id, ()) if cursor is None or eid > cursor]
+
+    def wait(self, user_id, cursor, timeout):
+        """Block until there is an event past cursor or timeout. Returns the new events."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                events = [(eid, p) for eid, p in self._events.get(user_id, ()) if cursor is None or eid > cursor]
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0:
+                    return events
+                self._cond.wait(remaining)
+
+    def open_stream(self):
+        with self._cond:
+            if self.streams >= MISSION_PUSH_MAX_STREAMS:
+                return False
+            self.streams += 1
+            return True
+
+    def close_stream(self):
+        with self._cond:
+            self.streams -= 1
+
+    def count_delivered(self, n):
+        with self._cond:
+            self.delivered += n
+
+    def stats(self):
+        with self._cond:
+            return {"streams": self.streams, "published": self.published, "delivered": self.delivered,
+                    "users_with_history": len(self._events)}
+
+
+def sse(event_id, payload, event="mission"):
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def stream_missions(broadcaster, markers, user_id, cursor, fetch_pending,
+                    heartbeat=MISSION_PUSH_HEARTBEAT, check_seconds=1.0):
+    """
+    Generator of SSE lines for one device.
+    fetch_pending(user_id, after) -> [(event_id, payload)] from the database, oldest first.
+    """
+    key = f"missions:{user_id}"
+    seen_version = markers.version(key)
+
+    # Replay: whatever is pending past the cursor (everything pending on first connect)
+    backlog = fetch_pending(user_id, cursor)
+    for eid, payload in backlog:
+        yield sse(eid, payload)
+        cursor = eid
+    broadcaster.count_delivered(len(backlog))
+    if cursor is None:
+        # Nothing pending: start after whatever this worker already broadcast
+        recent = broadcaster.since(user_id, None)
+        cursor = recent[-1][0] if recent else ""
+
+    last_sent = time.monotonic()
+    yield f"retry: 5000\n: connected cursor={cursor or ''}\n\n"
+
+    while True:
+        events = broadcaster.wait(user_id, cursor, timeout=check_seconds)
+        if events:
+            seen_version = markers.version(key)
+        else:
+            version = markers.version(key)
+            if version != seen_version:
+                # Queued through another worker (or acked): read what we haven't sent
+                seen_version = version
+                events = fetch_pending(user_id, cursor)
+
+        for eid, payload in events:
+            yield sse(eid, payload)
+            cursor = eid
+        if events:
+            broadcaster.count_delivered(len(events))
+            last_sent = time.monotonic()
+        elif time.monotonic() - last_sent >= heartbeat:
+            yield ": heartbeat\n\n"
+            last_sent = time.monotonic()
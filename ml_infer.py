@@ -1,45 +1,79 @@
-import argparse, json, os
+import argparse, json, os, time
 import numpy as np
-from PIL import Image
-import tensorflow as tf
 import cv2
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--model", required=True)
-    ap.add_argument("--input", required=True)     # input image path
-    ap.add_argument("--output", required=True)    # output image path (png)
-    ap.add_argument("--size", default="224,224")  # change if needed
-    args = ap.parse_args()
+import inference_backends
+import preprocess
+import tiling
+
+
+def parse_size(size):
+    w, h = [int(x) for x in size.split(",")]
+    return w, h
+
+
+def load_model(model_path):
+    # Keras or TFLite, picked by INFER_BACKEND (see inference_backends.py).
+    # TF itself is only imported here, by processes that actually infer.
+    return inference_backends.load_backend(model_path)
+
+
+def warmup(model, size):
+    """One dummy predict so graph building / kernel selection happens before real traffic."""
+    t0 = time.perf_counter()
+    w, h = size
+    model.predict(np.zeros((1, h, w, 3), dtype=np.float32), verbose=0)
+    return (time.perf_counter() - t0) * 1000.0
 
-    w, h = [int(x) for x in args.size.split(",")]
 
-    model = tf.keras.models.load_model(args.model, compile=False)
+_buffers = preprocess.BatchBuffer()
 
-    img = Image.open(args.input).convert("RGB").resize((w, h))
-    img_rgb = np.array(img, dtype=np.uint8)
-    x = img_rgb.astype(np.float32) / 255.0
-    x = np.expand_dims(x, axis=0)
 
-    pred = model.predict(x)
+def analyze(model, image, size, tiled=False):
+    """
+    image: path, bytes or file-like object
+    tiled: score overlapping model-sized tiles of the full-res image instead of one resize
+    Returns: (overlay_bgr, metrics_dict)
+    """
+    if tiled:
+        img_rgb = preprocess.load_full(image)
+        return tiling.analyze_tiled(lambda b: model.predict(b, verbose=0), img_rgb, size)
+
+    frame = preprocess.load_frame(image, size)
+    x = _buffers.from_frames([frame])
+
+    pred = model.predict(x, verbose=0)
 
     # Simple classification-style overlay (works for many models)
     health_score = 0
-    out = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
 
     if pred.ndim == 2 and pred.shape[0] == 1:
         probs = pred[0]
         cls = int(np.argmax(probs))
         conf = float(np.max(probs))
         health_score = int(conf * 100)
-        cv2.putText(out, f"class={cls} conf={conf:.2f}", (10, 30),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0,255,0), 2)
+        preprocess.label(frame, f"class={cls} conf={conf:.2f}")
+
+    return preprocess.to_bgr_inplace(frame), {"health_score": health_score}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model", required=True)
+    ap.add_argument("--input", required=True)     # input image path
+    ap.add_argument("--output", required=True)    # output image path (png)
+    ap.add_argument("--size", default="224,224")  # change if needed
+    ap.add_argument("--tiled", action="store_true")  # full-res tiled heatmap mode
+    args = ap.parse_args()
+
+    model = load_model(args.model)
+    out, metrics = analyze(model, args.input, parse_size(args.size), tiled=args.tiled)
 
     cv2.imwrite(args.output, out)
 
     print(json.dumps({
         "output_path": args.output,
-        "health_score": health_score
+        **metrics
     }))
 
 if __name__ == "__main__":
@@ -0,0 +1,111 @@
+# preprocess.py
+# Shared image preprocessing for ml_infer.py, crop_analyzer.py and the workers.
+#
+# One pass, few copies:
+#   - the resize matches what the model was trained and validated with: a full
+#     decode, then PIL's default BICUBIC filter (Image.resize(size) in the old code)
+#   - PREPROCESS_JPEG_DRAFT=1 lets libjpeg decode at 1/2, 1/4 or 1/8 scale when the
+#     model input is much smaller than the photo, so a 20 MP frame never hits RAM.
+#     It changes the input pixels slightly, so it is off until accuracy has been
+#     re-checked with it on (reanalyze.py over a labelled set, compare metrics)
+#   - the resized uint8 frame is written straight into a preallocated float32
+#     batch buffer (no astype / divide / expand_dims temporaries)
+#   - the same uint8 frame is reused for the overlay; text is drawn in RGB and the
+#     frame is swapped to BGR in place right before encoding
+
+import io
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+import cv2
+
+PREPROCESS_JPEG_DRAFT = os.getenv("PREPROCESS_JPEG_DRAFT", "0") == "1"
+
+_INV_255 = np.float32(1.0 / 255.0)
+
+
+def open_image(src):
+    """src: bytes, path or file-like. Returns a lazily-decoded PIL image."""
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        src = io.BytesIO(src)
+    return Image.open(src)
+
+
+def load_frame(src, size, draft=PREPROCESS_JPEG_DRAFT):
+    """
+    Decode + resize to size=(w, h) in one pass.
+    Returns: (h, w, 3) uint8 RGB array (owns its memory, safe to draw on).
+    """
+    w, h = size
+    img = open_image(src)
+
+    # Ask libjpeg for the smallest DCT scale that is still >= 2x the target, so
+    # the final resize has enough pixels to antialias from
+    if draft and img.format == "JPEG":
+        img.draft("RGB", (w * 2, h * 2))
+
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    if img.size != (w, h):
+        img = img.resize((w, h), Image.BICUBIC)
+
+    return np.array(img)
+
+
+def load_full(src):
+    """Full-resolution (H, W, 3) uint8 RGB, for tiled inference."""
+    img = open_image(src)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    return np.asarray(img)
+
+
+def normalize_into(frames, out):
+    """frames: (N, h, w, 3) uint8 -> out[:N] float32 in [0, 1]. Returns that view."""
+    view = out[:len(frames)]
+    np.multiply(frames, _INV_255, out=view, casting="unsafe")
+    return view
+
+
+class BatchBuffer:
+    """Reusable float32 batch buffer, grown on demand. One per thread."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def get(self, n, h, w):
+        buf = getattr(self._local, "buf", None)
+        if buf is None or buf.shape[0] < n or buf.shape[1:] != (h, w, 3):
+            buf = np.empty((n, h, w, 3), dtype=np.float32)
+            self._local.buf = buf
+        return buf
+
+    def from_frames(self, frames):
+        """frames: (N, h, w, 3) uint8 or a list of (h, w, 3) uint8."""
+        n = len(frames)
+        h, w = frames[0].shape[:2]
+        buf = self.get(n, h, w)
+        for i, f in enumerate(frames):
+            np.multiply(f, _INV_255, out=buf[i], casting="unsafe")
+        return buf[:n]
+
+
+def label(frame_rgb, text):
+    # (0, 255, 0) is the same green in RGB and BGR, so no swap is needed to draw
+    cv2.putText(frame_rgb, text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+    return frame_rgb
+
+
+def to_bgr_inplace(frame_rgb):
+    return cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2BGR, dst=frame_rgb)
+
+
+def encode_png(frame_rgb):
+    """Encode an RGB frame as PNG. The frame is swapped to BGR in place (no copy)."""
+    ok, buf = cv2.imencode(".png", to_bgr_inplace(frame_rgb))
+    if not ok:
+        raise RuntimeError("png encode failed")
+    return buf.tobytes()
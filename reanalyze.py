@@ -0,0 +1,205 @@
+# reanalyze.py
+# Re-score a user's (or every user's) image history after a model retrain.
+#
+#   python reanalyze.py --user 7dd1806f-97d7-4228-95eb-c45e8b52b283
+#   python reanalyze.py --all --workers 4 --downloads 8
+#
+# - lists images from imageReceived page by page
+# - downloads with bounded concurrency over one pooled requests.Session
+# - runs inference on the same persistent TF worker pool the web app uses
+#   (inference_pool.py): INFER_WORKERS processes, each holding one loaded model
+# - uploads the overlay to IMAGE_BUCKET/results/reanalysis/<model_fp>/<image path>.png
+#   and upserts metrics into imageAnalysis (image_path, model_fp unique; see schema.sql)
+# - --skip-near-duplicates leaves out images flagged by the upload-time hash index
+# - appends every finished image to a checkpoint file, so a rerun resumes where
+#   the last one stopped (same model file = same checkpoint)
+#
+# Needs SUPABASE_URL / SUPABASE_KEY, plus TF_PYTHON / MODEL_PATH like app.py.
+
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from supabase import create_client
+
+from inference_backends import resolve_model_path
+from inference_pool import InferencePool
+from result_cache import model_fingerprint
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+IMAGE_BUCKET = os.getenv("SUPABASE_IMAGE_BUCKET", "image_transmission")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TF_PYTHON = os.getenv("TF_PYTHON", os.path.join(BASE_DIR, ".venv_tf", "Scripts", "python.exe"))
+MODEL_PATH = os.getenv("MODEL_PATH", os.path.join(BASE_DIR, "models", "CROP_MODEL.h5"))
+MODEL_INPUT_SIZE = os.getenv("MODEL_INPUT_SIZE", "224,224")
+
+PAGE_SIZE = 500
+
+
+def list_images(supabase, user_id=None):
+    """Yields imageReceived rows. uploaded_at holds the bucket-relative storage path."""
+    start = 0
+    while True:
+        q = supabase.table("imageReceived").select("requested_by, uploaded_at")
+        if user_id:
+            q = q.eq("requested_by", user_id)
+        rows = q.order("uploaded_at").range(start, start + PAGE_SIZE - 1).execute().data or []
+        yield from rows
+        if len(rows) < PAGE_SIZE:
+            return
+        start += PAGE_SIZE
+
+
+def near_duplicate_paths(supabase, user_id=None):
+    """Images flagged as near-duplicates at upload time (see image_hash.py)."""
+    paths = set()
+    start = 0
+    while True:
+        q = supabase.table("imageHashes").select("image_path").not_.is_("near_duplicate_of", "null")
+        if user_id:
+            q = q.eq("requested_by", user_id)
+        rows = q.range(start, start + PAGE_SIZE - 1).execute().data or []
+        paths.update(r["image_path"] for r in rows)
+        if len(rows) < PAGE_SIZE:
+            return paths
+        start += PAGE_SIZE
+
+
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.done = {line.strip() for line in f if line.strip()}
+        self._f = open(path, "a", encoding="utf-8")
+
+    def mark(self, image_path):
+        with self._lock:
+            self._f.write(image_path + "\n")
+            self._f.flush()
+            self.done.add(image_path)
+
+    def close(self):
+        self._f.close()
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.t0 = time.perf_counter()
+        self.ok = 0
+        self.failed = 0
+        self.skipped = 0
+
+    def add(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def line(self):
+        elapsed = time.perf_counter() - self.t0
+        rate = self.ok / elapsed if elapsed > 0 else 0.0
+        return (f"ok={self.ok} failed={self.failed} skipped={self.skipped} "
+                f"elapsed={elapsed:.1f}s throughput={rate:.2f} img/s")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    scope = ap.add_mutually_exclusive_group(required=True)
+    scope.add_argument("--user", help="user_id to re-analyze")
+    scope.add_argument("--all", action="store_true", help="every user's images")
+    ap.add_argument("--workers", type=int, default=int(os.getenv("INFER_WORKERS", "2")) or 1)
+    ap.add_argument("--downloads", type=int, default=8, help="max concurrent downloads")
+    ap.add_argument("--tiled", action="store_true")
+    ap.add_argument("--skip-near-duplicates", action="store_true",
+                    help="skip images flagged as near-duplicates on upload")
+    ap.add_argument("--checkpoint", default=None)
+    ap.add_argument("--report-every", type=int, default=50)
+    args = ap.parse_args()
+
+    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    storage = supabase.storage.from_(IMAGE_BUCKET)
+    public_base = f"{SUPABASE_URL}/storage/v1/object/public/{IMAGE_BUCKET}/"
+
+    skip = near_duplicate_paths(supabase, args.user) if args.skip_near_duplicates else set()
+    if skip:
+        print(f"skipping {len(skip)} near-duplicate images")
+
+    model_fp = model_fingerprint(resolve_model_path(MODEL_PATH))
+    scope_name = args.user or "all"
+    ckpt = Checkpoint(args.checkpoint or os.path.join(BASE_DIR, f"reanalyze_{scope_name}_{model_fp}.done"))
+    print(f"model_fp={model_fp} checkpoint={ckpt.path} already done={len(ckpt.done)}")
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=args.downloads, pool_maxsize=args.downloads)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    pool = InferencePool(TF_PYTHON, MODEL_PATH, MODEL_INPUT_SIZE, workers=args.workers)
+    stats = Stats()
+
+    download_slots = threading.Semaphore(args.downloads)
+    # Bound how many rows are queued so a huge history doesn't sit in memory
+    in_flight = threading.Semaphore(args.workers * 4 + args.downloads)
+
+    def process(row):
+        image_path = row["uploaded_at"]
+        try:
+            with download_slots:
+                r = session.get(public_base + image_path, timeout=60)
+            if r.status_code != 200:
+                raise RuntimeError(f"download HTTP {r.status_code}")
+
+            png, metrics = pool.infer(r.content, tiled=args.tiled)
+
+            result_path = f"results/reanalysis/{model_fp}/{image_path}.png"
+            storage.upload(
+                path=result_path,
+                file=png,
+                file_options={"content-type": "image/png", "upsert": "true"},
+            )
+            supabase.table("imageAnalysis").upsert({
+                "image_path": image_path,
+                "requested_by": row["requested_by"],
+                "model_fp": model_fp,
+                "result_path": result_path,
+                "health_score": metrics.get("health_score", 0),
+                "metrics": metrics,
+            }, on_conflict="image_path,model_fp").execute()
+
+            ckpt.mark(image_path)
+            stats.add("ok")
+        except Exception as e:
+            stats.add("failed")
+            print("FAILED", image_path, e)
+        finally:
+            in_flight.release()
+            done = stats.ok + stats.failed
+            if done and done % args.report_every == 0:
+                print(stats.line())
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers + args.downloads) as ex:
+            for row in list_images(supabase, args.user):
+                if row.get("uploaded_at") in ckpt.done or row.get("uploaded_at") in skip:
+                    stats.add("skipped")
+                    continue
+                in_flight.acquire()
+                ex.submit(process, row)
+    except KeyboardInterrupt:
+        print("interrupted; rerun the same command to resume")
+    finally:
+        pool.close()
+        ckpt.close()
+        print("DONE", stats.line())
+
+
+if __name__ == "__main__":
+    main()
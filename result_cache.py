@@ -0,0 +1,142 @@
+# result_cache.py
+# Content-addressed cache for analysis results.
+#
+# key = sha256(image bytes) + model identity (path, mtime, size) + input size + mode
+#       (+ the tiling settings for tiled results)
+# Tier 1: in-process LRU (cachetools)
+# Tier 2: sqlite file shared by every worker on the box, survives restarts
+#
+# A change to the model file changes its fingerprint, which drops tier 1 and
+# purges tier 2 rows written by the old model.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from cachetools import LRUCache
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "512"))
+RESULT_CACHE_DB = os.getenv("RESULT_CACHE_DB", os.path.join(BASE_DIR, "cache", "results.sqlite3"))
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def model_fingerprint(model_path: str) -> str:
+    try:
+        st = os.stat(model_path)
+        ident = f"{os.path.abspath(model_path)}:{st.st_mtime_ns}:{st.st_size}"
+    except OSError:
+        ident = f"{os.path.abspath(model_path)}:missing"
+    return hashlib.sha1(ident.encode("utf-8")).hexdigest()[:16]
+
+
+def tiling_signature():
+    """
+    Settings that change a tiled result (see tiling.py). Read from the environment
+    the inference workers inherit, rather than importing tiling.py (numpy + cv2) here.
+    """
+    return "tiled-o{}-m{}-s{}".format(
+        os.getenv("TILE_OVERLAP", "0.25"), os.getenv("TILE_MAX", "64"), os.getenv("OVERLAY_MAX_SIDE", "1600"),
+    )
+
+
+class ResultCache:
+    def __init__(self, model_path, input_size, db_path=RESULT_CACHE_DB, size=RESULT_CACHE_SIZE):
+        self.model_path = model_path
+        self.input_size = input_size
+        self.db_path = db_path
+        self._lru = LRUCache(maxsize=size)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._fp = None
+
+        self.hits = 0
+        self.misses = 0
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._db() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY, model_fp TEXT, result_url TEXT,"
+                " metrics TEXT, created_at REAL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS results_model_fp ON results(model_fp)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS image_hashes ("
+                " image_path TEXT PRIMARY KEY, sha256 TEXT)"
+            )
+
+    def _db(self):
+        # sqlite connections can't be shared across threads; keep one per thread
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
+
+    def _check_model(self):
+        fp = model_fingerprint(self.model_path)
+        if fp != self._fp:
+            with self._lock:
+                if fp != self._fp:
+                    self._lru.clear()
+                    with self._db() as db:
+                        db.execute("DELETE FROM results WHERE model_fp != ?", (fp,))
+                    self._fp = fp
+        return fp
+
+    def key(self, sha, tiled=False):
+        fp = self._check_model()
+        return f"{sha}:{fp}:{self.input_size}:{tiling_signature() if tiled else 'single'}"
+
+    # image_path -> content hash, so a repeat press can skip the download as well
+    def hash_for_path(self, image_path):
+        row = self._db().execute(
+            "SELECT sha256 FROM image_hashes WHERE image_path = ?", (image_path,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def remember_path(self, image_path, sha):
+        with self._db() as db:
+            db.execute("INSERT OR REPLACE INTO image_hashes VALUES (?, ?)", (image_path, sha))
+
+    def get(self, key):
+        """Returns {"result_url": ..., "metrics": {...}} or None."""
+        with self._lock:
+            hit = self._lru.get(key)
+        if hit is None:
+            row = self._db().execute(
+                "SELECT result_url, metrics FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row:
+                hit = {"result_url": row[0], "metrics": json.loads(row[1])}
+                with self._lock:
+                    self._lru[key] = hit
+
+        if hit is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return hit
+
+    def put(self, key, result_url, metrics):
+        entry = {"result_url": result_url, "metrics": metrics}
+        with self._lock:
+            self._lru[key] = entry
+        with self._db() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (key, self._fp, result_url, json.dumps(metrics), time.time()),
+            )
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "lru_size": len(self._lru), "model_fp": self._fp}
@@ -0,0 +1,63 @@
+-- schema.sql
+-- Supabase tables added for analysis, upload dedup and thumbnails. Run once in the SQL editor
+-- (or psql) before deploying; every statement is idempotent.
+--
+-- requested_by holds the same user id as requestImages / imageReceived.
+
+-- =========================
+-- imageAnalysis (reanalyze.py)
+-- =========================
+-- One row per image per model: reanalyze.py upserts on (image_path, model_fp),
+-- so re-running with the same model file overwrites instead of duplicating.
+create table if not exists "imageAnalysis" (
+    id            bigint generated by default as identity primary key,
+    image_path    text        not null,
+    requested_by  uuid        not null,
+    model_fp      text        not null,   -- result_cache.model_fingerprint() of the model file
+    result_path   text        not null,   -- overlay PNG in IMAGE_BUCKET
+    health_score  real        not null default 0,
+    metrics       jsonb       not null default '{}'::jsonb,
+    created_at    timestamptz not null default now()
+);
+
+create unique index if not exists "imageAnalysis_image_path_model_fp"
+    on "imageAnalysis" (image_path, model_fp);
+create index if not exists "imageAnalysis_requested_by"
+    on "imageAnalysis" (requested_by);
+
+-- =========================
+-- imageHashes (image_hash.py)
+-- =========================
+-- Upload-time fingerprints: sha256 for exact duplicates, 64-bit dHash / aHash
+-- (16 hex chars) for near duplicates. near_duplicate_of points at the image_path
+-- of the earlier upload it matched.
+create table if not exists "imageHashes" (
+    id                 bigint generated by default as identity primary key,
+    requested_by       uuid        not null,
+    image_path         text        not null,
+    sha256             text        not null,
+    dhash              text,
+    ahash              text,
+    near_duplicate_of  text,
+    created_at         timestamptz not null default now()
+);
+
+-- One row per (user, exact content). Also what makes dedup safe across workers:
+-- two concurrent uploads of the same bytes can both pass HashIndex.check(), but
+-- only one row is kept (HashIndex.add_many() skips the duplicate).
+create unique index if not exists "imageHashes_requested_by_sha256"
+    on "imageHashes" (requested_by, sha256);
+-- reanalyze.py --skip-near-duplicates
+create index if not exists "imageHashes_near_duplicates"
+    on "imageHashes" (requested_by) where near_duplicate_of is not null;
+
+-- =========================
+-- imageThumbnails (thumbnails.py)
+-- =========================
+-- Written once every derivative of an original is uploaded (upload queue or
+-- --backfill); /history/images only hands out thumbnail URLs for these rows.
+create table if not exists "imageThumbnails" (
+    image_path  text        primary key,   -- original, bucket-relative
+    thumbs      jsonb       not null,      -- {"small": "thumbs/small/....webp", "medium": ...}
+    created_at  timestamptz not null default now()
+);
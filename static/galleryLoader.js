@@ -1,35 +1,104 @@
-async function loadHistoryGallery() {
+// Pages through /history/images as the user scrolls.
+// renderImage(img) returns the element for one image; onEmpty runs if there is no history at all.
+// Calling it again on the same container starts over (stale in-flight pages are dropped).
+function loadHistoryPages(container, renderImage, { pageSize = 30, onEmpty, onError } = {}) {
+    const generation = String(Number(container.dataset.generation || 0) + 1);
+    container.dataset.generation = generation;
 
-    const container = document.getElementById("history-gallery");
+    if (container._historyObserver) container._historyObserver.disconnect();
+
+    const sentinel = document.createElement("div");
+    sentinel.className = "history-sentinel";
+
+    let cursor = null;
+    let loading = false;
+    let first = true;
+
+    const loadNext = async () => {
+        if (loading) return;
+        loading = true;
+
+        const params = new URLSearchParams({ limit: pageSize });
+        if (cursor) params.set("cursor", cursor);
+
+        try {
+            const res = await fetch(`/history/images?${params}`);
+            const data = await res.json().catch(() => ({}));
+            if (container.dataset.generation !== generation) return;
+
+            if (!res.ok) {
+                console.error(data);
+                if (onError) onError(data);
+                cursor = null;
+                observer.disconnect();
+                return;
+            }
 
-    try {
-        const res = await fetch("/history/images");
-        const data = await res.json();
+            if (first) {
+                container.innerHTML = "";
+                first = false;
+                if (!data.images || data.images.length === 0) {
+                    if (onEmpty) onEmpty();
+                    observer.disconnect();
+                    return;
+                }
+            }
 
-        if (!res.ok) {
-            console.error(data);
-            return;
+            const frag = document.createDocumentFragment();
+            (data.images || []).forEach((img) => frag.appendChild(renderImage(img)));
+            container.appendChild(frag);
+
+            cursor = data.next_cursor;
+            if (cursor) {
+                container.appendChild(sentinel);  // keep it after the last item
+            } else {
+                observer.disconnect();
+                sentinel.remove();
+            }
+        } catch (err) {
+            console.error("Gallery load failed:", err);
+            if (onError) onError(err);
+            cursor = null;
+            observer.disconnect();
+        } finally {
+            loading = false;
+        }
+
+        // Page didn't fill the viewport: the sentinel is still visible, so keep going
+        if (cursor && container.dataset.generation === generation) {
+            const r = sentinel.getBoundingClientRect();
+            if (r.top < window.innerHeight + 400) loadNext();
         }
+    };
+
+    const observer = new IntersectionObserver((entries) => {
+        if (entries.some((e) => e.isIntersecting)) loadNext();
+    }, { rootMargin: "400px" });
 
-        container.innerHTML = "";
+    container._historyObserver = observer;
+    observer.observe(sentinel);
+    loadNext();
+}
+
+async function loadHistoryGallery() {
 
-        data.images.forEach(img => {
+    const container = document.getElementById("history-gallery");
+    if (!container) return;
 
-            const item = document.createElement("div");
-            item.classList.add("history-content-gallery-item");
+    loadHistoryPages(container, (img) => {
 
-            item.innerHTML = `
-                <img src="${img.url}" class="history-image" loading="lazy">
-                <div class="history-image-meta">
-                    <p>${img.filename ?? "Image"}</p>
-                    <small>${img.uploaded_at ?? ""}</small>
-                </div>
-            `;
+        const item = document.createElement("div");
+        item.classList.add("history-content-gallery-item");
 
-            container.appendChild(item);
-        });
+        item.innerHTML = `
+            <img src="${img.thumb_url || img.url}" data-original="${img.url}" class="history-image" loading="lazy" decoding="async"
+                 onerror="if (this.src !== this.dataset.original) this.src = this.dataset.original;">
+            <div class="history-image-meta">
+                <p>${img.filename ?? "Image"}</p>
+                <small>${img.uploaded_at ?? ""}</small>
+            </div>
+        `;
 
-    } catch (err) {
-        console.error("Gallery load failed:", err);
-    }
+        return item;
+    });
 }
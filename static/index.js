@@ -145,23 +145,8 @@ async function loadHistoryGallery() {
 
   container.innerHTML = "<p>Loading...</p>";
 
-  const res = await fetch("/history/images");
-  const data = await res.json().catch(() => ({}));
-
-  if (!res.ok) {
-    console.error(data);
-    container.innerHTML = "<p>Failed to load history.</p>";
-    return;
-  }
-
-  if (!data.images || data.images.length === 0) {
-    container.innerHTML = "<p>No history yet.</p>";
-    return;
-  }
-
-  container.innerHTML = "";
-
-  data.images.forEach((img) => {
+  // Pages arrive as the user scrolls (loadHistoryPages lives in galleryLoader.js)
+  loadHistoryPages(container, (img) => {
     const ts = img.uploaded_at ? new Date(img.uploaded_at).toLocaleString() : "Unknown time";
 
     const card = document.createElement("div");
@@ -177,11 +162,15 @@ async function loadHistoryGallery() {
         <button class="history-load-btn" data-image-id="${img.id}">LOAD</button>
       </div>
       <div class="history-thumb">
-        <img src="${img.url}" loading="lazy" alt="">
+        <img src="${img.thumb_url || img.url}" data-original="${img.url}" loading="lazy" decoding="async" alt=""
+             onerror="if (this.src !== this.dataset.original) this.src = this.dataset.original;">
       </div>
     `;
 
-    container.appendChild(card);
+    return card;
+  }, {
+    onEmpty: () => { container.innerHTML = "<p>No history yet.</p>"; },
+    onError: () => { if (!container.querySelector(".history-card")) container.innerHTML = "<p>Failed to load history.</p>"; },
   });
 
   // Event delegation once
@@ -206,22 +195,77 @@ async function loadHistoryGallery() {
 // -------------------------------
 // Run analysis + update UI
 // -------------------------------
+// Resolves with the finished job (status "done" or "failed"); rejects if the
+// status endpoint can't be reached.
+// Polls the status endpoint; uses server-sent events only when the server
+// enabled them (useEvents, from the submit response) and the browser has them.
+function waitForJob(jobId, onUpdate, useEvents = false) {
+  return new Promise((resolve, reject) => {
+    const finish = (job) => {
+      if (job.status === "done" || job.status === "failed") {
+        resolve(job);
+        return true;
+      }
+      return false;
+    };
+
+    const poll = async () => {
+      while (true) {
+        const res = await fetch(`/analysis/jobs/${jobId}`);
+        const job = await res.json().catch(() => ({}));
+        if (!res.ok) return resolve({ status: "failed", error: job.error || "job lookup failed" });
+        if (onUpdate) onUpdate(job);
+        if (finish(job)) return;
+        await new Promise((r) => setTimeout(r, 1000));
+      }
+    };
+
+    if (!useEvents || !window.EventSource) {
+      poll().catch(reject);
+      return;
+    }
+
+    const es = new EventSource(`/analysis/jobs/${jobId}/events`);
+    es.addEventListener("status", (e) => {
+      const job = JSON.parse(e.data);
+      if (onUpdate) onUpdate(job);
+      if (finish(job)) es.close();
+    });
+    es.onerror = () => {
+      es.close();
+      poll().catch(reject);
+    };
+  });
+}
+
 async function runAnalysisAndShow(imageId) {
   try {
-    const res = await fetch("/analysis/run", {
+    const res = await fetch("/analysis/jobs", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ image_id: imageId }),
+      body: JSON.stringify({ image_ids: [imageId] }),
     });
 
-    const data = await res.json().catch(() => ({}));
+    const submitted = await res.json().catch(() => ({}));
 
     if (!res.ok) {
-      console.error(data);
-      alert(data.error || "Analysis failed");
+      console.error(submitted);
+      alert(submitted.error || "Analysis failed");
       return;
     }
 
+    const job = await waitForJob(submitted.jobs[0].job_id, (j) => {
+      console.log("Analysis job:", j.status, j.step || "");
+    }, submitted.events === true);
+
+    if (job.status !== "done") {
+      console.error(job);
+      alert(job.error || "Analysis failed");
+      return;
+    }
+
+    const data = job.result;
+
     // Switch active navbar button to Analysis
     if (navbarButtonActive) navbarButtonActive.classList.remove("navbar-button-active");
     if (buttonAnalysis) buttonAnalysis.classList.add("navbar-button-active");
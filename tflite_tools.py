@@ -0,0 +1,157 @@
+# tflite_tools.py
+# Convert the Keras crop model to TFLite and check the two agree.
+# Run inside the TF venv.
+#
+#   python tflite_tools.py convert --model models/CROP_MODEL.h5 --quantize int8 --calib-dir samples/
+#   python tflite_tools.py parity  --reference models/CROP_MODEL.h5 --candidate models/CROP_MODEL.tflite --images samples/
+#
+# --quantize: none (float32), float16, dynamic (int8 weights) or int8 (int8 weights +
+# activations, needs a handful of representative images via --calib-dir)
+
+import argparse
+import glob
+import json
+import os
+import time
+
+import numpy as np
+
+import inference_backends
+import preprocess
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def parse_size(size):
+    w, h = [int(v) for v in size.split(",")]
+    return w, h
+
+
+def list_images(folder, limit):
+    paths = sorted(p for p in glob.glob(os.path.join(folder, "*")) if p.lower().endswith(IMAGE_EXTS))
+    return paths[:limit]
+
+
+def sample_batches(folder, size, limit, seed=0):
+    """Yields (1, h, w, 3) float32 batches from real images, or random ones if no folder."""
+    w, h = size
+    buffers = preprocess.BatchBuffer()
+    if folder:
+        for path in list_images(folder, limit):
+            yield np.array(buffers.from_frames([preprocess.load_frame(path, size)]))
+        return
+
+    rng = np.random.default_rng(seed)
+    for _ in range(limit):
+        yield rng.random((1, h, w, 3), dtype=np.float32)
+
+
+def convert(args):
+    import tensorflow as tf
+
+    size = parse_size(args.size)
+    model = tf.keras.models.load_model(args.model, compile=False)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+
+    if args.quantize == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif args.quantize == "dynamic":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif args.quantize == "int8":
+        if not args.calib_dir:
+            print("WARNING: no --calib-dir, calibrating int8 ranges on random noise")
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([x] for x in sample_batches(args.calib_dir, size, args.calib_count))
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+
+    out_path = args.output or os.path.splitext(args.model)[0] + ".tflite"
+    t0 = time.perf_counter()
+    blob = converter.convert()
+    with open(out_path, "wb") as f:
+        f.write(blob)
+
+    print(json.dumps({
+        "output": out_path,
+        "quantize": args.quantize,
+        "bytes": len(blob),
+        "source_bytes": os.path.getsize(args.model),
+        "convert_s": round(time.perf_counter() - t0, 2),
+    }))
+
+
+def parity(args):
+    size = parse_size(args.size)
+    ref = inference_backends.load_backend(args.reference, backend=inference_backends.backend_name(args.reference, "auto"))
+    cand = inference_backends.load_backend(args.candidate, backend=inference_backends.backend_name(args.candidate, "auto"))
+
+    agree = 0
+    n = 0
+    max_abs = 0.0
+    sum_abs = 0.0
+    t_ref = t_cand = 0.0
+
+    for x in sample_batches(args.images, size, args.count):
+        t0 = time.perf_counter()
+        a = ref.predict(x)
+        t1 = time.perf_counter()
+        b = cand.predict(x)
+        t2 = time.perf_counter()
+        t_ref += t1 - t0
+        t_cand += t2 - t1
+
+        diff = np.abs(a.astype(np.float32) - b.astype(np.float32))
+        max_abs = max(max_abs, float(diff.max()))
+        sum_abs += float(diff.mean())
+        if a.ndim == 2:
+            agree += int(np.argmax(a[0]) == np.argmax(b[0]))
+        n += 1
+
+    if n == 0:
+        raise SystemExit("no sample images found")
+
+    report = {
+        "samples": n,
+        "top1_agreement": round(agree / n, 4),
+        "max_abs_diff": round(max_abs, 6),
+        "mean_abs_diff": round(sum_abs / n, 6),
+        "reference_ms": round(t_ref / n * 1000, 2),
+        "candidate_ms": round(t_cand / n * 1000, 2),
+    }
+    print(json.dumps(report, indent=2))
+
+    if report["top1_agreement"] < args.min_agreement:
+        raise SystemExit(f"parity FAILED: top-1 agreement {report['top1_agreement']} < {args.min_agreement}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    c = sub.add_parser("convert")
+    c.add_argument("--model", required=True)
+    c.add_argument("--output", default=None)
+    c.add_argument("--size", default=os.getenv("MODEL_INPUT_SIZE", "224,224"))
+    c.add_argument("--quantize", choices=["none", "float16", "dynamic", "int8"], default="none")
+    c.add_argument("--calib-dir", default=None)
+    c.add_argument("--calib-count", type=int, default=100)
+
+    p = sub.add_parser("parity")
+    p.add_argument("--reference", required=True)
+    p.add_argument("--candidate", required=True)
+    p.add_argument("--images", default=None)  # folder of sample images; random noise if omitted
+    p.add_argument("--count", type=int, default=50)
+    p.add_argument("--size", default=os.getenv("MODEL_INPUT_SIZE", "224,224"))
+    p.add_argument("--min-agreement", type=float, default=0.98)
+
+    args = ap.parse_args()
+    if args.cmd == "convert":
+        convert(args)
+    else:
+        parity(args)
+
+
+if __name__ == "__main__":
+    main()
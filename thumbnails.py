@@ -0,0 +1,234 @@
+# thumbnails.py
+# Small / medium derivatives of uploaded field photos for the history gallery.
+#
+# Derivatives live at a predictable path next to the originals in IMAGE_BUCKET:
+#   <user>/<date>/<name>.jpg  ->  thumbs/small/<user>/<date>/<name>.webp
+#                                 thumbs/medium/<user>/<date>/<name>.webp
+# Which originals actually have them is recorded in the imageThumbnails table
+# (DDL in schema.sql) once every size is uploaded; /history/images only hands out
+# a thumbnail URL for those (ThumbnailRegistry) and the original otherwise.
+#
+# Uploads schedule generation on a small background pool (ThumbnailQueue).
+# Existing images:  python thumbnails.py --backfill [--user <user_id>] [--table requestImages]
+
+import argparse
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cachetools import LRUCache
+
+THUMB_SIZES = {
+    name: int(px)
+    for name, px in (item.split(":") for item in os.getenv("THUMB_SIZES", "small:320,medium:1280").split(","))
+}
+THUMB_FORMAT = os.getenv("THUMB_FORMAT", "WEBP").upper()   # WEBP or JPEG
+THUMB_QUALITY = int(os.getenv("THUMB_QUALITY", "80"))
+THUMB_WORKERS = int(os.getenv("THUMB_WORKERS", "2"))
+THUMB_REGISTRY_CACHE = int(os.getenv("THUMB_REGISTRY_CACHE", "20000"))   # originals remembered as having thumbnails
+THUMB_TABLE = "imageThumbnails"
+
+_EXT = {"WEBP": ".webp", "JPEG": ".jpg"}
+_MIME = {"WEBP": "image/webp", "JPEG": "image/jpeg"}
+
+
+def thumb_path(original_path, size_name, fmt=THUMB_FORMAT):
+    stem = os.path.splitext(original_path)[0]
+    return f"thumbs/{size_name}/{stem}{_EXT[fmt]}"
+
+
+def thumb_paths(original_path):
+    return {name: thumb_path(original_path, name) for name in THUMB_SIZES}
+
+
+def generate(src, sizes=THUMB_SIZES, fmt=THUMB_FORMAT, quality=THUMB_QUALITY):
+    """
+    src: path, bytes or file-like.
+    Decodes once (JPEG draft at the largest target), then shrinks largest -> smallest.
+    Returns: {size_name: encoded_bytes}
+    """
+    from PIL import Image, ImageOps
+
+    if isinstance(src, (bytes, bytearray)):
+        src = io.BytesIO(src)
+    img = Image.open(src)
+
+    largest = max(sizes.values())
+    if img.format == "JPEG":
+        img.draft("RGB", (largest, largest))
+    img = ImageOps.exif_transpose(img)  # phone/drone EXIF rotation
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    out = {}
+    for name, px in sorted(sizes.items(), key=lambda kv: -kv[1]):
+        img.thumbnail((px, px), Image.LANCZOS)
+        buf = io.BytesIO()
+        if fmt == "WEBP":
+            img.save(buf, fmt, quality=quality, method=4)
+        else:
+            img.save(buf, fmt, quality=quality, optimize=True, progressive=True)
+        out[name] = buf.getvalue()
+    return out
+
+
+def store(storage, original_path, src):
+    """Generate + upload every derivative for one original. Returns {size_name: path}."""
+    written = {}
+    # Smallest first, largest last: the largest one existing means the set is complete
+    for name, data in sorted(generate(src).items(), key=lambda kv: THUMB_SIZES[kv[0]]):
+        path = thumb_path(original_path, name)
+        storage.upload(
+            path=path,
+            file=data,
+            file_options={"content-type": _MIME[THUMB_FORMAT], "upsert": "true"},
+        )
+        written[name] = path
+    return written
+
+
+class ThumbnailRegistry:
+    """
+    imageThumbnails rows: original image_path -> {size_name: derivative path}.
+    Rows are only ever added (derivatives aren't deleted), so known originals are
+    cached in memory and only unknown ones are looked up.
+    """
+
+    def __init__(self, supabase, max_known=THUMB_REGISTRY_CACHE):
+        self.supabase = supabase
+        self._known = LRUCache(maxsize=max_known)
+        self._lock = threading.Lock()
+
+    def record(self, original_path, written):
+        self.supabase.table(THUMB_TABLE).upsert(
+            {"image_path": original_path, "thumbs": written}, on_conflict="image_path"
+        ).execute()
+        with self._lock:
+            self._known[original_path] = written
+
+    def lookup(self, original_paths):
+        """{original_path: {size_name: path}} for the originals whose derivatives exist."""
+        with self._lock:
+            found = {p: self._known[p] for p in original_paths if p in self._known}
+        missing = [p for p in set(original_paths) if p not in found]
+        if missing:
+            rows = (
+                self.supabase.table(THUMB_TABLE)
+                .select("image_path, thumbs")
+                .in_("image_path", missing)
+                .execute()
+            ).data or []
+            with self._lock:
+                for r in rows:
+                    self._known[r["image_path"]] = found[r["image_path"]] = r["thumbs"]
+        return found
+
+
+class ThumbnailQueue:
+    """Background derivative generation so uploads return as soon as the original is stored."""
+
+    def __init__(self, storage_factory, workers=THUMB_WORKERS, on_stored=None):
+        """on_stored(original_path, {size_name: path}) runs once every derivative is uploaded."""
+        self._storage_factory = storage_factory
+        self._on_stored = on_stored
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbs")
+        self._lock = threading.Lock()
+        self.done = 0
+        self.failed = 0
+
+    def schedule(self, original_path, src_path, delete_after=True):
+        """src_path is a local file; with delete_after the queue owns it and removes it."""
+        self._executor.submit(self._run, original_path, src_path, delete_after)
+
+    def _run(self, original_path, src_path, delete_after):
+        try:
+            written = store(self._storage_factory(), original_path, src_path)
+            if self._on_stored:
+                self._on_stored(original_path, written)
+            with self._lock:
+                self.done += 1
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            print("THUMBNAIL FAILED:", original_path, e)
+        finally:
+            if delete_after:
+                try:
+                    os.remove(src_path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        return {"done": self.done, "failed": self.failed}
+
+
+# =========================
+# BACKFILL
+# =========================
+PATH_COLUMN = {"imageReceived": "uploaded_at", "requestImages": "image_path"}
+
+
+def backfill(args):
+    import requests
+    from supabase import create_client
+
+    supabase_url = os.getenv("SUPABASE_URL")
+    bucket = os.getenv("SUPABASE_IMAGE_BUCKET", "image_transmission")
+    supabase = create_client(supabase_url, os.getenv("SUPABASE_KEY"))
+    storage = supabase.storage.from_(bucket)
+    registry = ThumbnailRegistry(supabase)
+    public_base = f"{supabase_url}/storage/v1/object/public/{bucket}/"
+    column = PATH_COLUMN[args.table]
+
+    session = requests.Session()
+    counts = {"created": 0, "skipped": 0, "failed": 0}
+    lock = threading.Lock()
+
+    def one(original_path):
+        try:
+            # store() writes the largest derivative last
+            largest = max(THUMB_SIZES, key=THUMB_SIZES.get)
+            if not args.force and session.head(public_base + thumb_path(original_path, largest), timeout=20).ok:
+                registry.record(original_path, thumb_paths(original_path))   # made before rows were recorded
+                key = "skipped"
+            else:
+                r = session.get(public_base + original_path, timeout=60)
+                r.raise_for_status()
+                registry.record(original_path, store(storage, original_path, r.content))
+                key = "created"
+        except Exception as e:
+            print("FAILED", original_path, e)
+            key = "failed"
+        with lock:
+            counts[key] += 1
+
+    start = 0
+    page = 500
+    with ThreadPoolExecutor(max_workers=args.workers) as ex:
+        while True:
+            q = supabase.table(args.table).select(column)
+            if args.user:
+                q = q.eq("requested_by", args.user)
+            rows = q.order(column).range(start, start + page - 1).execute().data or []
+            list(ex.map(one, [r[column] for r in rows if r.get(column)]))
+            print(counts)
+            if len(rows) < page:
+                break
+            start += page
+
+    print("DONE", counts)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--backfill", action="store_true", required=True)
+    ap.add_argument("--user", default=None)
+    ap.add_argument("--table", choices=sorted(PATH_COLUMN), default="imageReceived")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--force", action="store_true", help="regenerate even if thumbnails exist")
+    backfill(ap.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# tiling.py
+# Tiled sliding-window inference for full-resolution drone photos.
+# The image is cut into overlapping model-sized tiles, tiles are run through the
+# model in vectorized batches, and per-tile scores are stitched into a heatmap.
+
+import os
+
+import numpy as np
+import cv2
+
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", "0.25"))   # fraction of a tile shared with its neighbour
+TILE_MAX = int(os.getenv("TILE_MAX", "64"))                # upper bound on tiles per image
+TILE_BATCH = int(os.getenv("TILE_BATCH", "16"))            # tiles per predict() call
+OVERLAY_MAX_SIDE = int(os.getenv("OVERLAY_MAX_SIDE", "1600"))
+
+# An image always has at least one tile, so fit_to_budget() could never get under 0
+if TILE_MAX < 1:
+    raise ValueError(f"TILE_MAX must be >= 1, got {TILE_MAX}")
+if not 0.0 <= TILE_OVERLAP < 1.0:
+    raise ValueError(f"TILE_OVERLAP must be in [0, 1), got {TILE_OVERLAP}")
+
+
+def _axis_starts(length, tile, stride):
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile + 1, stride))
+    if starts[-1] != length - tile:
+        starts.append(length - tile)  # last tile flush with the edge
+    return starts
+
+
+def tile_grid(h, w, tile_h, tile_w, overlap=TILE_OVERLAP):
+    sy = max(1, int(tile_h * (1.0 - overlap)))
+    sx = max(1, int(tile_w * (1.0 - overlap)))
+    return [(y, x) for y in _axis_starts(h, tile_h, sy) for x in _axis_starts(w, tile_w, sx)]
+
+
+def fit_to_budget(img_rgb, tile_h, tile_w, overlap=TILE_OVERLAP, max_tiles=TILE_MAX):
+    """Downscale until the tile grid fits in max_tiles, so cost per image stays bounded."""
+    h, w = img_rgb.shape[:2]
+    max_tiles = max(1, max_tiles)
+    scale = 1.0
+    while len(tile_grid(int(h * scale), int(w * scale), tile_h, tile_w, overlap)) > max_tiles:
+        scale *= 0.9
+    if scale < 1.0:
+        img_rgb = cv2.resize(img_rgb, (max(tile_w, int(w * scale)), max(tile_h, int(h * scale))),
+                             interpolation=cv2.INTER_AREA)
+    return img_rgb, scale
+
+
+def extract_tiles(img_rgb, origins, tile_h, tile_w):
+    """Returns an (N, tile_h, tile_w, 3) float32 batch scaled to [0, 1]."""
+    h, w = img_rgb.shape[:2]
+    if h < tile_h or w < tile_w:
+        img_rgb = cv2.copyMakeBorder(img_rgb, 0, max(0, tile_h - h), 0, max(0, tile_w - w),
+                                     cv2.BORDER_REFLECT)
+
+    # Zero-copy (N, th, tw, 3) view over all window positions, then gather ours
+    windows = np.lib.stride_tricks.sliding_window_view(img_rgb, (tile_h, tile_w, 3))[:, :, 0]
+    ys = np.array([o[0] for o in origins])
+    xs = np.array([o[1] for o in origins])
+
+    out = np.empty((len(origins), tile_h, tile_w, 3), dtype=np.float32)
+    np.multiply(windows[ys, xs], 1.0 / 255.0, out=out, casting="unsafe")
+    return out
+
+
+def predict_tiles(predict_fn, tiles, batch=TILE_BATCH):
+    preds = [predict_fn(tiles[i:i + batch]) for i in range(0, len(tiles), batch)]
+    return np.concatenate(preds, axis=0)
+
+
+def tile_scores(preds):
+    """Per-tile (class, confidence). Non-classification outputs fall back to their mean."""
+    if preds.ndim == 2:
+        return np.argmax(preds, axis=1), np.max(preds, axis=1)
+    flat = preds.reshape(len(preds), -1)
+    return np.zeros(len(preds), dtype=np.int64), flat.mean(axis=1)
+
+
+def stitch_heatmap(shape, origins, tile_h, tile_w, scores, max_side=OVERLAY_MAX_SIDE):
+    """Average overlapping tile scores into an (h', w') float32 map at overlay resolution."""
+    h, w = shape
+    s = min(1.0, max_side / float(max(h, w)))
+    oh, ow = max(1, int(round(h * s))), max(1, int(round(w * s)))
+
+    acc = np.zeros((oh, ow), dtype=np.float32)
+    cnt = np.zeros((oh, ow), dtype=np.float32)
+    for (y, x), score in zip(origins, scores):
+        y0, x0 = int(y * s), int(x * s)
+        y1, x1 = min(oh, int((y + tile_h) * s) + 1), min(ow, int((x + tile_w) * s) + 1)
+        acc[y0:y1, x0:x1] += score
+        cnt[y0:y1, x0:x1] += 1.0
+
+    np.divide(acc, cnt, out=acc, where=cnt > 0)
+    return acc
+
+
+def render_overlay(img_rgb, heatmap, alpha=0.45):
+    """Blend a JET-coloured heatmap over the image. Returns BGR uint8."""
+    oh, ow = heatmap.shape
+    base = cv2.resize(img_rgb, (ow, oh), interpolation=cv2.INTER_AREA)
+    base = cv2.cvtColor(base, cv2.COLOR_RGB2BGR)
+    heat = cv2.applyColorMap(np.clip(heatmap * 255.0, 0, 255).astype(np.uint8), cv2.COLORMAP_JET)
+    return cv2.addWeighted(heat, alpha, base, 1.0 - alpha, 0)
+
+
+def analyze_tiled(predict_fn, img_rgb, size, overlap=TILE_OVERLAP, max_tiles=TILE_MAX, batch=TILE_BATCH):
+    """
+    img_rgb: full-resolution HxWx3 uint8
+    size: model input (w, h)
+    Returns: (overlay_bgr, metrics_dict)
+    """
+    tile_w, tile_h = size
+    work, scale = fit_to_budget(img_rgb, tile_h, tile_w, overlap, max_tiles)
+    origins = tile_grid(work.shape[0], work.shape[1], tile_h, tile_w, overlap)
+
+    preds = predict_tiles(predict_fn, extract_tiles(work, origins, tile_h, tile_w), batch)
+    classes, scores = tile_scores(preds)
+
+    heatmap = stitch_heatmap(work.shape[:2], origins, tile_h, tile_w, scores)
+    out = render_overlay(work, heatmap)
+
+    mean_score = float(np.mean(scores))
+    metrics = {
+        "health_score": int(mean_score * 100),
+        "tiles": len(origins),
+        "tile_scale": round(scale, 4),
+        "min_tile_score": float(np.min(scores)),
+        "max_tile_score": float(np.max(scores)),
+        "class_counts": {str(int(c)): int(n) for c, n in zip(*np.unique(classes, return_counts=True))},
+    }
+    cv2.putText(out, f"tiles={len(origins)} health={metrics['health_score']}", (10, 30),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+    return out, metrics
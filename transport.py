@@ -0,0 +1,211 @@
+# transport.py
+# Shared outbound HTTP for the web app: Supabase (PostgREST + storage) and plain
+# downloads of bucket objects.
+#
+# - per-call timeouts everywhere (nothing waits on a socket forever)
+# - one pooled requests.Session for object downloads instead of a fresh
+#   connection + TLS handshake per analysis
+# - retries with jittered exponential backoff (tenacity) for idempotent calls
+#   only: selects, GETs. Inserts/uploads are never retried blindly.
+# - a circuit breaker per backend: after BREAKER_FAILURES transient failures in
+#   a row, calls fail fast with CircuitOpen (-> 503 + Retry-After) for
+#   BREAKER_RESET_SECONDS, then one trial call decides whether to close again.
+#   A degraded Supabase costs a worker milliseconds instead of a 30 s timeout.
+
+import os
+import threading
+import time
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))                # attempts, including the first
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "4"))      # seconds, cap per wait
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+
+class CircuitOpen(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} unavailable (circuit open)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class TransientHTTPError(Exception):
+    """A 5xx/429 from a backend, raised so it can be retried and counted by the breaker."""
+
+    def __init__(self, response):
+        super().__init__(f"{response.status_code} from {response.url}")
+        self.response = response
+
+
+class CircuitBreaker:
+    def __init__(self, name, failures=BREAKER_FAILURES, reset_seconds=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._consecutive = 0
+        self._opened_at = None
+        self._trial = False
+        self.rejected = 0
+        self.trips = 0
+
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_seconds:
+                return "half_open"
+            return "open"
+
+    def before(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            waited = time.monotonic() - self._opened_at
+            # Half-open: let exactly one caller through to probe the backend
+            if waited >= self.reset_seconds and not self._trial:
+                self._trial = True
+                return
+            self.rejected += 1
+            raise CircuitOpen(self.name, max(1, int(self.reset_seconds - waited)))
+
+    def success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._consecutive += 1
+            if self._trial or self._consecutive >= self.failures:
+                if self._opened_at is None or self._trial:
+                    self.trips += 1
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+    def call(self, fn):
+        self.before()
+        try:
+            result = fn()
+        except Exception as e:
+            if is_transient(e):
+                self.failure()
+            else:
+                self.success()  # the backend answered; a 4xx is the caller's problem
+            raise
+        self.success()
+        return result
+
+    def stats(self):
+        return {"state": self.state(), "consecutive_failures": self._consecutive,
+                "trips": self.trips, "rejected": self.rejected}
+
+
+SUPABASE = CircuitBreaker("supabase")
+STORAGE = CircuitBreaker("storage")
+
+
+# PostgREST's own codes for "database unreachable / timed out" (sent as 503 / 504)
+_POSTGREST_UNAVAILABLE = {"PGRST000", "PGRST001", "PGRST002", "PGRST003"}
+
+
+def http_status(exc):
+    """The HTTP status behind a backend exception, or None if it doesn't carry one."""
+    status = getattr(getattr(exc, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status
+    status = getattr(exc, "status", None)   # storage3.StorageApiError
+    if isinstance(status, int):
+        return status
+    # postgrest.APIError.code is a Postgres / PostgREST error code ("23505",
+    # "PGRST116"), not a status -- except when the reply wasn't JSON (a gateway
+    # error page), where postgrest puts the HTTP status there instead
+    if getattr(exc, "message", None) == "JSON could not be generated":
+        code = str(getattr(exc, "code", "") or "")
+        return int(code) if code.isdigit() else None
+    return None
+
+
+def is_transient(exc):
+    if isinstance(exc, (TransientHTTPError, httpx.TransportError,
+                        requests.ConnectionError, requests.Timeout)):
+        return True
+    if getattr(exc, "code", None) in _POSTGREST_UNAVAILABLE:
+        return True
+    status = http_status(exc)
+    return status is not None and (status >= 500 or status == 429)
+
+
+def guarded(fn, retry=False, breaker=SUPABASE):
+    """
+    Run fn() behind `breaker`. retry=True only for idempotent operations:
+    transient failures are retried HTTP_RETRIES times with jittered backoff.
+    """
+    if not retry:
+        return breaker.call(fn)
+    for attempt in Retrying(
+        stop=stop_after_attempt(HTTP_RETRIES),
+        wait=wait_random_exponential(multiplier=0.2, max=HTTP_BACKOFF_MAX),
+        retry=retry_if_exception(is_transient),   # CircuitOpen is not: stop at once
+        reraise=True,
+    ):
+        with attempt:
+            return breaker.call(fn)
+
+
+def execute(query, retry=True):
+    """query.execute() for a PostgREST builder; selects are safe to retry."""
+    return guarded(query.execute, retry=retry)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _session = s
+    return _session
+
+
+def http_get(url, timeout=None, breaker=STORAGE):
+    """Pooled, retried GET. Raises TransientHTTPError on 5xx/429 after the last attempt."""
+    timeout = timeout or (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+    def once():
+        r = get_session().get(url, timeout=timeout)
+        if r.status_code >= 500 or r.status_code == 429:
+            raise TransientHTTPError(r)
+        return r
+
+    return guarded(once, retry=True, breaker=breaker)
+
+
+def supabase_options():
+    """ClientOptions with explicit PostgREST/storage timeouts instead of the library defaults."""
+    from supabase import ClientOptions
+
+    return ClientOptions(
+        postgrest_client_timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        storage_client_timeout=int(HTTP_READ_TIMEOUT * 2),   # uploads of large originals
+    )
+
+
+def stats():
+    return {"supabase": SUPABASE.stats(), "storage": STORAGE.stats()}
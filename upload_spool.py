@@ -0,0 +1,174 @@
+# upload_spool.py
+# Chunked handling of device image uploads, so a 20 MB drone photo never sits
+# in a gunicorn worker's memory as one bytes object.
+#
+# - spool_stream(): copy a request/file stream to disk in fixed-size chunks,
+#   enforcing a size cap as it goes
+# - UploadSessions: resumable (TUS-style) uploads. The device creates a session,
+#   PATCHes chunks at an explicit offset, and after a dropped LTE connection asks
+#   for the current offset and continues from there instead of resending.
+#   Session state lives on disk (UPLOAD_SPOOL_DIR) so every worker on the box
+#   sees it and it survives restarts.
+
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:   # Windows dev server: single process, the per-upload thread lock is enough
+    fcntl = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(256 * 1024)))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(40 * 1024 * 1024)))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "agrivision_uploads"))
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class OffsetMismatch(Exception):
+    def __init__(self, expected):
+        super().__init__(f"expected offset {expected}")
+        self.expected = expected
+
+
+def spool_stream(stream, dest, max_bytes=UPLOAD_MAX_BYTES, chunk_bytes=UPLOAD_CHUNK_BYTES, already=0):
+    """
+    Copy stream -> dest (a binary file) chunk by chunk.
+    Raises UploadTooLarge as soon as already + copied exceeds max_bytes.
+    Returns bytes copied.
+    """
+    copied = 0
+    while True:
+        chunk = stream.read(chunk_bytes)
+        if not chunk:
+            return copied
+        copied += len(chunk)
+        if already + copied > max_bytes:
+            raise UploadTooLarge(f"upload exceeds {max_bytes} bytes")
+        dest.write(chunk)
+
+
+def spool_to_tempfile(stream, max_bytes=UPLOAD_MAX_BYTES):
+    """Spool a stream to a named temp file. Returns (path, size); caller deletes path."""
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=UPLOAD_SPOOL_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            size = spool_stream(stream, f, max_bytes)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, size
+
+
+class UploadSessions:
+    def __init__(self, root=UPLOAD_SPOOL_DIR, ttl=UPLOAD_SESSION_TTL):
+        self.root = root
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._locks = {}      # upload_id -> lock for its appends in this process
+        os.makedirs(root, exist_ok=True)
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.root, f"{upload_id}.json")
+
+    def data_path(self, upload_id):
+        return os.path.join(self.root, f"{upload_id}.part")
+
+    def create(self, user_id, filename, size, content_type):
+        if size > UPLOAD_MAX_BYTES:
+            raise UploadTooLarge(f"upload exceeds {UPLOAD_MAX_BYTES} bytes")
+
+        self.prune()
+        upload_id = uuid.uuid4().hex
+        meta = {
+            "upload_id": upload_id,
+            "user_id": user_id,
+            "filename": filename,
+            "size": int(size),
+            "content_type": content_type,
+            "created_at": time.time(),
+        }
+        open(self.data_path(upload_id), "wb").close()
+        with open(self._meta_path(upload_id), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        return self.status(upload_id)
+
+    def get(self, upload_id):
+        # upload ids are hex uuids; anything else never touches the filesystem
+        if not upload_id or not all(c in "0123456789abcdef" for c in upload_id):
+            return None
+        try:
+            with open(self._meta_path(upload_id), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def offset(self, upload_id):
+        try:
+            return os.path.getsize(self.data_path(upload_id))
+        except OSError:
+            return 0
+
+    def status(self, upload_id):
+        meta = self.get(upload_id)
+        if meta is None:
+            return None
+        offset = self.offset(upload_id)
+        return {**meta, "offset": offset, "complete": offset >= meta["size"], "chunk_size": UPLOAD_CHUNK_BYTES}
+
+    def _upload_lock(self, upload_id):
+        with self._lock:
+            return self._locks.setdefault(upload_id, threading.Lock())
+
+    def append(self, upload_id, offset, stream):
+        """
+        Write the chunk in `stream` at `offset`. Returns the new offset.
+        The spool file is flock()ed (and held under a per-upload thread lock, for
+        platforms without flock) for the check and the write, so a retried PATCH
+        that lands on another worker while the first is still writing sees the
+        offset move instead of writing the chunk twice. Other uploads never wait.
+        """
+        meta = self.get(upload_id)
+        with self._upload_lock(upload_id), open(self.data_path(upload_id), "ab") as f:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                current = os.fstat(f.fileno()).st_size
+                if offset != current:
+                    raise OffsetMismatch(current)
+                spool_stream(stream, f, max_bytes=meta["size"], already=current)
+                f.flush()
+                return os.fstat(f.fileno()).st_size
+            finally:
+                if fcntl:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def discard(self, upload_id):
+        with self._lock:
+            self._locks.pop(upload_id, None)
+        for p in (self.data_path(upload_id), self._meta_path(upload_id)):
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+    def prune(self):
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.root):
+            if name.endswith(".json"):
+                path = os.path.join(self.root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        self.discard(name[:-5])
+                except OSError:
+                    pass